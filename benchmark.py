@@ -0,0 +1,356 @@
+import typer
+from typing import List, Optional
+from typing_extensions import Annotated
+import os
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import sys
+import platform
+import numpy as np
+from osgeo import gdal, osr
+from pydelatin import Delatin
+from monique_helper.terramesh import MeshGrid
+from monique_helper.rtin import RTIN
+from monique_helper.io import load_tile_json
+from monique_helper.terrain import read_terrain
+from monique_helper.raycast import RaycastEngine, create_raycaster
+from monique_helper.transforms import stack_cameras, img2ray
+from monique_helper.instrument import PROFILER
+
+gdal.UseExceptions()
+
+app = typer.Typer()
+
+@app.callback()
+def callback():
+    #keeps the name of the subcommands even if only one command is available
+    pass
+
+def fractal_heights(size, res=1, seed=0, beta=3.2, relief=1000, holes=0.05):
+
+    #power law noise (spectral synthesis) resembling alpine terrain; holes are elliptic nodata patches
+    #covering approximately the given fraction of the DTM
+    rng = np.random.default_rng(seed)
+
+    kx = np.fft.fftfreq(size).reshape(1, -1)
+    ky = np.fft.fftfreq(size).reshape(-1, 1)
+    k = np.sqrt(kx**2 + ky**2)
+    k[0, 0] = 1
+
+    amp = k**(-beta/2.)
+    amp[0, 0] = 0
+    spec = amp * np.exp(2j * np.pi * rng.random((size, size)))
+
+    heights = np.real(np.fft.ifft2(spec))
+    heights = (heights - heights.min()) / (heights.max() - heights.min()) * relief + 500
+    heights = heights.astype(np.float32)
+
+    if holes > 0:
+        rr, cc = np.ogrid[0:size, 0:size]
+        covered = 0
+        while covered < holes:
+            r0, c0 = rng.integers(0, size, 2)
+            ar, ac = rng.integers(max(2, size//64), max(3, size//12), 2)
+            in_hole = ((rr - r0) / ar)**2 + ((cc - c0) / ac)**2 <= 1
+            heights[in_hole] = np.nan
+            covered = np.count_nonzero(np.isnan(heights)) / heights.size
+
+    return heights
+
+def write_geotiff(path, arr, gt, epsg, nd=None, gdal_type=gdal.GDT_Float32):
+    arr = np.atleast_3d(arr)
+    driver = gdal.GetDriverByName("GTiff")
+    ds = driver.Create(path, arr.shape[1], arr.shape[0], arr.shape[2], gdal_type, options=["TILED=YES"])
+    ds.SetGeoTransform(gt)
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(int(epsg))
+    ds.SetProjection(srs.ExportToWkt())
+
+    for bx in range(arr.shape[2]):
+        band = ds.GetRasterBand(bx+1)
+        if nd is not None:
+            band.SetNoDataValue(nd)
+        band.WriteArray(arr[:, :, bx])
+    ds = None
+
+def synthetic_dtm(path, size, res=1, seed=0, holes=0.05, epsg=31287, origin=(400000, 300000)):
+    heights = fractal_heights(size, res=res, seed=seed, holes=holes)
+    heights[np.isnan(heights)] = -9999
+    gt = (origin[0], res, 0, origin[1] + size * res, 0, -res)
+    write_geotiff(path, heights, gt, epsg, nd=-9999)
+    return heights, gt
+
+def synthetic_ortho(path, heights, gt, epsg, op_res):
+
+    #simple hillshade colored by height; only used to provide realistic textures for add-ortho
+    scale = int(max(1, round(gt[1] / op_res)))
+    valid = heights != -9999
+    h = np.where(valid, heights, np.min(heights[valid]))
+
+    gy, gx = np.gradient(h, gt[1])
+    shade = np.clip((gx - gy) / np.sqrt(gx**2 + gy**2 + 1) * 0.5 + 0.5, 0, 1)
+    rel = (h - h.min()) / max(np.ptp(h), 1)
+
+    rgb = np.stack((0.3 + 0.6 * rel, 0.5 + 0.3 * rel, 0.3 + 0.2 * rel), axis=-1) * shade[:, :, None] * 255
+    rgb = np.repeat(np.repeat(rgb.astype(np.uint8), scale, axis=0), scale, axis=1)
+
+    op_gt = (gt[0], gt[1] / scale, 0, gt[3], 0, gt[5] / scale)
+    write_geotiff(path, rgb, op_gt, epsg, gdal_type=gdal.GDT_Byte)
+
+def synthetic_cameras(tiles_data, nr_cams, img_w, img_h, hfov=np.deg2rad(60)):
+
+    #cameras are distributed on a circle around the region above the terrain looking inwards
+    min_xyz = np.array(tiles_data["min_xyz"])
+    max_xyz = np.array(tiles_data["max_xyz"])
+    cx = (min_xyz + max_xyz) / 2.
+    rad = np.min(max_xyz[:2] - min_xyz[:2]) * 0.45
+
+    f = (img_w / 2.) / np.tan(hfov / 2.)
+
+    cam_dict = {}
+    for ix, alpha in enumerate(np.linspace(0, 2*np.pi, nr_cams, endpoint=False)):
+        cam_dict["cam_%i" % (ix)] = {"obj_x0":cx[0] + rad * np.cos(alpha),
+                                     "obj_y0":cx[1] + rad * np.sin(alpha),
+                                     "obj_z0":max_xyz[2] + 100,
+                                     "alpha":alpha, "zeta":np.deg2rad(65), "kappa":0.,
+                                     "img_x0":img_w / 2., "img_y0":-img_h / 2., "f":f,
+                                     "img_w":img_w, "img_h":img_h,
+                                     "hfov":hfov, "vfov":2 * np.arctan((img_h / 2.) / f)}
+    return cam_dict
+
+def camera_rays(cam, min_xyz, stride=1):
+    prc, rmat, ior = stack_cameras([cam])
+
+    cols = np.arange(0, cam["img_w"], stride) + 0.5
+    rows = -(np.arange(0, cam["img_h"], stride) + 0.5)
+    img_x, img_y = np.meshgrid(cols, rows)
+    img_xy = np.column_stack((img_x.ravel(), img_y.ravel()))
+
+    dirs = img2ray(img_xy, rmat[0, :, :], ior[0, :])
+    return np.hstack((np.broadcast_to(prc[0, :] - np.array(min_xyz), np.shape(dirs)), dirs))
+
+def render_cameras(tiles_data, tiles_arrays, cam_dict):
+
+    import pygfx as gfx
+    from wgpu.gui.offscreen import WgpuCanvas as OffscreenCanvas
+    from monique_helper.render import create_scene, camera_from_gpkg, terrain_from_arrays
+
+    with PROFILER.stage("render_setup"):
+        gfx_scene = create_scene(terrain_from_arrays(tiles_data, tiles_arrays))
+
+    img_w = list(cam_dict.values())[0]["img_w"]
+    img_h = list(cam_dict.values())[0]["img_h"]
+
+    with PROFILER.stage("render", cameras=len(cam_dict), pixels=len(cam_dict) * img_w * img_h) as stage:
+        canvas = OffscreenCanvas(size=(img_w, img_h), pixel_ratio=1)
+        renderer = gfx.WgpuRenderer(canvas, pixel_ratio=1)
+
+        #the first frame includes pipeline creation and the texture upload
+        first = None
+        for cid, data in cam_dict.items():
+            t0 = time.perf_counter()
+            gfx_camera = camera_from_gpkg(data, tiles_data["min_xyz"], padding=0)
+            canvas.request_draw(renderer.render(gfx_scene, gfx_camera))
+            np.asarray(canvas.draw())
+            if first is None:
+                first = time.perf_counter() - t0
+        stage.rec["first_frame_s"] = round(first, 4)
+
+@app.command()
+def pipeline(out_path:Annotated[str, typer.Argument(help="Path to the *.json the benchmark results are written to.")],
+             size:Annotated[int, typer.Option(help="Width and height of the synthetic DTM in pixels.")] = 2048,
+             res:Annotated[float, typer.Option(help="Resolution of the synthetic DTM.")] = 1,
+             holes:Annotated[float, typer.Option(help="Fraction of the DTM covered by nodata holes.")] = 0.05,
+             seed:Annotated[int, typer.Option(help="Seed of the synthetic terrain.")] = 0,
+             max_error:Annotated[float, typer.Option(help="Maximum error of the simplified mesh.")] = 1,
+             max_triangles:Annotated[int, typer.Option(help="Maximum number of triangles of each tile.")] = None,
+             method:Annotated[str, typer.Option(help="Simplification of the tiles (delatin or martini).")] = "delatin",
+             tile_size:Annotated[int, typer.Option(help="Size of each tile in pixels.")] = 256,
+             op_res:Annotated[float, typer.Option(help="Resolution of the orthophoto tiles.")] = 1,
+             cams:Annotated[int, typer.Option(help="Number of synthetic cameras rendered and cast.")] = 4,
+             img_size:Annotated[int, typer.Option(help="Width of the rendered images; the height is 2/3 of it.")] = 1200,
+             ray_stride:Annotated[int, typer.Option(help="Only every n-th pixel of each camera is cast.")] = 1,
+             engine:Annotated[RaycastEngine, typer.Option(case_sensitive=False)] = RaycastEngine.mesh,
+             render:Annotated[bool, typer.Option(help="Include the offscreen rendering stages.")] = True,
+             work_dir:Annotated[str, typer.Option(help="Directory for the synthetic data. If None a temporary directory is used and removed afterwards.")] = None):
+
+    #stages which are run: load, simplify, snapping, save, add-ortho, terrain_load, render_setup, render, raycast_setup, raycast
+    keep_dir = work_dir is not None
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="monique_bench_")
+    elif os.path.exists(work_dir):
+        raise typer.Exit("%s already exists." % (work_dir))
+    else:
+        os.makedirs(work_dir)
+
+    #the stages are recorded by the instrumentation of the pipeline itself; only rendering and casting
+    #of the synthetic cameras is recorded here
+    PROFILER.enable(command="benchmark pipeline")
+
+    try:
+        print("Creating synthetic data...")
+        dtm_path = os.path.join(work_dir, "dtm.tif")
+        op_path = os.path.join(work_dir, "op.tif")
+
+        heights, gt = synthetic_dtm(dtm_path, size, res=res, seed=seed, holes=holes)
+        synthetic_ortho(op_path, heights, gt, 31287, op_res)
+        nodata = float(np.count_nonzero(heights == -9999) / heights.size)
+        heights = None
+
+        print("Running benchmark...")
+        tiles_dir = os.path.join(work_dir, "tiles")
+        tile_grid = MeshGrid(path=dtm_path, tile_size=tile_size, max_error=max_error, method=method, max_triangles=max_triangles)
+        tile_grid.snap_boundaries()
+        tile_grid.save_tiles(odir=tiles_dir, oname="bench")
+        tile_grid = None
+
+        json_path = os.path.join(tiles_dir, "bench.json")
+        tiles_data = load_tile_json(json_path)
+
+        from main import add_ortho
+        add_ortho(op_path, json_path, op_res=op_res)
+
+        tiles_arrays = read_terrain(tiles_data)
+
+        cam_dict = synthetic_cameras(tiles_data, cams, img_size, int(img_size * 2 / 3.))
+
+        if render:
+            render_cameras(tiles_data, tiles_arrays, cam_dict)
+
+        raycaster = create_raycaster(tiles_data, tiles_arrays=tiles_arrays, engine=engine)
+
+        rays = [camera_rays(data, tiles_data["min_xyz"], stride=ray_stride) for data in cam_dict.values()]
+        with PROFILER.stage("raycast", engine=engine.value, rays=int(sum([len(r) for r in rays]))) as stage:
+            for cam_rays in rays:
+                stage.count(hits=int(np.count_nonzero(np.isfinite(raycaster.cast(cam_rays)))))
+        stage.rec["rays_per_s"] = round(stage.rec["rays"] / max(stage.rec["wall_s"], 1e-9))
+
+    finally:
+        if not keep_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        PROFILER.disable()
+
+    result = {"params":{"size":size, "res":res, "holes":holes, "nodata":round(nodata, 4), "seed":seed,
+                        "max_error":max_error, "max_triangles":max_triangles, "method":method, "tile_size":tile_size, "op_res":op_res, "cams":cams,
+                        "img_size":img_size, "ray_stride":ray_stride, "engine":engine.value, "render":render},
+              "env":{"python":platform.python_version(), "numpy":np.__version__, "gdal":gdal.__version__,
+                     "platform":platform.platform(), "cpus":os.cpu_count()},
+              "stages":PROFILER.stages,
+              "total_s":round(sum([rec["wall_s"] for rec in PROFILER.stages]), 4),
+              "peak_rss_mb":PROFILER.report()["peak_rss_mb"]}
+
+    with open(out_path, "w") as f:
+        json.dump(result, f, indent=4)
+
+    print("...saved results to %s." % (out_path))
+
+@app.command()
+def simplify(out_path:Annotated[str, typer.Argument(help="Path to the *.json the benchmark results are written to.")],
+             max_errors:Annotated[List[float], typer.Option("--max-error", help="Maximum errors the tiles are simplified with.")] = [0.25, 0.5, 1, 2],
+             tile_size:Annotated[int, typer.Option(help="Size of each tile in pixels; must be 2**n.")] = 256,
+             tiles:Annotated[int, typer.Option(help="Number of synthetic tiles.")] = 16,
+             seed:Annotated[int, typer.Option(help="Seed of the synthetic terrain.")] = 0):
+    
+    if tile_size < 2 or tile_size & (tile_size - 1) != 0:
+        raise typer.Exit("--tile-size must be 2**n.")
+    
+    #the tiles are cut from one fractal DTM without holes; delatin simplifies each tile again for every
+    #max_error while martini computes the error map once per tile and extracts all meshes from it
+    nr_cols = int(np.ceil(np.sqrt(tiles)))
+    heights = fractal_heights(nr_cols * tile_size + 1, seed=seed, holes=0)
+    tile_arrs = [heights[r*tile_size:(r+1)*tile_size+1, c*tile_size:(c+1)*tile_size+1] for r, c in
+                 [divmod(tx, nr_cols) for tx in range(tiles)]]
+    heights = None
+    
+    results = {"delatin":[], "martini":[]}
+    
+    print("...simplifying %i tiles with delatin." % (tiles))
+    for max_error in max_errors:
+        t0 = time.perf_counter()
+        nr_tris = sum([len(Delatin(tile_arr, max_error=max_error).triangles) for tile_arr in tile_arrs])
+        results["delatin"].append({"max_error":max_error, "triangles":nr_tris, "wall_s":round(time.perf_counter() - t0, 4)})
+    
+    print("...simplifying %i tiles with martini." % (tiles))
+    t0 = time.perf_counter()
+    rtins = [RTIN(tile_arr) for tile_arr in tile_arrs]
+    errors_s = round(time.perf_counter() - t0, 4)
+    
+    for max_error in max_errors:
+        t0 = time.perf_counter()
+        nr_tris = sum([len(rtin.mesh(max_error)[1]) for rtin in rtins])
+        results["martini"].append({"max_error":max_error, "triangles":nr_tris, "wall_s":round(time.perf_counter() - t0, 4)})
+    
+    for delatin_res, martini_res in zip(results["delatin"], results["martini"]):
+        print("...max_error %.2f: delatin %i triangles in %.3f s; martini %i triangles in %.3f s." % (delatin_res["max_error"], 
+              delatin_res["triangles"], delatin_res["wall_s"], martini_res["triangles"], martini_res["wall_s"]))
+    print("...martini error maps: %.3f s." % (errors_s))
+    
+    result = {"params":{"tile_size":tile_size, "tiles":tiles, "seed":seed, "max_errors":max_errors},
+              "env":{"python":platform.python_version(), "numpy":np.__version__, "platform":platform.platform(), "cpus":os.cpu_count()},
+              "delatin":results["delatin"],
+              "martini":{"errors_s":errors_s, "levels":results["martini"]}}
+    
+    with open(out_path, "w") as f:
+        json.dump(result, f, indent=4)
+    
+    print("...saved results to %s." % (out_path))
+
+def import_times(stderr, nr=10):
+    
+    #parses the output of python -X importtime; returns the top level imports with the largest cumulative time
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cum_us, name = line[len("import time:"):].split("|")
+        #nested imports are indented
+        if not name[1:].startswith(" "):
+            imports.append((name.strip(), int(cum_us)))
+    imports = [{"module":name, "cumulative_s":round(cum_us / 1e6, 4)} for name, cum_us in sorted(imports, key=lambda imp: -imp[1])]
+    return imports[:nr]
+
+@app.command()
+def startup(out_path:Annotated[str, typer.Argument(help="Path to the *.json the benchmark results are written to.")],
+            commands:Annotated[Optional[List[str]], typer.Option("--command", help="Commands of main.py whose startup is measured. If None add-ortho, create-mesh, render-gpkg and monoplot are used.")] = None,
+            repeat:Annotated[int, typer.Option(help="Number of runs of each command.")] = 5):
+    
+    if commands is None:
+        commands = ["add-ortho", "create-mesh", "render-gpkg", "monoplot"]
+    
+    #the startup time is measured with --help in a new interpreter for each run; hence, it includes all imports
+    #and the setup of the CLI but no work of the command itself
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    
+    results = []
+    for cmd in [None] + commands:
+        args = [sys.executable, main_path] + ([cmd] if cmd is not None else []) + ["--help"]
+        
+        wall = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            subprocess.run(args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            wall.append(time.perf_counter() - t0)
+        
+        proc = subprocess.run([sys.executable, "-X", "importtime"] + args[1:], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        
+        results.append({"command":cmd if cmd is not None else "--help",
+                        "median_s":round(float(np.median(wall)), 4),
+                        "min_s":round(float(np.min(wall)), 4),
+                        "imports":import_times(proc.stderr)})
+        print("...%s: %.3f s." % (results[-1]["command"], results[-1]["median_s"]))
+    
+    result = {"params":{"repeat":repeat},
+              "env":{"python":platform.python_version(), "platform":platform.platform(), "cpus":os.cpu_count()},
+              "commands":results}
+    
+    with open(out_path, "w") as f:
+        json.dump(result, f, indent=4)
+    
+    print("...saved results to %s." % (out_path))
+
+if __name__ == "__main__":
+    app()
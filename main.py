@@ -1,33 +1,41 @@
 import typer
+import sys
 from typing import List, Optional, Tuple
 from typing_extensions import Annotated
-from rich.progress import track, Progress
+from rich.progress import track
 import os
 from enum import Enum
-from monique_helper.terramesh import MeshGrid
-from monique_helper.io import load_tile_json, load_terrain, save_tif, save_png, load_gtif
-from monique_helper.transforms import alzeka2rot, R_ori2cv, alpha2azi
-from monique_helper.geom import plane_from_camera, img2square
-from osgeo import gdal, osr, ogr
+from monique_helper.raycast import RaycastEngine
+from monique_helper.transforms import alzeka2rot, R_ori2cv
+from monique_helper.anim import AnimFormat
+from monique_helper.instrument import PROFILER
 import json
 import string
 import numpy as np
-import pygfx as gfx
-from wgpu.gui.offscreen import WgpuCanvas as OffscreenCanvas
-import open3d as o3d
-from pyproj import Transformer
-from PIL import Image
-import base64
-from io import BytesIO
-import pandas as pd
-import imageio.v3 as iio
+
+#open3d, pygfx/wgpu, GDAL and the modules depending on them take several seconds to import; hence, they are
+#only imported within the commands which need them
 
 class MeshSimplification(str, Enum):
     delatin = "delatin"
+    martini = "martini"
+
+class SeamMode(str, Enum):
+    snap = "snap"
+    skirt = "skirt"
 
 
 app = typer.Typer()
 
+@app.callback()
+def main(ctx: typer.Context,
+         profile: Annotated[str, typer.Option(help="Path to a *.json where the time and memory usage of each stage are written to.")] = None):
+    
+    #the report is also written if the command fails or exits early
+    if profile is not None:
+        PROFILER.enable(command=" ".join(sys.argv))
+        ctx.call_on_close(lambda: PROFILER.save(profile))
+
 @app.command()
 def create_mesh(dtm_path:Annotated[str, typer.Argument()], 
                 out_dir:Annotated[str, typer.Argument()],
@@ -35,9 +43,16 @@ def create_mesh(dtm_path:Annotated[str, typer.Argument()],
                 max_error:Annotated[float, typer.Argument()],
                 extent:Annotated[tuple[float, float, float, float], typer.Option(help="Clip input DTM to (minx, miny, maxx, maxy).")] = (None, None, None, None),
                 method: Annotated[MeshSimplification, typer.Option(case_sensitive=False)] = MeshSimplification.delatin,
-                tile_size:Annotated[int, typer.Option(help="Size of each tile in pixels.")] = 1000
+                tile_size:Annotated[int, typer.Option(help="Size of each tile in pixels.")] = 1000,
+                max_triangles:Annotated[int, typer.Option(help="Maximum number of triangles of each tile. Tiles reaching it are simplified with a larger error than MAX_ERROR.")] = None,
+                update:Annotated[bool, typer.Option(help="Update the tiles in OUT_DIR; only tiles where the DTM changed are created again.")] = False,
+                shard:Annotated[str, typer.Option(help="Only create the i-th of N blocks of tile rows (i/N, starting with 0); combine the shards with merge-mesh.")] = None,
+                seams:Annotated[SeamMode, typer.Option(case_sensitive=False, help="Snap the vertices along the tile boundaries or add a vertical skirt to each tile (only for rendering).")] = SeamMode.snap,
+                skirt_depth:Annotated[float, typer.Option(help="Depth of the skirts. If None twice the maximum error of each tile is used.")] = None
                 ):
     
+    from monique_helper.terramesh import MeshGrid
+    
     allowed_characters = string.ascii_letters + string.digits + "_\\/:"
         
     if not os.path.exists(dtm_path):
@@ -46,7 +61,24 @@ def create_mesh(dtm_path:Annotated[str, typer.Argument()],
     if not os.path.isfile(dtm_path):
         raise typer.Exit("Input path does appaer to be a valid file.")
     
-    if os.path.exists(out_dir):
+    if shard is not None:
+        try:
+            shard = tuple([int(v) for v in shard.split("/")])
+            assert len(shard) == 2
+        except (ValueError, AssertionError):
+            raise typer.Exit("--shard must be provided as i/N.")
+        if update:
+            raise typer.Exit("--shard can not be combined with --update.")
+    
+    #all shards are written to the same directory
+    update_json = os.path.join(out_dir, "%s.json" % (out_name))
+    if update:
+        if not os.path.exists(update_json):
+            raise typer.Exit("%s does not exist; the tiles must be created without --update first." % (update_json))
+    elif shard is not None:
+        if os.path.exists(update_json):
+            raise typer.Exit("%s already exists." % (update_json))
+    elif os.path.exists(out_dir):
         raise typer.Exit("%s already exists." % (out_dir))
     
     spec_chars = list(set(out_dir).difference(allowed_characters))
@@ -58,22 +90,95 @@ def create_mesh(dtm_path:Annotated[str, typer.Argument()],
         raise typer.Exit("The output name contains special characters: %s" % ",".join(spec_chars))
     
     print("Starting to create mesh tiles:")
-    tile_grid = MeshGrid(path=dtm_path, tile_size=tile_size, max_error=max_error, method=method, extent=extent)
+    try:
+        tile_grid = MeshGrid(path=dtm_path, tile_size=tile_size, max_error=max_error, method=method, extent=extent, 
+                             update_json=update_json if update else None, shard=shard, max_triangles=max_triangles,
+                             seams=seams, skirt_depth=skirt_depth)
+    except ValueError as e:
+        raise typer.Exit(str(e))
+    
+    if max_triangles is not None:
+        errors = [tile.error for tile in tile_grid.data.values() if tile.error is not None]
+        if len(errors) > 0:
+            print("...%i tiles reached the triangle budget; maximum error %.2f." % (np.count_nonzero(np.array(errors) > max_error), max(errors)))
+    
+    if shard is not None:
+        print("...shard %i/%i contains tile rows %i to %i." % (shard[0], shard[1], tile_grid.shard_rows[0], tile_grid.shard_rows[1]-1))
     
-    print("...snapping vertices along tile boundaries.")
-    tile_grid.snap_boundaries()
+    if update:
+        print("...%i of %i tiles changed." % (len(tile_grid.changed), len(tile_grid.hashes)))
+    
+    if seams == SeamMode.snap:
+        print("...snapping vertices along tile boundaries.")
+        tile_grid.snap_boundaries()
     
     out_dir = os.path.normpath(out_dir)
     
     print("...saving tiles to %s." % (out_dir))
     tile_grid.save_tiles(odir=out_dir, oname=out_name)
     
+    if update and len(tile_grid.ortho_outdated) > 0:
+        print("...%i orthophoto tiles are outdated; recreate them with add-ortho --missing." % (len(tile_grid.ortho_outdated)))
+    
+@app.command()
+def merge_mesh(out_dir:Annotated[str, typer.Argument(help="Directory the shards of create-mesh --shard were saved to.")],
+               out_name:Annotated[str, typer.Argument(help="Name used for the shards.")]
+               ):
+    
+    from monique_helper.terramesh import MeshGrid
+    
+    print("Starting to merge mesh shards:")
+    if os.path.exists(os.path.join(out_dir, "%s.json" % (out_name))):
+        raise typer.Exit("%s.json already exists in %s." % (out_name, out_dir))
+    
+    try:
+        tile_grid = MeshGrid.from_shards(out_dir, out_name)
+    except (ValueError, FileNotFoundError) as e:
+        raise typer.Exit(str(e))
+    
+    if tile_grid.seams == "snap":
+        print("...snapping vertices along %i shard boundary tiles." % (len(tile_grid.changed)))
+        tile_grid.snap_boundaries()
+    
+    print("...saving tiles to %s." % (out_dir))
+    tile_grid.save_tiles(odir=out_dir, oname=out_name)
+    tile_grid.remove_shards()
+
+@app.command()
+def export_mesh(json_path:Annotated[str, typer.Argument(help="Path to the *.json created by create-mesh.")],
+                out_path:Annotated[str, typer.Argument(help="Path to the *.ply the merged mesh is written to.")]
+                ):
+    
+    from monique_helper.terramesh import merge_tiles, iter_ply_tiles
+    from monique_helper.io import load_tile_json
+    
+    print("Starting to merge mesh tiles:")
+    if not os.path.exists(json_path):
+        raise typer.Exit("%s does not exist." % (json_path))
+    if os.path.splitext(out_path)[1].lower() != ".ply":
+        raise typer.Exit("The merged mesh must be saved as *.ply.")
+    
+    tiles_data = load_tile_json(json_path)
+    tile_size = tiles_data.get("tile_size", None)
+    if tile_size is None:
+        raise typer.Exit("The tiles do not contain the tile size. Create them again.")
+    
+    try:
+        nr_verts, nr_tris = merge_tiles(out_path, iter_ply_tiles(tiles_data), tile_size)
+    except ValueError as e:
+        raise typer.Exit(str(e))
+    
+    print("...saved %i vertices and %i triangles of %i tiles to %s." % (nr_verts, nr_tris, len(tiles_data["tiles"]), out_path))
+    
 @app.command()
 def add_ortho(op_path:Annotated[str, typer.Argument(help="Parth to the original orthophoto.")],
               json_path:Annotated[str, typer.Argument(help="Path to the *.json created by create-mesh.")],
-              op_res:Annotated[float, typer.Option(help="Output resolution of the orthophoto tiles.")] = 1
+              op_res:Annotated[float, typer.Option(help="Output resolution of the orthophoto tiles.")] = 1,
+              missing:Annotated[bool, typer.Option(help="Only create orthophoto tiles which do not exist yet (e.g. after create-mesh --update).")] = False
               ):
     
+    from osgeo import gdal, osr
+    
     print("Starting to create orthophoto tiles:")
     print("...loading %s." % (op_path))
     op_data = gdal.Open(op_path)
@@ -89,46 +194,75 @@ def add_ortho(op_path:Annotated[str, typer.Argument(help="Parth to the original
     if not os.path.exists(op_dir):
         os.makedirs(op_dir)    
     
-    for tile in track(tiles_data["tiles"], description="Creating OP tiles..."):
-        tid = tile["tid"]
-        out_path = os.path.join(op_dir, "%s.jpg" % (tid))
+    with PROFILER.stage("add-ortho", tiles=len(tiles_data["tiles"])) as stage:
+        for tile in track(tiles_data["tiles"], description="Creating OP tiles..."):
+            tid = tile["tid"]
+            out_path = os.path.join(op_dir, "%s.jpg" % (tid))
+            
+            if missing and os.path.exists(out_path):
+                continue
         
-        min_xyz = tile["min_xyz"]
-        max_xyz = tile["max_xyz"]
+            min_xyz = tile["min_xyz"]
+            max_xyz = tile["max_xyz"]
         
-        bbox = [min_xyz[0], min_xyz[1], max_xyz[0], max_xyz[1]]
+            bbox = [min_xyz[0], min_xyz[1], max_xyz[0], max_xyz[1]]
         
-        out_srs = osr.SpatialReference()
-        out_srs.ImportFromEPSG(int(tiles_epsg))
+            out_srs = osr.SpatialReference()
+            out_srs.ImportFromEPSG(int(tiles_epsg))
         
-        inp_srs = osr.SpatialReference()
-        inp_srs.ImportFromEPSG(int(op_epsg))
+            inp_srs = osr.SpatialReference()
+            inp_srs.ImportFromEPSG(int(op_epsg))
         
-        kwargs = {'format': 'JPEG', 
-                'outputBounds':bbox,
-                'outputBoundsSRS':out_srs,
-                'srcSRS':inp_srs,
-                'dstSRS':out_srs,
-                'xRes':op_res, 
-                'yRes':op_res,
-                'resampleAlg':'bilinear'}
-        ds = gdal.Warp(out_path, op_path, **kwargs)
-        del ds    
+            kwargs = {'format': 'JPEG', 
+                    'outputBounds':bbox,
+                    'outputBoundsSRS':out_srs,
+                    'srcSRS':inp_srs,
+                    'dstSRS':out_srs,
+                    'xRes':op_res, 
+                    'yRes':op_res,
+                    'resampleAlg':'bilinear'}
+            with stage.item(tid):
+                ds = gdal.Warp(out_path, op_path, **kwargs)
+                del ds    
 
 @app.command()
 def render_json(camera_json:Annotated[str, typer.Argument(help="Path to the *.json containing the camera parameters.")],
                 tiles_json:Annotated[str, typer.Argument(help="Path to the *.json created with create-mesh.")],
                 out_dir:Annotated[str, typer.Argument(help="Path to the directory where the outputs shall be stored.")],
-                xyz:Annotated[bool, typer.Option(help="If additional image with the xyz-coordinates of the scene shall be created.")] = True):
+                xyz:Annotated[bool, typer.Option(help="If additional image with the xyz-coordinates of the scene shall be created.")] = True,
+                engine: Annotated[RaycastEngine, typer.Option(case_sensitive=False, help="Ray casting against the mesh tiles or directly against the DTM.")] = RaycastEngine.mesh,
+                dtm: Annotated[str, typer.Option(help="DTM used by the heightfield engine. If None the DTM stored by create-mesh is used.")] = None,
+                tile_size: Annotated[int, typer.Option(help="Images larger than this are rendered in tiles of this size in px and saved as tiled *.tif. If None the maximum texture size of the GPU is used.")] = None,
+                ids: Annotated[bool, typer.Option(help="Create an additional raster with the tile id and triangle index of each pixel.")] = False):
            
+    import pygfx as gfx
+    import open3d as o3d
+    from wgpu.gui.offscreen import WgpuCanvas as OffscreenCanvas
+    from osgeo import gdal
+    from monique_helper.io import load_tile_json, save_tif, save_tif_tiles, save_png
+    from monique_helper.raycast import MeshRaycaster, create_raycaster
+    from monique_helper.render import load_terrain, tiling, render_tiles, enable_ids, read_ids
+    
     gfx_scene = gfx.Scene()
     bg = gfx.Background(None, gfx.BackgroundMaterial([1, 1, 1, 1]))
     gfx_scene.add(bg)
     
     print("Loading terrain...")
     tiles_data = load_tile_json(tiles_json)
-    gfx_terrain, o3d_scene = load_terrain(tiles_data)
+    gfx_terrain, o3d_scene = load_terrain(tiles_data, raycasting=xyz and engine == RaycastEngine.mesh)
     gfx_scene.add(gfx_terrain)
+    
+    if ids:
+        enable_ids(gfx_scene)
+    
+    if xyz:
+        if engine == RaycastEngine.mesh:
+            raycaster = MeshRaycaster(o3d_scene)
+        else:
+            try:
+                raycaster = create_raycaster(tiles_data, engine=engine, dtm_path=dtm)
+            except FileNotFoundError as e:
+                raise typer.Exit(str(e))
       
     with open(camera_json, "r") as json_file:
         cam_data = json.load(json_file)   
@@ -140,8 +274,14 @@ def render_json(camera_json:Annotated[str, typer.Argument(help="Path to the *.js
         cam_w = data["img_w"]
         cam_h = data["img_h"]
         
-        offscreen_canvas = OffscreenCanvas(size=(cam_w, cam_h), pixel_ratio=1)
-        offscreen_renderer = gfx.WgpuRenderer(offscreen_canvas, pixel_ratio=1)            
+        #large images are rendered in tiles and saved as tiled *.tif; the memory only depends on the tile size
+        cam_tile_size = tiling(cam_w, cam_h, tile_size)
+        if cam_tile_size is not None and ids:
+            raise typer.Exit("%s is rendered in tiles; --ids is not supported for tiled rendering." % (name))
+        
+        if cam_tile_size is None:
+            offscreen_canvas = OffscreenCanvas(size=(cam_w, cam_h), pixel_ratio=1)
+            offscreen_renderer = gfx.WgpuRenderer(offscreen_canvas, pixel_ratio=1)            
         
         euler = np.array([data["alpha"], data["zeta"], data["kappa"]])
         rmat = alzeka2rot(euler)
@@ -163,10 +303,20 @@ def render_json(camera_json:Annotated[str, typer.Argument(help="Path to the *.js
         gfx_camera.local.position = prc_local
         gfx_camera.local.rotation_matrix = rmat_gfx
             
-        offscreen_canvas.request_draw(offscreen_renderer.render(gfx_scene, gfx_camera))    
-        img_scene_arr = np.asarray(offscreen_canvas.draw())[:,:,:3]
+        with PROFILER.stage("render", camera=name, pixels=cam_w*cam_h):
+            if cam_tile_size is None:
+                offscreen_canvas.request_draw(offscreen_renderer.render(gfx_scene, gfx_camera))    
+                img_scene_arr = np.asarray(offscreen_canvas.draw())[:,:,:3]
+            else:
+                save_tif_tiles(render_tiles(gfx_scene, gfx_camera, cam_w, cam_h, cam_tile_size), 
+                               os.path.join(out_dir, name + ".tif"), cam_w, cam_h, 3)
+        
+        if cam_tile_size is None:
+            save_png(img_scene_arr, os.path.join(out_dir, name + ".png"))
         
-        save_png(img_scene_arr, os.path.join(out_dir, name + ".png"))
+        if ids:
+            with PROFILER.stage("ids", camera=name, pixels=cam_w*cam_h):
+                save_tif(read_ids(gfx_scene, offscreen_renderer, cam_w, cam_h), os.path.join(out_dir, name + "_id.tif"), nd=-1)
                 
         if xyz:
             
@@ -188,19 +338,35 @@ def render_json(camera_json:Annotated[str, typer.Argument(help="Path to the *.js
                                                                   cam_w/2., cam_h/2.)
         
     
-            rays = o3d_scene.create_rays_pinhole(intrinsic_matrix=cam_o3d_intrinsic.intrinsic_matrix, 
-                                                 extrinsic_matrix=cam_o3d_extrinsic, 
-                                                 width_px=cam_w, 
-                                                 height_px=cam_h)
-            rays = rays.reshape((cam_w*cam_h, 6))
+            def xyz_tiles(tile_w, tile_h):
+                #the rays of a tile are created with the principal point shifted by the offset of the tile
+                for y in range(0, cam_h, tile_h):
+                    for x in range(0, cam_w, tile_w):
+                        w, h = min(tile_w, cam_w-x), min(tile_h, cam_h-y)
+                        intrinsic = np.array(cam_o3d_intrinsic.intrinsic_matrix)
+                        intrinsic[0, 2] -= x
+                        intrinsic[1, 2] -= y
+                        
+                        rays = o3d.t.geometry.RaycastingScene.create_rays_pinhole(intrinsic_matrix=intrinsic, 
+                                                                                  extrinsic_matrix=cam_o3d_extrinsic, 
+                                                                                  width_px=w, 
+                                                                                  height_px=h)
+                        rays = rays.numpy().reshape((w*h, 6))
+                        
+                        with PROFILER.stage("raycast", camera=name, rays=len(rays)):
+                            t_hit = raycaster.cast(rays)
+                        ans_coord = rays[:,:3] + rays[:,3:]*t_hit.reshape((-1,1))
+                        ans_coord = ans_coord.reshape(-1, 3)
+                        ans_coord += np.array(tiles_data["min_xyz"])
+                        
+                        yield x, y, np.reshape(ans_coord, (h, w, 3))
             
-            ans = o3d_scene.cast_rays(rays)
-            ans_coord = rays[:,:3] + rays[:,3:]*ans['t_hit'].reshape((-1,1))
-            ans_coord = ans_coord.numpy().reshape(-1, 3)
-            ans_coord += np.array(tiles_data["min_xyz"])
-            
-            coord_arr = np.reshape(ans_coord, (cam_h, cam_w, 3))
-            save_tif(coord_arr, os.path.join(out_dir, name + "_xyz.tif"))
+            if cam_tile_size is None:
+                _, _, coord_arr = next(xyz_tiles(cam_w, cam_h))
+                save_tif(coord_arr, os.path.join(out_dir, name + "_xyz.tif"))
+            else:
+                save_tif_tiles(xyz_tiles(cam_tile_size, cam_tile_size), os.path.join(out_dir, name + "_xyz.tif"), 
+                               cam_w, cam_h, 3, gdal_type=gdal.GDT_Float32, nd=-9999)
 
 @app.command()            
 def render_gpkg(gpkg_path:Annotated[str, typer.Argument(help="Path to the *.gpkg containing the oriented cameras.")],
@@ -211,8 +377,22 @@ def render_gpkg(gpkg_path:Annotated[str, typer.Argument(help="Path to the *.gpkg
                 hist_dist: Annotated[float, typer.Option(help="Distance of the historical image from the camera.")] = 10,
                 width: Annotated[int, typer.Option(help="Width in px of the output rendering. If None the width of the oriented image will be used.")] = None,
                 height: Annotated[int, typer.Option(help="Height in px of the output rendering. If None the width of the oriented image will be used.")] = None,
-                export_json: Annotated[bool, typer.Option(help="", hidden=True)] = False):
+                export_json: Annotated[bool, typer.Option(help="", hidden=True)] = False,
+                json_lines: Annotated[bool, typer.Option(help="", hidden=True)] = False,
+                workers: Annotated[int, typer.Option(help="Number of processes the cameras are distributed to. Only the progress of the cameras is shown.")] = 1,
+                prefetch: Annotated[int, typer.Option(help="Number of historical images which are loaded in the background while rendering. If None 2 are used. Only supported with a single worker.")] = None,
+                tile_size: Annotated[int, typer.Option(help="Images larger than this are rendered in tiles of this size in px and saved as tiled *.tif. If None the maximum texture size of the GPU is used.")] = None,
+                cache_dir: Annotated[str, typer.Option(help="Directory of the render cache. Cameras whose parameters, terrain and historical image did not change are copied from the cache instead of rendered. If None no cache is used.")] = None,
+                cache_size: Annotated[float, typer.Option(help="Maximum size of the render cache in MB. The least recently used renderings are removed first.")] = 10000,
+                ids: Annotated[bool, typer.Option(help="Create an additional raster with the tile id and triangle index of each pixel.")] = False):
        
+    from osgeo import ogr
+    from monique_helper.io import load_tile_json, read_gpkg_cameras, RecordWriter
+    from monique_helper.terrain import read_terrain
+    from monique_helper.cache import RenderCache, tiles_digest, camera_key
+    from monique_helper.render import render_gpkg_camera, camera_tiling, load_hist_image
+    from monique_helper.parallel import map_cameras, spatial_order
+    
     if os.path.exists(gpkg_path):
         ds = ogr.Open(gpkg_path)
         gpkg_name = os.path.basename(gpkg_path).split(".")[0]
@@ -229,172 +409,113 @@ def render_gpkg(gpkg_path:Annotated[str, typer.Argument(help="Path to the *.gpkg
     # Select the dataset to retrieve from the GeoPackage and assign it to an layer instance called lyr.
     # The names of available datasets can be found in the gpkg_contents table.
     reg_lyr = ds.GetLayer("region")
-    cam_lyr = ds.GetLayer("cameras")
     
     # Refresh the reader
     reg_lyr.ResetReading()
-    cam_lyr.ResetReading()
     
     # for each feature in the layer, print the feature properties
     reg_feat = reg_lyr.GetNextFeature()
     reg_dict = reg_feat.items()
     
-    cam_dict = {}
-    for feat in cam_lyr:
-        feat_dict = feat.items()
-        if feat_dict["is_oriented"] == 1:
-            cam_dict[feat_dict["iid"]] = feat_dict
+    cam_dict = read_gpkg_cameras(ds, cam=cam)
+    if len(cam_dict) == 0:
+        raise typer.Exit("No oriented cameras found in %s." % (gpkg_path))
     
-    tiles_json = reg_dict["json_path"]
+    #neighbouring cameras are rendered one after another
+    cam_dict = spatial_order(cam_dict)
     
-    gfx_scene = gfx.Scene()
-    bg = gfx.Background(None, gfx.BackgroundMaterial([1, 1, 1, 1]))
-    gfx_scene.add(bg)
+    if export_json and tile_size is not None:
+        raise typer.Exit("Tiled rendering does not support --export-json.")
+    if ids and tile_size is not None:
+        raise typer.Exit("Tiled rendering does not support --ids.")
+    if workers > 1 and prefetch is not None:
+        raise typer.Exit("--prefetch is only supported with a single worker.")
     
-    print("Loading terrain...")
+    tiles_json = reg_dict["json_path"]
     tiles_data = load_tile_json(tiles_json)
-    gfx_terrain, _ = load_terrain(tiles_data)
-    gfx_scene.add(gfx_terrain)
     
     if export_json:
-        trans = Transformer.from_crs(int(tiles_data["epsg"]), 4326, always_xy=True)
-        csv_spot_data = []
-        csv_render_data = []
-        canvas_h = 500
-        canvas_w = 500
-    
-    for cid, data in cam_dict.items():
-        
-        if cam is not None:
-            if cid not in cam:
-                continue
-             
-        print("...rendering %s." % (cid))
-        prc = np.array([data["obj_x0"], data["obj_y0"], data["obj_z0"]]) 
-        prc_local = prc - np.array(tiles_data["min_xyz"])
-        
-        if export_json:
-            prc_4326 = trans.transform(data["obj_x0"], data["obj_y0"])
-        
-        euler = np.array([data["alpha"], data["zeta"], data["kappa"]])
-        rmat = alzeka2rot(euler)
-        ior = np.array([data["img_x0"], data["img_y0"], data["f"]])
-        
-        img_path = data["path"]
-        img_arr, _, _ = load_gtif(img_path)
-        
-        if export_json:
-            bg_color = (255, 255, 255)
-            img = Image.fromarray(img_arr)
-            img.thumbnail((canvas_h, canvas_w))
-            img_pad = img2square(img, background_color=bg_color)
-            img_pad.save(os.path.join(out_dir, "%s_square.png" % (cid)))
-                    
-            img_pad_bits = BytesIO()
-            img_pad.save(img_pad_bits, format="png")
-            img_pad_str = "data:image/png;base64," + base64.b64encode(img_pad_bits.getvalue()).decode("utf-8")
-
-            img_w, img_h = img.size
-                    
-            if img_w > img_h:
-                diff = img_w-img_h
-                bbox = [diff/2., 0, img_w-(diff/2.), img_h]
-            else:
-                diff = img_h-img_w
-                bbox = [0, diff/2., img_w, img_h-(diff/2.)]
-
-            thumb_img = img.resize((50, 50), box=bbox)
-            thumb_bits = BytesIO()
-            thumb_img.save(thumb_bits, format="png")
-            thumb_str = "data:image/png;base64," + base64.b64encode(thumb_bits.getvalue()).decode("utf-8")
-        
-        hfov = data["hfov"]
-        vfov = data["vfov"]
-        
-        img_h = data["img_h"]
-        img_w = data["img_w"]
-        
-        canvas_h = img_h if width is None else width
-        canvas_w = img_w if height is None else height
-        
-        offscreen_canvas = OffscreenCanvas(size=(canvas_w, canvas_h), pixel_ratio=1)
-        offscreen_renderer = gfx.WgpuRenderer(offscreen_canvas) 
-        
-        rmat_gfx = np.zeros((4,4))
-        rmat_gfx[3, 3] = 1
-        rmat_gfx[:3, :3] = rmat
-                
-        if hfov > vfov:
-            gfx_camera = gfx.PerspectiveCamera(fov=np.rad2deg(hfov)+padding, depth_range=(1, 100000))
-        else:
-            gfx_camera = gfx.PerspectiveCamera(fov=np.rad2deg(vfov)+padding, depth_range=(1, 100000))
-            
-        gfx_camera.local.position = prc_local
-        gfx_camera.local.rotation_matrix = rmat_gfx
-        
-        offscreen_canvas.request_draw(offscreen_renderer.render(gfx_scene, gfx_camera))
-        img_scene_arr = np.asarray(offscreen_canvas.draw())[:,:,:3]
-        save_png(img_scene_arr, os.path.join(out_dir, cid + ".png"))
-        
-        if export_json:
-            img_scene = Image.fromarray(img_scene_arr)
-            # img_scene.save(os.path.join(out_dir, "%s_wo.png" % (cid)))
-            img_scene_bits = BytesIO()
-            img_scene.save(img_scene_bits, format="png")
-            img_scene_str = "data:image/png;base64," + base64.b64encode(img_scene_bits.getvalue()).decode("utf-8")
-        
-        if w_hist and padding > 0:
-            plane_mesh = plane_from_camera(data, img_arr, dist_plane=hist_dist, min_xyz=np.array(tiles_data["min_xyz"]))
-            gfx_scene.add(plane_mesh)
-
-            offscreen_canvas.request_draw(offscreen_renderer.render(gfx_scene, gfx_camera))
-            img_scene_with_arr = np.asarray(offscreen_canvas.draw())[:,:,:3]
-            save_png(img_scene_with_arr, os.path.join(out_dir, cid + "_hist.png"))
-            gfx_scene.remove(plane_mesh)
+        json_ext = "jsonl" if json_lines else "json"
+        spot_writer = RecordWriter(os.path.join(out_dir, "%s_spot.%s" % (gpkg_name, json_ext)), lines=json_lines)
+        render_writer = RecordWriter(os.path.join(out_dir, "%s_render.%s" % (gpkg_name, json_ext)), lines=json_lines)
+    
+    def write_recs(recs):
+        #records are written as soon as a camera is finished
+        if recs is not None:
+            spot_rec, render_rec = recs
+            spot_writer.write(spot_rec)
+            render_writer.write(render_rec)
+    
+    render_kwargs = {"out_dir":out_dir,
+                     "padding":padding,
+                     "w_hist":w_hist,
+                     "hist_dist":hist_dist,
+                     "width":width,
+                     "height":height,
+                     "export_json":export_json,
+                     "tile_size":tile_size,
+                     "ids":ids}
+    
+    #the json files are closed (and terminated) even if a camera fails
+    try:
+        #cached cameras are restored before the terrain is loaded; hence, if no camera changed the terrain is not read at all
+        if cache_dir is not None:
+            render_cache = RenderCache(cache_dir, max_size=cache_size*1024**2)
+        
+            with PROFILER.stage("cache", cameras=len(cam_dict)) as stage:
+                terrain_digest = tiles_digest(tiles_json, tiles_data)
+                cam_keys = {cid:camera_key(data, render_kwargs, terrain_digest, tile_size=camera_tiling(data, width, height, tile_size))
+                            for cid, data in cam_dict.items()}
             
-            img_scene_with = Image.fromarray(img_scene_with_arr)           
-            img_scene_with_bits = BytesIO()
-            img_scene_with.save(img_scene_with_bits, format="png")
-            img_scene_with_str = "data:image/png;base64," + base64.b64encode(img_scene_with_bits.getvalue()).decode("utf-8")
+                for cid in list(cam_dict.keys()):
+                    cam_meta = render_cache.get(cam_keys[cid], out_dir)
+                    if cam_meta is not None:
+                        write_recs(cam_meta["result"])
+                        del cam_dict[cid]
+                        stage.count(hits=1)
+        
+            print("...%i cameras restored from %s." % (len(cam_keys) - len(cam_dict), cache_dir))
+    
+        if len(cam_dict) > 0:
+            print("Loading terrain...")
+            tiles_arrays = read_terrain(tiles_data)
+        
+            #with several workers the stages within each camera are recorded by the workers and added afterwards
+            with PROFILER.stage("cameras", cameras=len(cam_dict), workers=workers):
+                #the historical images are only loaded if they are shown or exported
+                load = load_hist_image if export_json or (w_hist and padding > 0) else None
             
-            if export_json:
-                csv_render_data.append({"iid": "H" + cid,
-                                        "render":img_scene_str, 
-                                        "render_with":img_scene_with_str,
-                                        })
+                for cid, (cam_paths, recs) in map_cameras(render_gpkg_camera, cam_dict, tiles_data, tiles_arrays, render_kwargs, workers=workers,
+                                                          load=load, prefetch=prefetch):
+                    print("...rendered %s." % (cid))
+                    write_recs(recs)
                 
-                csv_spot_data.append({"iid":"H" + cid,
-                                "image":img_pad_str,
-                                "thumb":thumb_str,
-                                "geom": "SRID=4326;POINT (%.6f %.6f)" % (prc_4326[0], prc_4326[1]),
-                                "altitude": prc[2],
-                                "hfov":hfov,
-                                "vfov":vfov,
-                                "alpha":euler[0],
-                                "heading":alpha2azi(euler[0]),
-                                "zeta":euler[1],
-                                "kappa":euler[2],
-                                "f":ior[2],                         
-                                "archive":data["archiv"] if "archiv" in list(data.keys()) else None,
-                                "copy": data["copy"] if "copy" in list(data.keys()) else None,
-                                "von":"%s-01-01" % (data["jahr"]) if "jahr" in list(data.keys()) else "1111-01-01",
-                                "bis":"%s-12-31" % (data["jahr"]) if "jahr" in list(data.keys()) else "1111-12-31"})
-    
-    if export_json:
-        pd_spot = pd.DataFrame(csv_spot_data)
-        pd_spot.to_json(os.path.join(out_dir, "%s_spot.json" % (gpkg_name)), orient="records", indent=4)
-        
-        pd_render = pd.DataFrame(csv_render_data)
-        pd_render.to_json(os.path.join(out_dir, "%s_render.json" % (gpkg_name)), orient="records", indent=4)
+                    if cache_dir is not None:
+                        render_cache.put(cam_keys[cid], cam_paths, recs)
+    finally:
+        if export_json:
+            spot_writer.close()
+            render_writer.close()
 
 @app.command()            
 def animate_gpkg(gpkg_path:Annotated[str, typer.Argument(help="Path to the *.gpkg containing the oriented cameras.")],
-                out_dir: Annotated[str, typer.Argument(help="Path to save the .gif file. Must include the exeension.")],
+                out_dir: Annotated[str, typer.Argument(help="Path to the directory where the animations shall be stored.")],
                 padding:Annotated[float, typer.Option(help="Padding around historical image extent.")] = 1,
                 cam: Annotated[Optional[List[str]], typer.Option(help="Name of the cameras to create output for.")] = None,
                 dist_range: Annotated[Tuple[int, int, int], typer.Option(help="Distance of the historical image from the camera.")] = (100, 10000, 100),
                 width: Annotated[int, typer.Option(help="Width in px of the output rendering. If None the width of the oriented image will be used.")] = 1080,
-                height: Annotated[int, typer.Option(help="Height in px of the output rendering. If None the width of the oriented image will be used.")] = 1080):
+                height: Annotated[int, typer.Option(help="Height in px of the output rendering. If None the width of the oriented image will be used.")] = 1080,
+                fmt: Annotated[AnimFormat, typer.Option(case_sensitive=False, help="Output format of the animation. mp4 and webp require pyav.")] = AnimFormat.gif,
+                frame_duration: Annotated[int, typer.Option(help="Duration of each frame in milliseconds.")] = 50,
+                workers: Annotated[int, typer.Option(help="Number of processes the cameras are distributed to. Only the progress of the cameras is shown.")] = 1,
+                prefetch: Annotated[int, typer.Option(help="Number of historical images which are loaded in the background while rendering. If None 2 are used. Only supported with a single worker.")] = None):
+    
+    from PIL import Image
+    from osgeo import ogr
+    from monique_helper.io import load_tile_json, read_gpkg_cameras
+    from monique_helper.terrain import read_terrain
+    from monique_helper.render import animate_gpkg_camera, load_hist_image
+    from monique_helper.parallel import map_cameras, spatial_order
     
     logo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "monique_helper", "myalpics_logo_black_text_trans_200px.png")
     logo_arr = np.array(Image.open(logo_path))
@@ -403,8 +524,6 @@ def animate_gpkg(gpkg_path:Annotated[str, typer.Argument(help="Path to the *.gpk
     logo_alpha[logo_alpha > 0] = 255
     logo_alpha = logo_alpha / 255.
     
-    logo_h, logo_w, logo_d = np.shape(logo_arr)
-    
     if os.path.exists(gpkg_path):
         ds = ogr.Open(gpkg_path)
         gpkg_name = os.path.basename(gpkg_path).split(".")[0]
@@ -421,106 +540,167 @@ def animate_gpkg(gpkg_path:Annotated[str, typer.Argument(help="Path to the *.gpk
     # Select the dataset to retrieve from the GeoPackage and assign it to an layer instance called lyr.
     # The names of available datasets can be found in the gpkg_contents table.
     reg_lyr = ds.GetLayer("region")
-    cam_lyr = ds.GetLayer("cameras")
     
     # Refresh the reader
     reg_lyr.ResetReading()
-    cam_lyr.ResetReading()
     
     # for each feature in the layer, print the feature properties
     reg_feat = reg_lyr.GetNextFeature()
     reg_dict = reg_feat.items()
     
-    cam_dict = {}
-    for feat in cam_lyr:
-        feat_dict = feat.items()
-        if feat_dict["is_oriented"] == 1:
-            cam_dict[feat_dict["iid"]] = feat_dict
+    cam_dict = read_gpkg_cameras(ds, cam=cam)
+    if len(cam_dict) == 0:
+        raise typer.Exit("No oriented cameras found in %s." % (gpkg_path))
     
-    tiles_json = reg_dict["json_path"]
+    #neighbouring cameras are rendered one after another
+    cam_dict = spatial_order(cam_dict)
     
-    gfx_scene = gfx.Scene()
-    bg = gfx.Background(None, gfx.BackgroundMaterial([1, 1, 1, 1]))
-    gfx_scene.add(bg)
+    if workers > 1 and prefetch is not None:
+        raise typer.Exit("--prefetch is only supported with a single worker.")
+    
+    tiles_json = reg_dict["json_path"]
     
     print("Loading terrain...")
     tiles_data = load_tile_json(tiles_json)
-    gfx_terrain, _ = load_terrain(tiles_data)
-    gfx_scene.add(gfx_terrain)
-        
-    for cid, data in cam_dict.items():
-        
-        if cam is not None:
-            if cid not in cam:
-                continue
-        
-        gif_path = os.path.join(out_dir, f"{cid}.gif")
-        
-        print("...rendering %s." % (cid))
-        prc = np.array([data["obj_x0"], data["obj_y0"], data["obj_z0"]]) 
-        prc_local = prc - np.array(tiles_data["min_xyz"])
-        
-        euler = np.array([data["alpha"], data["zeta"], data["kappa"]])
-        rmat = alzeka2rot(euler)
-        ior = np.array([data["img_x0"], data["img_y0"], data["f"]])
-        
-        img_path = data["path"]
-        img_arr, _, _ = load_gtif(img_path)
-                
-        hfov = data["hfov"]
-        vfov = data["vfov"]
-        
-        canvas_h = width
-        canvas_w = height
-        
-        offscreen_canvas = OffscreenCanvas(size=(canvas_w, canvas_h), pixel_ratio=1)
-        offscreen_renderer = gfx.WgpuRenderer(offscreen_canvas) 
-        
-        rmat_gfx = np.zeros((4,4))
-        rmat_gfx[3, 3] = 1
-        rmat_gfx[:3, :3] = rmat
-                
-        if hfov > vfov:
-            gfx_camera = gfx.PerspectiveCamera(fov=np.rad2deg(hfov)+padding, depth_range=(1, 100000))
-        else:
-            gfx_camera = gfx.PerspectiveCamera(fov=np.rad2deg(vfov)+padding, depth_range=(1, 100000))
-            
-        gfx_camera.local.position = prc_local
-        gfx_camera.local.rotation_matrix = rmat_gfx
-        
-        dist_range = np.arange(dist_range[0], dist_range[1]+dist_range[2], dist_range[2])
-       
-        frames = []
-        
-        with Progress() as progress:
-            
-            task1 = progress.add_task("...rendering frames.", total=len(dist_range))
-
-            for dx, dist in enumerate(dist_range):
-                plane_mesh = plane_from_camera(data, img_arr, dist_plane=dist, min_xyz=np.array(tiles_data["min_xyz"]))
-                gfx_scene.add(plane_mesh)
-
-                offscreen_canvas.request_draw(offscreen_renderer.render(gfx_scene, gfx_camera))
-                img_scene_with_arr = np.asarray(offscreen_canvas.draw())[:,:,:3]
-                
-                img_scene_with_arr[-logo_h:, -logo_w:, 0] = (logo_arr[:, :, 0] * logo_alpha + img_scene_with_arr[-logo_h:, -logo_w:, 0] * (1 - logo_alpha)).astype(np.uint8)
-                img_scene_with_arr[-logo_h:, -logo_w:, 1] = (logo_arr[:, :, 1] * logo_alpha + img_scene_with_arr[-logo_h:, -logo_w:, 1] * (1 - logo_alpha)).astype(np.uint8)
-                img_scene_with_arr[-logo_h:, -logo_w:, 2] = (logo_arr[:, :, 2] * logo_alpha + img_scene_with_arr[-logo_h:, -logo_w:, 2] * (1 - logo_alpha)).astype(np.uint8)
-                
-                frames.append(img_scene_with_arr)
-                gfx_scene.remove(plane_mesh)
-                
-                progress.update(task1, advance=1)
-        
-                
-        frames_reverse = frames[::-1]
-        frames_total = frames + frames_reverse
-        
-        print(f"...saving {gif_path}")
-        iio.imwrite(gif_path, frames_total, duration=50)
-        
-        print("...done!")
+    tiles_arrays = read_terrain(tiles_data)
+    
+    anim_kwargs = {"out_dir":out_dir,
+                   "logo_arr":logo_arr,
+                   "logo_alpha":logo_alpha,
+                   "padding":padding,
+                   "dist_range":dist_range,
+                   "width":width,
+                   "height":height,
+                   "fmt":fmt.value,
+                   "frame_duration":frame_duration,
+                   "progress":None}
+    
+    with PROFILER.stage("cameras", cameras=len(cam_dict), workers=workers):
+        for cid, anim_path in map_cameras(animate_gpkg_camera, cam_dict, tiles_data, tiles_arrays, anim_kwargs, workers=workers,
+                                          load=load_hist_image, prefetch=prefetch):
+            print("...saved %s." % (anim_path))
+    
+    print("...done!")
         
     
+@app.command()
+def monoplot(gpkg_path:Annotated[str, typer.Argument(help="Path to the *.gpkg containing the oriented cameras.")],
+             out_path:Annotated[str, typer.Argument(help="Path to the *.csv where the object coordinates shall be stored.")],
+             csv_path:Annotated[str, typer.Option(help="Path to a *.csv with the columns iid, img_x and img_y. If None the points are read from --layer.")] = None,
+             layer:Annotated[str, typer.Option(help="Layer of the *.gpkg containing the image points.")] = "gcps",
+             iid_col:Annotated[str, typer.Option(help="Column containing the camera id.")] = "iid",
+             x_col:Annotated[str, typer.Option(help="Column containing the x-coordinate of the image point.")] = "img_x",
+             y_col:Annotated[str, typer.Option(help="Column containing the y-coordinate of the image point.")] = "img_y",
+             pixel_rows:Annotated[bool, typer.Option(help="Image y-coordinates are positive row indices instead of moniQue coordinates.")] = False,
+             batch_size:Annotated[int, typer.Option(help="Number of rays which are cast at once.")] = 1000000,
+             engine: Annotated[RaycastEngine, typer.Option(case_sensitive=False, help="Ray casting against the mesh tiles or directly against the DTM.")] = RaycastEngine.mesh,
+             dtm: Annotated[str, typer.Option(help="DTM used by the heightfield engine. If None the DTM stored by create-mesh is used.")] = None):
+    
+    from osgeo import ogr
+    from monique_helper.io import load_tile_json, read_gpkg_cameras
+    from monique_helper.raycast import create_raycaster
+    from monique_helper.terrain import read_terrain
+    from monique_helper.monoplot import monoplot_batches, read_csv_points, read_gpkg_points, write_csv_points
+    
+    if os.path.exists(gpkg_path):
+        ds = ogr.Open(gpkg_path)
+    else:
+        raise typer.Exit("%s does not exists." % (gpkg_path))
+    
+    # If the file handle is null then exit
+    if ds is None:
+        raise typer.Exit("Failed to load %s." % (gpkg_path))
+    
+    reg_lyr = ds.GetLayer("region")
+    reg_lyr.ResetReading()
+    reg_dict = reg_lyr.GetNextFeature().items()
+    
+    cam_dict = read_gpkg_cameras(ds)
+    if len(cam_dict) == 0:
+        raise typer.Exit("No oriented cameras found in %s." % (gpkg_path))
+    
+    print("Loading terrain...")
+    tiles_data = load_tile_json(reg_dict["json_path"])
+    try:
+        raycaster = create_raycaster(tiles_data, 
+                                     tiles_arrays=read_terrain(tiles_data, read_op=False) if engine == RaycastEngine.mesh else None, 
+                                     engine=engine, dtm_path=dtm)
+    except FileNotFoundError as e:
+        raise typer.Exit(str(e))
+    
+    if csv_path is not None:
+        points = read_csv_points(csv_path)
+        if (iid_col, x_col, y_col) != ("iid", "img_x", "img_y"):
+            points = ({**pnt, "iid":pnt[iid_col], "img_x":pnt[x_col], "img_y":pnt[y_col]} for pnt in points)
+    else:
+        points = read_gpkg_points(ds, layer, iid_col=iid_col, x_col=x_col, y_col=y_col)
+    
+    print("...casting rays.")
+    unmatched = {}
+    batches = monoplot_batches(points, cam_dict, raycaster, tiles_data["min_xyz"], batch_size=batch_size, pixel_rows=pixel_rows,
+                               unmatched=unmatched)
+    nr_points, nr_hits = write_csv_points(out_path, batches)
+    
+    if len(unmatched) > 0:
+        print("...%i points skipped as their camera is not oriented or does not exist: %s." % (sum(unmatched.values()), 
+                                                                                               ", ".join(sorted(unmatched.keys()))))
+    print("...%i of %i points intersected the terrain. Saved to %s." % (nr_hits, nr_points, out_path))
+    
+@app.command()
+def viewshed(gpkg_path:Annotated[str, typer.Argument(help="Path to the *.gpkg containing the oriented cameras.")],
+             out_dir:Annotated[str, typer.Argument(help="Path to the directory where the outputs shall be stored.")],
+             cam: Annotated[Optional[List[str]], typer.Option(help="Name of the cameras to create output for.")] = None,
+             res:Annotated[float, typer.Option(help="Resolution of the output raster. If None the resolution stored by create-mesh is used.")] = None,
+             per_camera:Annotated[bool, typer.Option(help="Create a visibility raster for each camera.")] = True,
+             coverage:Annotated[bool, typer.Option(help="Create an additional raster with the number of cameras seeing each cell.")] = False,
+             tol:Annotated[float, typer.Option(help="Tolerance in meters for a cell to count as visible if the ray hits the terrain perpendicularly. It is scaled with 1/cos of the angle of incidence (at most 5x) for grazing rays. If None half the resolution is used.")] = None,
+             chunk_size:Annotated[int, typer.Option(help="Number of cells processed at once.")] = 2**22,
+             max_open:Annotated[int, typer.Option(help="Maximum number of camera rasters written at once. The cameras are processed in groups of this size.")] = 64,
+             engine: Annotated[RaycastEngine, typer.Option(case_sensitive=False, help="Ray casting against the mesh tiles or directly against the DTM.")] = RaycastEngine.mesh,
+             dtm: Annotated[str, typer.Option(help="DTM used by the heightfield engine. If None the DTM stored by create-mesh is used.")] = None):
+    
+    from osgeo import ogr
+    from monique_helper.io import load_tile_json, read_gpkg_cameras
+    from monique_helper.raycast import create_raycaster
+    from monique_helper.terrain import read_terrain
+    from monique_helper.viewshed import compute_viewsheds
+    
+    if os.path.exists(gpkg_path):
+        ds = ogr.Open(gpkg_path)
+    else:
+        raise typer.Exit("%s does not exists." % (gpkg_path))
+    
+    # If the file handle is null then exit
+    if ds is None:
+        raise typer.Exit("Failed to load %s." % (gpkg_path))
+    
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    
+    reg_lyr = ds.GetLayer("region")
+    reg_lyr.ResetReading()
+    reg_dict = reg_lyr.GetNextFeature().items()
+    
+    cam_dict = read_gpkg_cameras(ds, cam=cam)
+    if len(cam_dict) == 0:
+        raise typer.Exit("No oriented cameras found in %s." % (gpkg_path))
+    
+    print("Loading terrain...")
+    tiles_data = load_tile_json(reg_dict["json_path"])
+    try:
+        raycaster = create_raycaster(tiles_data, 
+                                     tiles_arrays=read_terrain(tiles_data, read_op=False) if engine == RaycastEngine.mesh else None, 
+                                     engine=engine, dtm_path=dtm)
+    except FileNotFoundError as e:
+        raise typer.Exit(str(e))
+    
+    if res is None:
+        if "res" not in tiles_data.keys():
+            raise typer.Exit("No resolution stored in %s; it must be provided with --res." % (reg_dict["json_path"]))
+        res = tiles_data["res"]
+    
+    compute_viewsheds(raycaster, tiles_data, cam_dict, out_dir, res=res, per_camera=per_camera, 
+                      coverage=coverage, tol=tol, chunk_size=chunk_size, max_open=max_open)
+    
 if __name__ == "__main__":
     app()
\ No newline at end of file
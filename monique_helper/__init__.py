@@ -1 +1,7 @@
-from .terramesh import MeshGrid
\ No newline at end of file
+#submodules are imported lazily as open3d and pygfx take several seconds to import
+
+def __getattr__(name):
+    if name == "MeshGrid":
+        from .terramesh import MeshGrid
+        return MeshGrid
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -0,0 +1,138 @@
+import os
+import tempfile
+import numpy as np
+from enum import Enum
+
+class AnimFormat(str, Enum):
+    gif = "gif"
+    mp4 = "mp4"
+    webp = "webp"
+
+#codec used by the pyav plugin of imageio for the respective container
+VIDEO_CODECS = {"mp4":("h264", "yuv420p"),
+                "webp":("libwebp_anim", None)}
+
+def palette_from_samples(samples, nr_colors=256):
+    #all samples are stacked vertically into one image; the palette is computed once from it and shared
+    #by all frames which avoids the expensive (and flickering) quantization of each frame individually
+    samples_w = max([np.shape(s)[1] for s in samples])
+
+    samples_pad = []
+    for s in samples:
+        s = np.atleast_3d(s)[:, :, :3]
+        s_pad = np.zeros((np.shape(s)[0], samples_w, 3), dtype=np.uint8)
+        s_pad[:, :np.shape(s)[1], :] = s
+        samples_pad.append(s_pad)
+
+    #PIL is only imported once an animation is created; hence, main.py can import AnimFormat without it
+    from PIL import Image
+    sample_img = Image.fromarray(np.vstack(samples_pad))
+    return sample_img.quantize(colors=nr_colors)
+
+def overlay_logo(arr, logo_arr, logo_alpha):
+    #blends the logo into the lower right corner of the frame (in place)
+    logo_h, logo_w = np.shape(logo_alpha)
+    logo_alpha = logo_alpha.reshape(logo_h, logo_w, 1)
+    
+    arr_logo = arr[-logo_h:, -logo_w:, :3]
+    arr_logo[:] = (logo_arr[:, :, :3] * logo_alpha + arr_logo * (1 - logo_alpha)).astype(np.uint8)
+    return arr
+
+class GifStreamWriter:
+    def __init__(self, path, palette_img, duration=50, loop=0):
+        self.path = path
+        self.palette_img = palette_img
+        self.palette = palette_img.getpalette()
+        self.duration = duration
+        self.loop = loop
+
+        self.fp = open(path, "wb")
+        self.header_written = False
+
+    def prepare(self, arr):
+        #maps the rgb frame onto the shared palette; the resulting indices are what is actually written
+        from PIL import Image
+        img = Image.fromarray(arr).quantize(palette=self.palette_img, dither=Image.Dither.NONE)
+        return np.asarray(img)
+
+    def write(self, frame):
+        from PIL import Image
+        from PIL.GifImagePlugin import getheader, getdata
+        img = Image.fromarray(frame)
+        img.putpalette(self.palette)
+
+        if not self.header_written:
+            header, _ = getheader(img, info={"loop":self.loop, "duration":self.duration})
+            for h in header:
+                self.fp.write(h)
+            self.header_written = True
+
+        #no local color table is written; all frames reference the global palette from the header
+        for d in getdata(img, duration=self.duration):
+            self.fp.write(d)
+
+    def close(self):
+        self.fp.write(b";")
+        self.fp.close()
+
+class VideoStreamWriter:
+    def __init__(self, path, fmt, duration=50):
+
+        #pyav is an optional dependency only required for the video formats
+        import imageio.v3 as iio
+
+        codec, pix_fmt = VIDEO_CODECS[fmt]
+
+        self.path = path
+        self.file = iio.imopen(path, "w", plugin="pyav")
+        self.file.init_video_stream(codec, fps=1000./duration, pixel_format=pix_fmt)
+
+    def prepare(self, arr):
+        return arr
+
+    def write(self, frame):
+        self.file.write_frame(np.ascontiguousarray(frame))
+
+    def close(self):
+        self.file.close()
+
+def open_anim_writer(path, fmt, palette_img=None, duration=50):
+    if fmt == "gif":
+        if palette_img is None:
+            raise ValueError("A palette must be provided for %s." % (fmt))
+        return GifStreamWriter(path, palette_img, duration=duration)
+    elif fmt in VIDEO_CODECS.keys():
+        return VideoStreamWriter(path, fmt, duration=duration)
+    else:
+        raise ValueError("%s not supported." % (fmt))
+
+class FrameSpool:
+    #frames are spooled to a temporary file while they are written to the encoder for the first time;
+    #this allows to write them again in reversed order without re-rendering or keeping them in memory
+    def __init__(self, frame_shape, dtype=np.uint8, tmp_dir=None):
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.frame_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self.nr_frames = 0
+        self.fp = tempfile.TemporaryFile(dir=tmp_dir)
+
+    def __len__(self):
+        return self.nr_frames
+
+    def append(self, frame):
+        assert np.shape(frame) == self.frame_shape, "Frame shape does not match the spool."
+        self.fp.seek(self.nr_frames * self.frame_bytes, os.SEEK_SET)
+        self.fp.write(np.ascontiguousarray(frame, dtype=self.dtype).tobytes())
+        self.nr_frames += 1
+
+    def read(self, fx):
+        self.fp.seek(fx * self.frame_bytes, os.SEEK_SET)
+        buf = self.fp.read(self.frame_bytes)
+        return np.frombuffer(buf, dtype=self.dtype).reshape(self.frame_shape)
+
+    def reversed(self):
+        for fx in range(self.nr_frames-1, -1, -1):
+            yield self.read(fx)
+
+    def close(self):
+        self.fp.close()
@@ -0,0 +1,127 @@
+import os
+import json
+import glob
+import shutil
+import hashlib
+from monique_helper.io import _json_default
+
+#increased whenever the output of the renderer changes; hence, entries of older versions are never reused
+CACHE_VERSION = 2
+
+def file_stamp(path):
+
+    #files are identified by their size and modification time instead of their content; hence, unchanged files
+    #are not read at all (e.g. large historical images on a network drive)
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [os.path.basename(path), stat.st_size, stat.st_mtime_ns]
+
+def tiles_digest(tiles_json, tiles_data):
+
+    #content of the tiles *.json and the stamps of all mesh and orthophoto tiles
+    digest = hashlib.sha256()
+    with open(tiles_json, "rb") as f:
+        digest.update(f.read())
+
+    for tile in tiles_data["tiles"]:
+        tile_paths = [os.path.join(tiles_data["tile_dir"], "%s.ply" % (tile["tid"]))]
+        tile_paths += sorted(glob.glob(os.path.join(tiles_data["op_dir"], "%s.*" % (tile["tid"]))))
+        for tile_path in tile_paths:
+            digest.update(json.dumps(file_stamp(tile_path)).encode())
+
+    return digest.hexdigest()
+
+def camera_key(data, render_kwargs, terrain_digest, tile_size=None):
+
+    #all attributes of the camera (orientation, fov, image size as well as the attributes exported to json), the
+    #render options except the output directory, the terrain and the historical image; tile_size is the tile size the
+    #camera is actually rendered with (the default depends on the GPU) and replaces the one of render_kwargs
+    key_dict = {"version":CACHE_VERSION,
+                "camera":data,
+                "render":dict({key:val for key, val in render_kwargs.items() if key != "out_dir"}, tile_size=tile_size),
+                "terrain":terrain_digest,
+                "image":file_stamp(data.get("path"))}
+
+    #attributes of other types (e.g. dates) only need a stable representation
+    key_str = json.dumps(key_dict, sort_keys=True, default=lambda obj: obj.item() if hasattr(obj, "item") else str(obj))
+    return hashlib.sha256(key_str.encode()).hexdigest()
+
+class RenderCache:
+    #content-addressed cache of rendered cameras; each entry is a directory named by the key of the camera holding
+    #the output files and the returned records; entries are evicted least recently used first if the cache
+    #exceeds max_size (bytes)
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def __repr__(self):
+        return "RenderCache(cache_dir=%s, max_size=%s)" % (self.cache_dir, self.max_size)
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key, out_dir):
+
+        #copies the files of the entry to out_dir and returns its meta data; None if the key is not cached
+        meta_path = os.path.join(self.entry_dir(key), "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+
+        with open(meta_path, "r") as f:
+            meta = json.load(f)
+
+        for name in meta["files"]:
+            shutil.copyfile(os.path.join(self.entry_dir(key), name), os.path.join(out_dir, name))
+
+        #the modification time of meta.json marks the last use of the entry
+        os.utime(meta_path)
+        return meta
+
+    def put(self, key, paths, result=None):
+
+        #the entry is written to a temporary directory first; hence, an interrupted run never leaves an incomplete entry
+        tmp_dir = self.entry_dir(key) + ".tmp%i" % (os.getpid())
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        for path in paths:
+            shutil.copyfile(path, os.path.join(tmp_dir, os.path.basename(path)))
+
+        meta = {"files":[os.path.basename(path) for path in paths],
+                "result":result}
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(meta, f, default=_json_default)
+
+        if os.path.exists(self.entry_dir(key)):
+            shutil.rmtree(self.entry_dir(key))
+        os.replace(tmp_dir, self.entry_dir(key))
+
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def entries(self):
+        #(last use, size, key) of all complete entries
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            meta_path = os.path.join(self.entry_dir(key), "meta.json")
+            if not os.path.exists(meta_path):
+                continue
+            size = sum([entry.stat().st_size for entry in os.scandir(self.entry_dir(key)) if entry.is_file()])
+            entries.append((os.stat(meta_path).st_mtime_ns, size, key))
+        return entries
+
+    def evict(self, max_size):
+        entries = sorted(self.entries())
+        cache_size = sum([size for _, size, _ in entries])
+
+        for _, size, key in entries:
+            if cache_size <= max_size:
+                break
+            shutil.rmtree(self.entry_dir(key))
+            cache_size -= size
@@ -1,30 +1,27 @@
 import numpy as np
 import pygfx as gfx
-from monique_helper.transforms import alzeka2rot
+from monique_helper.transforms import alzeka2rot, img2ray
 from PIL import Image
 
 def plane_from_camera(cam, img, dist_plane=100, min_xyz = None):
-    cmat = np.array([[1, 0, -cam["img_x0"]], 
-                    [0, 1, -cam["img_y0"]],
-                    [0, 0, -cam["f"]]])
-    
     rmat = alzeka2rot([cam["alpha"], cam["zeta"], cam["kappa"]])
+    ior = np.array([cam["img_x0"], cam["img_y0"], cam["f"]])
     prc_local = np.array([cam["obj_x0"], cam["obj_y0"], cam["obj_z0"]]) - min_xyz
 
-    plane_pnts_img = np.array([[0, 0, 1],
-                        [cam["img_w"], 0, 1],
-                        [cam["img_w"], cam["img_h"]*(-1), 1],
-                        [0, cam["img_h"]*(-1), 1]]).T
+    plane_pnts_img = np.array([[0, 0],
+                        [cam["img_w"], 0],
+                        [cam["img_w"], cam["img_h"]*(-1)],
+                        [0, cam["img_h"]*(-1)]])
     
-    plane_pnts_dir = (rmat@cmat@plane_pnts_img).T
-    plane_pnts_dir = plane_pnts_dir / np.linalg.norm(plane_pnts_dir, axis=1).reshape(-1, 1)
+    plane_pnts_dir = img2ray(plane_pnts_img, rmat, ior)
     
-    plane_pnts_obj = prc_local + dist_plane * plane_pnts_dir
     plane_faces = np.array([[3, 1, 0], [3, 2, 1]]).astype(np.uint32)
     plane_uv = np.array([[0, 0], [1, 0], [1, 1], [0, 1]]).astype(np.uint32)
     
+    #the vertices are the unit view rays through the image corners; the projection center and the
+    #distance of the plane are applied via the transform of the mesh (position + uniform scale)
     plane_geom = gfx.geometries.Geometry(indices=plane_faces, 
-                                        positions=plane_pnts_obj.astype(np.float32),
+                                        positions=plane_pnts_dir.astype(np.float32),
                                         texcoords=plane_uv.astype(np.float32))
     
     # img_array = np.asarray(img)
@@ -32,8 +29,15 @@ def plane_from_camera(cam, img, dist_plane=100, min_xyz = None):
     
     plane_material = gfx.MeshBasicMaterial(map=tex, side="FRONT")
     plane_mesh = gfx.Mesh(plane_geom, plane_material, visible=True)
+    plane_mesh.local.position = prc_local
+    set_plane_dist(plane_mesh, dist_plane)
     return plane_mesh
 
+def set_plane_dist(plane_mesh, dist_plane):
+    #moving the plane along the view rays is only a scale around the projection center;
+    #hence, neither the vertex buffer nor the texture has to be uploaded again
+    plane_mesh.local.scale = dist_plane
+
 def img2square(pil_img, background_color):
     width, height = pil_img.size
     if width == height:
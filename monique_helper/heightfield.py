@@ -0,0 +1,200 @@
+import numpy as np
+
+class HeightfieldRaycaster:
+    #ray caster working directly on the regular DTM grid; the heights are bilinearly interpolated between the
+    #pixel centers, i.e. rays are intersected with the original DTM instead of the simplified mesh; a max-mip pyramid
+    #allows to skip large empty parts of each ray; no acceleration structure needs to be built apart from the pyramid
+    def __init__(self, heights, origin, res, max_iter=100000):
+
+        #heights (h, w) of the pixel centers with NaN as nodata; origin is the local xy-coordinate of the
+        #center of the upper left pixel; res is the pixel size; heights and pyramid are kept as float32 (the heights
+        #are relative to the minimum of the tiles, hence the precision is well below a mm)
+        self.heights = np.asarray(heights, dtype=np.float32)
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.res = float(res)
+        self.max_iter = max_iter
+
+        self.grid_h, self.grid_w = np.shape(self.heights)
+        if self.grid_h < 2 or self.grid_w < 2:
+            raise ValueError("The heightfield must have at least 2x2 pixels.")
+
+        self.build_pyramid()
+
+    def __repr__(self):
+        return "HeightfieldRaycaster(h=%i, w=%i, levels=%i)" % (self.grid_h, self.grid_w, len(self.pyramid))
+
+    def build_pyramid(self):
+
+        #level 0 holds for each cell (between four pixel centers) the maximum of its corners;
+        #each further level holds the maximum of 2x2 cells of the previous one
+        h = np.where(np.isfinite(self.heights), self.heights, np.float32(-np.inf))
+        lvl0 = np.maximum(np.maximum(h[:-1, :-1], h[:-1, 1:]), np.maximum(h[1:, :-1], h[1:, 1:]))
+
+        self.pyramid = [lvl0]
+        while max(np.shape(self.pyramid[-1])) > 1:
+            prev = self.pyramid[-1]
+            prev_h, prev_w = np.shape(prev)
+            prev_pad = np.full((prev_h + prev_h % 2, prev_w + prev_w % 2), -np.inf, dtype=np.float32)
+            prev_pad[:prev_h, :prev_w] = prev
+            self.pyramid.append(prev_pad.reshape(prev_pad.shape[0]//2, 2, prev_pad.shape[1]//2, 2).max(axis=(1, 3)))
+
+        valid = np.isfinite(self.heights)
+        self.min_z = float(np.min(self.heights[valid])) if np.any(valid) else 0
+        self.max_z = float(np.max(self.heights[valid])) if np.any(valid) else 0
+
+    def cast(self, rays, batch_size=2**20):
+
+        #rays (n, 6) with origin and direction in local coordinates (same as open3d); returns t_hit (n, ) in units of
+        #the direction vectors with inf for rays not hitting the terrain
+        rays = np.asarray(rays).reshape(-1, 6)
+        
+        #the marching state is held for all rays of a batch; hence, large requests are split
+        t_hit = np.empty(len(rays))
+        for b0 in range(0, len(rays), batch_size):
+            t_hit[b0:b0+batch_size] = self._cast(rays[b0:b0+batch_size, :].astype(np.float64))
+        return t_hit
+
+    def _cast(self, rays):
+
+        #grid coordinates: columns to the right, rows downwards in units of pixels; z stays in meters; as this is
+        #an affine transformation of the ray the ray parameter t is unaffected
+        ox = (rays[:, 0] - self.origin[0]) / self.res
+        oy = (self.origin[1] - rays[:, 1]) / self.res
+        oz = rays[:, 2]
+        dx = rays[:, 3] / self.res
+        dy = -rays[:, 4] / self.res
+        dz = rays[:, 5]
+
+        t_hit = np.full(len(rays), np.inf)
+
+        #clip each ray to the bounding box of the heightfield
+        t_min, t_max = self._clip(ox, oy, oz, dx, dy, dz)
+        ix = np.nonzero((t_min <= t_max) & np.isfinite(t_max))[0]
+
+        t = t_min[ix]
+        t_end = t_max[ix]
+        lvl = np.full(len(ix), len(self.pyramid)-1)
+
+        ox, oy, oz, dx, dy, dz = ox[ix], oy[ix], oz[ix], dx[ix], dy[ix], dz[ix]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inv_dx = 1. / dx
+            inv_dy = 1. / dy
+
+            for _ in range(self.max_iter):
+                if len(ix) == 0:
+                    break
+
+                cell = (2.0 ** lvl)
+
+                px = ox + t * dx
+                py = oy + t * dy
+
+                lvl_h, lvl_w = self._level_shapes(lvl)
+                cx = np.clip(np.floor(px / cell), 0, lvl_w - 1).astype(np.int64)
+                cy = np.clip(np.floor(py / cell), 0, lvl_h - 1).astype(np.int64)
+
+                #parameter where the ray leaves the current cell in xy
+                bx = np.where(dx > 0, (cx + 1) * cell, cx * cell)
+                by = np.where(dy > 0, (cy + 1) * cell, cy * cell)
+                tx = np.where(dx != 0, (bx - ox) * inv_dx, np.inf)
+                ty = np.where(dy != 0, (by - oy) * inv_dy, np.inf)
+                t_cell = np.minimum(np.minimum(tx, ty), t_end)
+
+                h_max = self._level_max(lvl, cy, cx)
+                z_min = np.minimum(oz + t * dz, oz + t_cell * dz)
+                candidate = z_min <= h_max
+
+                #exact intersection with the bilinear patch of the cell on the finest level
+                fine = candidate & (lvl == 0)
+                hit = np.zeros(len(ix), dtype=bool)
+                if np.any(fine):
+                    fx = np.nonzero(fine)[0]
+                    s_hit = self._intersect_cell(cx[fx], cy[fx], px[fx], py[fx], oz[fx] + t[fx] * dz[fx],
+                                                 dx[fx], dy[fx], dz[fx], t_cell[fx] - t[fx])
+                    fx_hit = np.isfinite(s_hit)
+                    t_hit[ix[fx[fx_hit]]] = t[fx[fx_hit]] + s_hit[fx_hit]
+                    hit[fx[fx_hit]] = True
+
+                #descend if the cell might contain a hit; otherwise step over the cell and ascend
+                descend = candidate & (lvl > 0)
+                step = ~descend & ~hit
+
+                lvl = np.where(descend, lvl - 1, lvl)
+                lvl = np.where(step, np.minimum(lvl + 1, len(self.pyramid) - 1), lvl)
+
+                #tiny nudge into the next cell avoids getting stuck on cell boundaries
+                t = np.where(step, t_cell + 1e-9 * np.maximum(1, np.abs(t_cell)), t)
+
+                keep = ~hit & (t <= t_end)
+                ix, t, t_end, lvl = ix[keep], t[keep], t_end[keep], lvl[keep]
+                ox, oy, oz, dx, dy, dz = ox[keep], oy[keep], oz[keep], dx[keep], dy[keep], dz[keep]
+                inv_dx, inv_dy = inv_dx[keep], inv_dy[keep]
+
+        return t_hit
+
+    def _level_shapes(self, lvl):
+        shapes = np.array([np.shape(p) for p in self.pyramid])
+        return shapes[lvl, 0], shapes[lvl, 1]
+
+    def _level_max(self, lvl, cy, cx):
+        h_max = np.empty(len(lvl))
+        for l in np.unique(lvl):
+            lx = lvl == l
+            h_max[lx] = self.pyramid[l][cy[lx], cx[lx]]
+        return h_max
+
+    def _clip(self, ox, oy, oz, dx, dy, dz):
+
+        #slab test against the box spanned by the pixel centers and the height range
+        box_min = np.array([0, 0, self.min_z])
+        box_max = np.array([self.grid_w - 1, self.grid_h - 1, self.max_z])
+
+        t_min = np.zeros(len(ox))
+        t_max = np.full(len(ox), np.inf)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for o, d, b0, b1 in zip((ox, oy, oz), (dx, dy, dz), box_min, box_max):
+                t0 = (b0 - o) / d
+                t1 = (b1 - o) / d
+                t_near = np.where(d != 0, np.minimum(t0, t1), np.where((o >= b0) & (o <= b1), -np.inf, np.inf))
+                t_far = np.where(d != 0, np.maximum(t0, t1), np.where((o >= b0) & (o <= b1), np.inf, -np.inf))
+                t_min = np.maximum(t_min, t_near)
+                t_max = np.minimum(t_max, t_far)
+
+        return t_min, t_max
+
+    def _intersect_cell(self, cx, cy, px, py, pz, dx, dy, dz, s_max):
+
+        #z(s) - h(u(s), v(s)) = a*s^2 + b*s + c with h the bilinear interpolation of the cell corners;
+        #returns the smallest root within [0, s_max] or inf
+        h00 = self.heights[cy, cx]
+        h10 = self.heights[cy, cx+1]
+        h01 = self.heights[cy+1, cx]
+        h11 = self.heights[cy+1, cx+1]
+
+        u0 = px - cx
+        v0 = py - cy
+
+        B = h10 - h00
+        C = h01 - h00
+        D = h00 - h10 - h01 + h11
+
+        a = -D * dx * dy
+        b = dz - (B * dx + C * dy + D * (u0 * dy + v0 * dx))
+        c = pz - (h00 + B * u0 + C * v0 + D * u0 * v0)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            disc = b**2 - 4 * a * c
+            sq = np.sqrt(np.maximum(disc, 0))
+            q = -0.5 * (b + np.where(b >= 0, sq, -sq))
+            r1 = np.where(np.abs(a) > 1e-12, q / a, np.where(b != 0, -c / b, np.inf))
+            r2 = np.where(q != 0, c / q, np.inf)
+
+            r1 = np.where((disc >= 0) & (r1 >= 0) & (r1 <= s_max), r1, np.inf)
+            r2 = np.where((disc >= 0) & (r2 >= 0) & (r2 <= s_max), r2, np.inf)
+            s_hit = np.minimum(r1, r2)
+
+        #cells with nodata corners are holes
+        s_hit[~np.isfinite(c)] = np.inf
+        return s_hit
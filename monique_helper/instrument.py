@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import time
+import platform
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss_mb():
+
+    #peak resident memory of the process so far; ru_maxrss is in kB on linux and in bytes on macOS;
+    #on windows psutil is used if available
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(maxrss / 1024.**2 if sys.platform == "darwin" else maxrss / 1024., 1)
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / 1024.**2, 1)
+    except (ImportError, AttributeError):
+        return None
+
+def rss_mb():
+
+    #current resident memory of the process; /proc on linux, otherwise psutil if available
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024.**2, 1)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().rss / 1024.**2, 1)
+    except ImportError:
+        return None
+
+class Stage:
+    #records wall time, cpu time, memory and counts of a stage; the resident memory at the start and end belongs to
+    #the stage, while the peak is the one of the whole process reached so far (i.e. it is only attributable to the
+    #stage if it is larger than in the previous stages); items (e.g. tiles) are recorded as nested stages without memory
+    __slots__ = ("rec", "items", "wall0", "cpu0", "memory")
+
+    def __init__(self, name, counts, memory=True, key="stage"):
+        self.rec = {key:name}
+        self.rec.update(counts)
+        self.items = None
+        self.memory = memory
+
+    def __enter__(self):
+        if self.memory:
+            self.rec["rss_start_mb"] = rss_mb()
+        self.wall0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.rec["wall_s"] = round(time.perf_counter() - self.wall0, 4)
+        self.rec["cpu_s"] = round(time.process_time() - self.cpu0, 4)
+        if self.memory:
+            self.rec["rss_end_mb"] = rss_mb()
+            self.rec["process_peak_rss_mb"] = peak_rss_mb()
+        if self.items is not None:
+            self.rec["items"] = self.items
+        return False
+
+    def count(self, **counts):
+        #counts are accumulated, i.e. can be called repeatedly within the stage
+        for key, val in counts.items():
+            self.rec[key] = self.rec.get(key, 0) + val
+
+    def item(self, name, **counts):
+        if self.items is None:
+            self.items = []
+        item = Stage(name, counts, memory=False, key="item")
+        self.items.append(item.rec)
+        return item
+
+class NullStage:
+    #returned if profiling is disabled; hence, the instrumented code only pays for a method call
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def count(self, **counts):
+        pass
+
+    def item(self, name, **counts):
+        return self
+
+NULL_STAGE = NullStage()
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.stages = []
+        self.command = None
+        self.wall0 = None
+
+    def enable(self, command=None):
+        self.enabled = True
+        self.stages = []
+        self.command = command
+        self.wall0 = time.perf_counter()
+
+    def disable(self):
+        self.enabled = False
+
+    def stage(self, name, **counts):
+        if not self.enabled:
+            return NULL_STAGE
+        stage = Stage(name, counts)
+        self.stages.append(stage.rec)
+        return stage
+
+    def add_stages(self, stages):
+        #stages recorded elsewhere, e.g. by a worker process
+        if self.enabled:
+            self.stages.extend(stages)
+
+    def report(self):
+        return {"command":self.command,
+                "python":platform.python_version(),
+                "platform":platform.platform(),
+                "total_wall_s":round(time.perf_counter() - self.wall0, 4) if self.wall0 is not None else None,
+                "peak_rss_mb":peak_rss_mb(),
+                "stages":self.stages}
+
+    def save(self, path):
+        with open(path, "w") as f:
+            #numpy scalars passed as counts are converted to python types
+            json.dump(self.report(), f, indent=4, default=lambda obj: obj.item() if hasattr(obj, "item") else str(obj))
+
+PROFILER = Profiler()
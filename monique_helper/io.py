@@ -1,8 +1,6 @@
 import os
 import json
 import numpy as np
-import open3d as o3d
-import pygfx as gfx
 from osgeo import gdal, osr
 import glob
 
@@ -15,6 +13,29 @@ def load_tile_json(json_path):
         
     return tiles_data
 
+def read_gpkg_cameras(ds, cam=None):
+    
+    #the filtering is done by the sqlite query of the GeoPackage driver; hence, only the features
+    #of the requested (and oriented) cameras are actually read
+    cam_lyr = ds.GetLayer("cameras")
+    
+    cam_filter = "is_oriented = 1"
+    if cam is not None:
+        cam_ids = ", ".join(["'%s'" % (str(cid).replace("'", "''")) for cid in cam])
+        cam_filter += " AND iid IN (%s)" % (cam_ids)
+    
+    cam_lyr.SetAttributeFilter(cam_filter)
+    cam_lyr.ResetReading()
+    
+    cam_dict = {}
+    for feat in cam_lyr:
+        feat_dict = feat.items()
+        cam_dict[feat_dict["iid"]] = feat_dict
+    
+    cam_lyr.SetAttributeFilter(None)
+    
+    return cam_dict
+
 def load_gtif(path):
     ds = gdal.Open(path)
     
@@ -90,49 +111,64 @@ def save_tif(arr, path, proj=None, gt=None, nd=-9999):
     outdata.FlushCache()
     outdata = None
 
-def load_terrain(tiles_data):
-    
-    o3d_scene = o3d.t.geometry.RaycastingScene()
-    terrain = gfx.Group()
-   
-    for tile in tiles_data["tiles"]:
-        tile["op"] = {}
-        tile_path = os.path.join(tiles_data["tile_dir"], "%s.ply" % (tile["tid"]))
-        tile_mesh = o3d.io.read_triangle_mesh(tile_path)
+def save_tif_tiles(tiles, path, width, height, nr_bands, gdal_type=gdal.GDT_Byte, nd=None):
+    
+    #tiles (x, y, arr) are written to a tiled GeoTIFF as they are created; hence, only a single tile is kept in 
+    #memory and the size of the raster is not limited by the available memory
+    driver = gdal.GetDriverByName("GTiff")
+    outdata = driver.Create(path, width, height, nr_bands, gdal_type, options=["COMPRESS=DEFLATE", "TILED=YES", "BIGTIFF=IF_SAFER"])
+    
+    for b in range(nr_bands):
+        if nd is not None:
+            outdata.GetRasterBand(b+1).SetNoDataValue(nd)
+    
+    for x, y, arr in tiles:
+        arr = np.atleast_3d(arr)
+        if nd is not None:
+            arr = np.nan_to_num(arr, nan=nd, posinf=nd, neginf=nd)
+        for b in range(nr_bands):
+            outdata.GetRasterBand(b+1).WriteArray(arr[:, :, b], int(x), int(y))
+    
+    outdata.FlushCache()
+    outdata = None
 
-        verts = np.asarray(tile_mesh.vertices).astype(np.float32)
-        
-        u = (verts[:, 0] - tile["min_xyz"][0])/(tile["max_xyz"][0] - tile["min_xyz"][0])
-        v = (verts[:, 1] - tile["min_xyz"][1])/(tile["max_xyz"][1] - tile["min_xyz"][1])
-        uv = np.hstack((u.reshape(-1, 1), v.reshape(-1, 1)))
-        
-        # verts -= self.min_xyz
-        faces = np.asarray(tile_mesh.triangles).astype(np.uint32)       
-        verts -= np.array(tiles_data["min_xyz"])
-        
-        o3d_scene.add_triangles(verts, faces)
-                         
-        mesh_geom = gfx.geometries.Geometry(indices=faces, 
-                                            positions=verts.astype(np.float32),
-                                            texcoords=uv.astype(np.float32),
-                                            tid=[int(tile["tid_int"])])
-        
+def _json_default(obj):
+    #numpy scalars (e.g. from the camera parameters) are not serializable by default
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError("Object of type %s is not JSON serializable" % (type(obj).__name__))
 
-        # op_path = os.path.join(tiles_data["op_dir"], "%s.jpg" % (tile["tid"]))
-        op_paths = glob.glob(os.path.normpath(os.path.join(tiles_data["op_dir"], "%s.*" % (tile["tid"]))))
+class RecordWriter:
+    #writes records one by one either as JSON array (same layout as pandas orient="records") or as JSON Lines;
+    #hence, no record needs to be kept in memory after it is written
+    def __init__(self, path, lines=False):
+        self.path = path
+        self.lines = lines
+        self.nr_records = 0
         
-        if len(op_paths) == 1:
-            op_path = op_paths[0]            
-            img_arr, _ , _ = load_gtif(op_path)   
-            img_arr = np.flipud(img_arr)
-            
-            tex = gfx.Texture(img_arr, dim=2)
-            mesh_material = gfx.MeshBasicMaterial(map=tex, side="FRONT")
+        self.fp = open(path, "w")
+        if not self.lines:
+            self.fp.write("[")
+    
+    def write(self, rec):
+        if self.lines:
+            self.fp.write(json.dumps(rec, default=_json_default) + "\n")
         else:
-            mesh_material = gfx.MeshNormalMaterial(side="FRONT")
-            
-        #add lowest resolution material to mesh at startup
-        mesh = gfx.Mesh(mesh_geom, mesh_material, visible=True)
-        terrain.add(mesh)
+            rec_str = json.dumps(rec, indent=4, default=_json_default).replace("\n", "\n    ")
+            self.fp.write(("," if self.nr_records > 0 else "") + "\n    " + rec_str)
+        self.nr_records += 1
         
-    return terrain, o3d_scene
\ No newline at end of file
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+    
+    def close(self):
+        #the array is terminated even if writing is aborted by an exception; hence, the file stays valid JSON
+        if self.fp.closed:
+            return
+        if not self.lines:
+            self.fp.write("\n]" if self.nr_records > 0 else "]")
+        self.fp.close()
@@ -0,0 +1,99 @@
+import csv
+import numpy as np
+from monique_helper.transforms import stack_cameras, img2ray
+from monique_helper.instrument import PROFILER
+
+def cast_img_points(raycaster, img_xy, prc_local, rmat, ior):
+
+    #img_xy (N, 2) in the image coordinate system of moniQue (origin upper left, y-axis upwards); the camera
+    #parameters are given per point, i.e. prc_local (N, 3), rmat (N, 3, 3) and ior (N, 3); only the rays of
+    #those points are created and cast against the terrain; returns (N, 3) local coordinates, NaN if not hit
+    dirs = img2ray(img_xy, rmat, ior)
+
+    rays = np.hstack((prc_local, dirs))
+    t_hit = raycaster.cast(rays).astype(np.float64)
+
+    obj_xyz = prc_local + dirs * t_hit.reshape(-1, 1)
+    obj_xyz[~np.isfinite(t_hit), :] = np.nan
+
+    return obj_xyz
+
+def monoplot_batches(points, cam_dict, raycaster, min_xyz, batch_size=1000000, pixel_rows=False, unmatched=None):
+
+    #points is an iterable of dicts with (at least) iid, img_x and img_y; they are consumed in batches of batch_size
+    #and each batch is cast at once; yields (batch of point dicts, (n, 3) object coordinates); iids are compared as
+    #strings (e.g. the iids of a *.csv are strings while they might be integers in the GeoPackage); points without
+    #an oriented camera are counted per iid in unmatched (dict)
+    cam_ids = list(cam_dict.keys())
+    cam_ix = {str(cid):cx for cx, cid in enumerate(cam_ids)}
+
+    prc, rmat, ior = stack_cameras([cam_dict[cid] for cid in cam_ids])
+    prc_local = prc - np.array(min_xyz)
+
+    batch = []
+    for pnt in points:
+        if str(pnt["iid"]) not in cam_ix.keys():
+            if unmatched is not None:
+                unmatched[str(pnt["iid"])] = unmatched.get(str(pnt["iid"]), 0) + 1
+            continue
+        batch.append(pnt)
+
+        if len(batch) == batch_size:
+            yield batch, _monoplot_batch(batch, cam_ix, raycaster, prc_local, rmat, ior, min_xyz, pixel_rows)
+            batch = []
+
+    if len(batch) > 0:
+        yield batch, _monoplot_batch(batch, cam_ix, raycaster, prc_local, rmat, ior, min_xyz, pixel_rows)
+
+def _monoplot_batch(batch, cam_ix, raycaster, prc_local, rmat, ior, min_xyz, pixel_rows):
+
+    pnt_cx = np.array([cam_ix[str(pnt["iid"])] for pnt in batch])
+    img_xy = np.array([[float(pnt["img_x"]), float(pnt["img_y"])] for pnt in batch])
+
+    #positive row indices instead of the (negative) y-coordinates of moniQue
+    if pixel_rows:
+        img_xy[:, 1] *= -1
+
+    with PROFILER.stage("raycast", rays=len(batch)):
+        obj_xyz = cast_img_points(raycaster, img_xy, prc_local[pnt_cx, :], rmat[pnt_cx, :, :], ior[pnt_cx, :])
+    return obj_xyz + np.array(min_xyz)
+
+def read_csv_points(path):
+    with open(path, "r", newline="") as f:
+        for row in csv.DictReader(f):
+            yield row
+
+def read_gpkg_points(ds, layer, iid_col="iid", x_col="img_x", y_col="img_y"):
+    lyr = ds.GetLayer(layer)
+    if lyr is None:
+        raise ValueError("%s not found in the GeoPackage." % (layer))
+    lyr.ResetReading()
+
+    for feat in lyr:
+        feat_dict = feat.items()
+        feat_dict["iid"] = feat_dict[iid_col]
+        feat_dict["img_x"] = feat_dict[x_col]
+        feat_dict["img_y"] = feat_dict[y_col]
+        yield feat_dict
+
+def write_csv_points(path, batches):
+
+    #the input attributes of each point are written together with its object coordinates
+    nr_points = 0
+    nr_hits = 0
+
+    with open(path, "w", newline="") as f:
+        writer = None
+        for batch, obj_xyz in batches:
+            if writer is None:
+                fields = list(batch[0].keys()) + ["obj_x", "obj_y", "obj_z"]
+                writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+                writer.writeheader()
+
+            for pnt, xyz in zip(batch, obj_xyz):
+                writer.writerow(dict(pnt, obj_x=xyz[0], obj_y=xyz[1], obj_z=xyz[2]))
+
+            nr_points += len(batch)
+            nr_hits += int(np.count_nonzero(np.isfinite(obj_xyz[:, 0])))
+
+    return nr_points, nr_hits
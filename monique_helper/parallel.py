@@ -0,0 +1,174 @@
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from rich.progress import Progress
+from monique_helper.instrument import PROFILER
+
+#state of a render worker; the terrain is only loaded once per worker process and reused for all its cameras
+_worker = {}
+
+def share_arrays(tiles_arrays):
+
+    #all arrays are packed into a single shared memory block; spec describes where each array is located
+    spec = []
+    offset = 0
+
+    for tile_arrays in tiles_arrays:
+        tile_spec = {}
+        for key, arr in tile_arrays.items():
+            tile_spec[key] = (offset, arr.shape, arr.dtype.str)
+            offset += arr.nbytes
+            offset += (-offset) % 16    #keep every array aligned
+        spec.append(tile_spec)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+
+    for tile_arrays, tile_spec in zip(tiles_arrays, spec):
+        for key, arr in tile_arrays.items():
+            arr_offset, arr_shape, arr_dtype = tile_spec[key]
+            shm_arr = np.ndarray(arr_shape, dtype=arr_dtype, buffer=shm.buf, offset=arr_offset)
+            shm_arr[:] = arr
+
+    return shm, spec
+
+def attach_arrays(shm_name, spec):
+
+    #the block is owned (and unlinked) by the main process; workers started by multiprocessing share
+    #its resource tracker, hence attaching does not lead to a premature removal of the block
+    shm = shared_memory.SharedMemory(name=shm_name)
+
+    tiles_arrays = []
+    for tile_spec in spec:
+        tile_arrays = {}
+        for key, (arr_offset, arr_shape, arr_dtype) in tile_spec.items():
+            tile_arrays[key] = np.ndarray(arr_shape, dtype=arr_dtype, buffer=shm.buf, offset=arr_offset)
+        tiles_arrays.append(tile_arrays)
+
+    return shm, tiles_arrays
+
+def _init_worker(shm_name, spec, tiles_data, profile=False):
+
+    from monique_helper.render import create_scene, terrain_from_arrays
+
+    #the stages of each camera are recorded by the worker and returned with its result
+    if profile:
+        PROFILER.enable()
+
+    shm, tiles_arrays = attach_arrays(shm_name, spec)
+
+    _worker["shm"] = shm
+    _worker["tiles_data"] = tiles_data
+    _worker["scene"] = create_scene(terrain_from_arrays(tiles_data, tiles_arrays))
+
+def _run_camera(func, cid, data, kwargs):
+
+    #returns (cid, result, stages recorded while rendering the camera)
+    result = func(_worker["scene"], cid, data, _worker["tiles_data"], **kwargs)
+    stages = [dict(stage, worker=mp.current_process().name) for stage in PROFILER.stages]
+    PROFILER.stages = []
+    return cid, result, stages
+
+def spatial_order(cam_dict):
+
+    #cameras sorted along a z-order curve of their projection centers; hence, subsequent cameras are close to each
+    #other and mostly see the same terrain tiles
+    cids = list(cam_dict.keys())
+    if len(cids) <= 1:
+        return cam_dict
+
+    prc = np.array([[cam_dict[cid]["obj_x0"], cam_dict[cid]["obj_y0"]] for cid in cids], dtype=np.float64)
+    prc_min = np.min(prc, axis=0)
+    prc_ext = np.max(np.max(prc, axis=0) - prc_min)
+    if prc_ext == 0:
+        return cam_dict
+
+    #coordinates are quantized to 16 bit and their bits interleaved
+    cells = ((prc - prc_min) / prc_ext * (2**16 - 1)).astype(np.uint64)
+    code = np.zeros(len(cids), dtype=np.uint64)
+    for bit in range(16):
+        code |= ((cells[:, 0] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2*bit)
+        code |= ((cells[:, 1] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2*bit + 1)
+
+    return {cids[cx]:cam_dict[cids[cx]] for cx in np.argsort(code, kind="stable")}
+
+def prefetch_map(load, items, depth=2, threads=2):
+
+    #yields (item, load(item)) in the order of items; the next depth items are already loaded by background threads
+    #while the current one is processed; exceptions of load are raised when the respective item is reached
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = deque()
+        for item in items:
+            pending.append((item, pool.submit(load, item)))
+            if len(pending) >= depth:
+                break
+
+        while pending:
+            item, future = pending.popleft()
+            with PROFILER.stage("prefetch_wait"):
+                result = future.result()
+
+            #the next item is queued before the current one is returned to keep depth items in flight
+            for next_item in items:
+                pending.append((next_item, pool.submit(load, next_item)))
+                break
+
+            yield item, result
+
+def map_cameras(func, cam_dict, tiles_data, tiles_arrays, kwargs, workers=1, description="...rendering cameras.",
+                load=None, prefetch=None):
+
+    #yields (cid, result) for every camera once it is rendered; with more than one worker the cameras
+    #are distributed over separate processes each holding its own scene and wgpu device; with load (data -> img_arr)
+    #the images of the next prefetch cameras (default 2) are loaded in the background and passed to func as img_arr;
+    #as each worker loads its images itself, prefetching is only supported with a single worker
+    if workers > 1 and len(cam_dict) > 1 and prefetch:
+        raise ValueError("Prefetching is only supported with a single worker.")
+    if prefetch is None:
+        prefetch = 2
+
+    if workers <= 1 or len(cam_dict) <= 1:
+        from monique_helper.render import create_scene, terrain_from_arrays
+
+        gfx_scene = create_scene(terrain_from_arrays(tiles_data, tiles_arrays))
+
+        with Progress() as progress:
+            task = progress.add_task(description, total=len(cam_dict))
+            
+            #functions accepting a progress argument may add their own (e.g. per frame) tasks
+            if "progress" in kwargs.keys():
+                kwargs = dict(kwargs, progress=progress)
+            
+            if load is not None and prefetch > 0:
+                cameras = prefetch_map(lambda item: load(item[1]), cam_dict.items(), depth=prefetch)
+                for (cid, data), img_arr in cameras:
+                    yield cid, func(gfx_scene, cid, data, tiles_data, img_arr=img_arr, **kwargs)
+                    progress.update(task, advance=1)
+            else:
+                for cid, data in cam_dict.items():
+                    yield cid, func(gfx_scene, cid, data, tiles_data, **kwargs)
+                    progress.update(task, advance=1)
+        return
+
+    shm, spec = share_arrays(tiles_arrays)
+
+    try:
+        #spawn instead of fork as the gpu state of the main process must not be inherited
+        ctx = mp.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(cam_dict)), mp_context=ctx,
+                                 initializer=_init_worker, initargs=(shm.name, spec, tiles_data, PROFILER.enabled)) as pool:
+
+            futures = [pool.submit(_run_camera, func, cid, data, kwargs) for cid, data in cam_dict.items()]
+
+            with Progress() as progress:
+                task = progress.add_task(description, total=len(futures))
+                for future in as_completed(futures):
+                    cid, result, stages = future.result()
+                    PROFILER.add_stages(stages)
+                    yield cid, result
+                    progress.update(task, advance=1)
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,72 @@
+import os
+import numpy as np
+from enum import Enum
+from monique_helper.instrument import PROFILER
+
+class RaycastEngine(str, Enum):
+    mesh = "mesh"
+    heightfield = "heightfield"
+
+class MeshRaycaster:
+    #casts rays against the (simplified) mesh tiles using the BVH of open3d
+    def __init__(self, o3d_scene):
+        self.scene = o3d_scene
+
+    def __repr__(self):
+        return "MeshRaycaster()"
+
+    def cast(self, rays):
+        import open3d as o3d
+        rays = o3d.core.Tensor(np.ascontiguousarray(rays, dtype=np.float32).reshape(-1, 6))
+        return self.scene.cast_rays(rays)["t_hit"].numpy()
+
+def heightfield_from_dtm(dtm_path, tiles_data):
+
+    #reads only the window of the DTM covered by the tiles; the mesh vertices are located at the pixel
+    #centers of the DTM, hence min_xyz/max_xyz define the window; GDAL is only imported if the heightfield is used
+    from osgeo import gdal
+    from monique_helper.heightfield import HeightfieldRaycaster
+    
+    ds = gdal.Open(dtm_path)
+    gt = ds.GetGeoTransform()
+    res = gt[1]
+
+    min_xyz = np.array(tiles_data["min_xyz"])
+    max_xyz = np.array(tiles_data["max_xyz"])
+
+    c0 = max(int(np.round((min_xyz[0] - gt[0]) / res - 0.5)), 0)
+    c1 = min(int(np.round((max_xyz[0] - gt[0]) / res - 0.5)), ds.RasterXSize - 1)
+    r0 = max(int(np.round((gt[3] - max_xyz[1]) / -gt[5] - 0.5)), 0)
+    r1 = min(int(np.round((gt[3] - min_xyz[1]) / -gt[5] - 0.5)), ds.RasterYSize - 1)
+
+    band = ds.GetRasterBand(1)
+    heights = band.ReadAsArray(c0, r0, c1 - c0 + 1, r1 - r0 + 1).astype(np.float32)
+
+    nd = band.GetNoDataValue()
+    if nd is not None:
+        heights[heights == nd] = np.nan
+
+    heights -= np.float32(min_xyz[2])
+    origin = (gt[0] + (c0 + 0.5) * res - min_xyz[0], gt[3] + (r0 + 0.5) * gt[5] - min_xyz[1])
+
+    return HeightfieldRaycaster(heights, origin, res)
+
+def create_raycaster(tiles_data, tiles_arrays=None, engine="mesh", dtm_path=None):
+
+    if engine == "mesh":
+        if tiles_arrays is None:
+            raise ValueError("The mesh tiles must be provided for %s." % (engine))
+        #open3d is only imported if the mesh engine is used
+        from monique_helper.terrain import raycasting_scene
+        return MeshRaycaster(raycasting_scene(tiles_arrays, skirts=[tile.get("skirt", 0) for tile in tiles_data["tiles"]]))
+    elif engine == "heightfield":
+        if dtm_path is None:
+            dtm_path = tiles_data.get("dtm", None)
+        if dtm_path is None or not os.path.exists(dtm_path):
+            raise FileNotFoundError("The DTM of the tiles is required for %s." % (engine))
+        with PROFILER.stage("raycast_setup", engine="heightfield") as stage:
+            raycaster = heightfield_from_dtm(dtm_path, tiles_data)
+            stage.count(pixels=raycaster.heights.size)
+        return raycaster
+    else:
+        raise ValueError("%s not supported." % (engine))
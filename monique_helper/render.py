@@ -0,0 +1,504 @@
+import os
+import base64
+from io import BytesIO
+from functools import lru_cache
+import numpy as np
+import pygfx as gfx
+from pygfx.renderers.wgpu import register_wgpu_render_function
+from pygfx.renderers.wgpu.shaders.meshshader import MeshShader
+from wgpu.gui.offscreen import WgpuCanvas as OffscreenCanvas
+from PIL import Image
+from pyproj import Transformer
+from monique_helper.io import load_gtif, save_tif, save_tif_tiles
+from monique_helper.terrain import read_terrain, raycasting_scene
+from monique_helper.transforms import alzeka2rot, alpha2azi
+from monique_helper.geom import plane_from_camera, set_plane_dist, img2square
+from monique_helper.anim import open_anim_writer, palette_from_samples, overlay_logo, FrameSpool
+from monique_helper.instrument import PROFILER
+
+#supersampling of the renderings of render_gpkg_camera (default of pygfx)
+RENDER_PIXEL_RATIO = 2
+
+#normals and texture coordinates are not read by the terrain shader; pygfx still requires the buffers 
+NO_NORMALS = gfx.Buffer(np.zeros((1, 3), dtype=np.float32))
+NO_TEXCOORDS = gfx.Buffer(np.zeros((1, 2), dtype=np.float32))
+
+class TerrainMaterial(gfx.MeshBasicMaterial):
+    #the texture coordinates are derived from the tile-local positions (uv = xy * uv_scale) in the shader
+    uniform_type = dict(gfx.MeshBasicMaterial.uniform_type, uv_scale="2xf4")
+    
+    def __init__(self, uv_scale=(1, 1), **kwargs):
+        super().__init__(**kwargs)
+        self.uv_scale = uv_scale
+    
+    @property
+    def uv_scale(self):
+        return tuple(self.uniform_buffer.data["uv_scale"])
+    
+    @uv_scale.setter
+    def uv_scale(self, uv_scale):
+        self.uniform_buffer.data["uv_scale"] = uv_scale
+        self.uniform_buffer.update_range(0, 1)
+
+@register_wgpu_render_function(gfx.Mesh, TerrainMaterial)
+class TerrainShader(MeshShader):
+    
+    #wgsl has no 16 bit storage types; hence, the uint16 indices of a triangle (and one padding index) are packed
+    #into two uint32
+    CODE_REPLACE = (("let i0 = i32(vii[sub_index]);", 
+                     """$$ if packed_indices
+                        let i0 = i32((vii[sub_index / 2] >> (16u * u32(sub_index % 2))) & 0xffffu);
+                        $$ else
+                        let i0 = i32(vii[sub_index]);
+                        $$ endif"""),
+                    ("varyings.texcoord = vec2<f32>(load_s_texcoords(tex_coord_index));",
+                     "varyings.texcoord = vec2<f32>(raw_pos.xy * u_material.uv_scale);"),
+                    ("let raw_normal = load_s_normals(i0);",
+                     "let raw_normal = vec3<f32>(0.0, 0.0, 1.0);"))
+    
+    def __init__(self, wobject):
+        super().__init__(wobject)
+        self["packed_indices"] = wobject.geometry.indices.data.shape[-1] == 2
+    
+    def code_vertex(self):
+        code = super().code_vertex()
+        for old, new in self.CODE_REPLACE:
+            if old not in code:
+                raise RuntimeError("The mesh shader of pygfx %s is not supported." % (gfx.__version__))
+            code = code.replace(old, new)
+        return code
+
+def terrain_from_arrays(tiles_data, tiles_arrays):
+    
+    terrain = gfx.Group()
+    
+    for tile, tile_arrays in zip(tiles_data["tiles"], tiles_arrays):
+        tile["op"] = {}
+        
+        if "op" in tile_arrays.keys():
+            indices = tile_arrays["indices"]
+            if indices.dtype == np.uint16:
+                indices = np.hstack((indices, np.zeros((len(indices), 1), dtype=np.uint16))).view(np.uint32)
+            
+            tile_extent = np.array(tile["max_xyz"][:2]) - np.array(tile["min_xyz"][:2])
+            
+            mesh_geom = gfx.geometries.Geometry(indices=indices, 
+                                                positions=tile_arrays["positions"],
+                                                normals=NO_NORMALS,
+                                                texcoords=NO_TEXCOORDS,
+                                                tid=[int(tile["tid_int"])])
+            
+            tex = gfx.Texture(tile_arrays["op"], dim=2)
+            mesh_material = TerrainMaterial(map=tex, side="FRONT", uv_scale=1. / np.maximum(tile_extent, 1e-6))
+        else:
+            mesh_geom = gfx.geometries.Geometry(indices=tile_arrays["indices"].astype(np.uint32), 
+                                                positions=tile_arrays["positions"],
+                                                tid=[int(tile["tid_int"])])
+            mesh_material = gfx.MeshNormalMaterial(side="FRONT")
+            
+        #add lowest resolution material to mesh at startup
+        mesh = gfx.Mesh(mesh_geom, mesh_material, visible=True)
+        mesh.local.position = tile_arrays["origin"]
+        terrain.add(mesh)
+    
+    return terrain
+
+def load_terrain(tiles_data, raycasting=True):
+    
+    tiles_arrays = read_terrain(tiles_data)
+    terrain = terrain_from_arrays(tiles_data, tiles_arrays)
+    
+    if not raycasting:
+        return terrain, None
+    
+    return terrain, raycasting_scene(tiles_arrays, skirts=[tile.get("skirt", 0) for tile in tiles_data["tiles"]])
+
+def create_scene(gfx_terrain):
+    gfx_scene = gfx.Scene()
+    bg = gfx.Background(None, gfx.BackgroundMaterial([1, 1, 1, 1]))
+    gfx_scene.add(bg)
+    gfx_scene.add(gfx_terrain)
+    return gfx_scene
+
+def enable_ids(gfx_scene, enabled=True):
+
+    #the terrain tiles write the id of their mesh and the index of the rendered triangle into the (integer) pick
+    #target of pygfx; this is done in the same pass as the color and only costs the additional writes; pygfx builds
+    #the write mask into the pipeline, hence this must be set before the scene is rendered the first time
+    for obj in gfx_scene.iter():
+        if isinstance(obj, gfx.Mesh) and hasattr(obj.geometry, "tid"):
+            obj.material.pick_write = enabled
+
+def read_ids(gfx_scene, renderer, img_w, img_h):
+
+    #tile id (tid_int) and triangle index (within the *.ply of the tile) of each pixel of the last render; pixels
+    #without terrain are -1; pygfx only provides the pick info of single pixels, hence the pick target is read directly;
+    #this relies on the internals of pygfx 0.2 and is checked against the pick info of some pixels
+    pick_tex = getattr(getattr(renderer, "_blender", None), "pick_tex", None)
+    if pick_tex is None:
+        raise RuntimeError("The pick target of pygfx %s can not be read; the ids require pygfx 0.2." % (gfx.__version__))
+    tex_w, tex_h, _ = pick_tex.size
+    pick_data = renderer.device.queue.read_texture({"texture":pick_tex, "mip_level":0, "origin":(0, 0, 0)},
+                                                   {"offset":0, "bytes_per_row":tex_w*8},
+                                                   (tex_w, tex_h, 1))
+    pick = np.frombuffer(pick_data, dtype=np.uint64).reshape(tex_h, tex_w)
+
+    #the pick target has the internal resolution of the renderer (e.g. twice the size of the image with ssaa)
+    rows = ((np.arange(img_h) + 0.5) * tex_h / img_h).astype(np.int64)
+    cols = ((np.arange(img_w) + 0.5) * tex_w / img_w).astype(np.int64)
+    pick = pick[rows[:, None], cols[None, :]]
+
+    #bitfield written by the mesh shader of pygfx: 20 bits id of the object, 26 bits index of the triangle, 3x6 bits
+    #barycentric coordinates
+    obj_ids = (pick & np.uint64(2**20-1)).astype(np.int64)
+    face_ids = ((pick >> np.uint64(20)) & np.uint64(2**26-1)).astype(np.int32)
+
+    tile_ids = {obj.id:int(obj.geometry.tid.data[0]) for obj in gfx_scene.iter()
+                if isinstance(obj, gfx.Mesh) and hasattr(obj.geometry, "tid")}
+    id_lut = np.full(max(list(tile_ids.keys()) + [int(np.max(obj_ids))]) + 1, -1, dtype=np.int32)
+    id_lut[list(tile_ids.keys())] = list(tile_ids.values())
+
+    tid_arr = id_lut[obj_ids]
+    face_ids[tid_arr < 0] = -1
+
+    #the pixels are at the same position within the pick target as with get_pick_info (logical pixels)
+    rows, cols = np.nonzero(tid_arr >= 0)
+    for ix in np.unique(np.linspace(0, len(rows) - 1, min(len(rows), 16)).astype(np.int64)):
+        r, c = rows[ix], cols[ix]
+        info = renderer.get_pick_info((c + 0.5, r + 0.5))
+        obj = info.get("world_object", None)
+        if obj is None or obj.id != obj_ids[r, c] or info.get("face_index", None) != face_ids[r, c]:
+            raise RuntimeError("The pick target of pygfx %s has an unknown layout; the ids require pygfx 0.2." % (gfx.__version__))
+
+    return np.dstack((tid_arr, face_ids))
+
+def camera_from_gpkg(data, min_xyz, padding):
+
+    euler = np.array([data["alpha"], data["zeta"], data["kappa"]])
+    rmat = alzeka2rot(euler)
+
+    rmat_gfx = np.zeros((4,4))
+    rmat_gfx[3, 3] = 1
+    rmat_gfx[:3, :3] = rmat
+
+    hfov = data["hfov"]
+    vfov = data["vfov"]
+
+    if hfov > vfov:
+        gfx_camera = gfx.PerspectiveCamera(fov=np.rad2deg(hfov)+padding, depth_range=(1, 100000))
+    else:
+        gfx_camera = gfx.PerspectiveCamera(fov=np.rad2deg(vfov)+padding, depth_range=(1, 100000))
+
+    prc = np.array([data["obj_x0"], data["obj_y0"], data["obj_z0"]])
+    gfx_camera.local.position = prc - np.array(min_xyz)
+    gfx_camera.local.rotation_matrix = rmat_gfx
+
+    return gfx_camera
+
+class TileCamera(gfx.PerspectiveCamera):
+    
+    #renders the part (x, y, w, h) in px of a view of view_w x view_h px; the projection of the full view is computed
+    #as usual and afterwards scaled and shifted that the part covers the whole canvas (off-center frustum)
+    def __init__(self, fov, view_w, view_h, **kwargs):
+        super().__init__(fov=fov, **kwargs)
+        self.view_size = (view_w, view_h)
+        self.tile = (0, 0, view_w, view_h)
+    
+    @classmethod
+    def from_camera(cls, camera, view_w, view_h):
+        tile_camera = cls(camera.fov, view_w, view_h, depth_range=camera.depth_range)
+        tile_camera.local.position = camera.local.position
+        tile_camera.local.rotation = camera.local.rotation
+        return tile_camera
+    
+    def set_view_size(self, width, height):
+        #the canvas only shows a tile; hence, the aspect of the full view is used (view_size is not set yet
+        #while the base class is initialized)
+        super().set_view_size(*getattr(self, "view_size", (width, height)))
+    
+    def update_projection_matrix(self):
+        super().update_projection_matrix()
+        if not hasattr(self, "tile"):
+            return
+        
+        x, y, w, h = self.tile
+        view_w, view_h = self.view_size
+        
+        #extent of the tile in normalized device coordinates; y points upwards
+        x0, x1 = -1 + 2. * x / view_w, -1 + 2. * (x + w) / view_w
+        y0, y1 = 1 - 2. * (y + h) / view_h, 1 - 2. * y / view_h
+        
+        ndc_tile = np.array([[2. / (x1 - x0), 0, 0, -(x1 + x0) / (x1 - x0)],
+                             [0, 2. / (y1 - y0), 0, -(y1 + y0) / (y1 - y0)],
+                             [0, 0, 1, 0],
+                             [0, 0, 0, 1]])
+        
+        self.projection_matrix = ndc_tile @ self.projection_matrix
+        self.projection_matrix_inverse = np.linalg.inv(self.projection_matrix)
+
+def max_texture_size():
+    
+    #images larger than this can not be rendered to a single canvas (e.g. 8192 px with lavapipe)
+    from pygfx.renderers.wgpu import get_shared
+    limits = get_shared().device.limits
+    #the name of the limit differs between the versions of wgpu
+    return limits.get("max_texture_dimension2d", limits.get("max_texture_dimension_2d", 8192))
+
+def tiling(img_w, img_h, tile_size=None, pixel_ratio=1, margin=4):
+    
+    #tile size an image is rendered with; None if it is rendered to a single canvas; the textures of the renderer are
+    #pixel_ratio times larger than the image and each tile additionally has a margin on all sides; hence, the tile
+    #size is limited to the maximum texture size of the GPU reduced accordingly
+    max_tile_size = max_texture_size() // pixel_ratio - 2*margin
+    tile_size = max_tile_size if tile_size is None else min(tile_size, max_tile_size)
+    return tile_size if max(img_w, img_h) > tile_size else None
+
+def camera_tiling(data, width=None, height=None, tile_size=None):
+    
+    #tile size render_gpkg_camera renders the camera with; None if it is rendered to a single canvas
+    canvas_h = data["img_h"] if width is None else width
+    canvas_w = data["img_w"] if height is None else height
+    return tiling(canvas_w, canvas_h, tile_size, pixel_ratio=RENDER_PIXEL_RATIO)
+
+def render_tiles(gfx_scene, gfx_camera, img_w, img_h, tile_size, pixel_ratio=1, margin=4):
+    
+    #renders the view of gfx_camera with img_w x img_h px in tiles of at most tile_size x tile_size px; yields
+    #(x, y, rgb) of each tile that only a single tile is kept in memory; the final filter of pygfx samples the
+    #neighbouring pixels; hence, each tile is rendered with a margin which is cropped afterwards
+    tile_w, tile_h = min(tile_size, img_w), min(tile_size, img_h)
+    
+    offscreen_canvas = OffscreenCanvas(size=(tile_w + 2*margin, tile_h + 2*margin), pixel_ratio=1)
+    offscreen_renderer = gfx.WgpuRenderer(offscreen_canvas, pixel_ratio=pixel_ratio)
+    tile_camera = TileCamera.from_camera(gfx_camera, img_w, img_h)
+    
+    for y in range(0, img_h, tile_h):
+        for x in range(0, img_w, tile_w):
+            #tiles at the right and bottom border extend beyond the view and are cropped
+            tile_camera.tile = (x - margin, y - margin, tile_w + 2*margin, tile_h + 2*margin)
+            offscreen_canvas.request_draw(offscreen_renderer.render(gfx_scene, tile_camera))
+            tile_arr = np.asarray(offscreen_canvas.draw())[margin:margin+min(tile_h, img_h-y), margin:margin+min(tile_w, img_w-x), :3]
+            yield x, y, tile_arr
+
+def encode_png(img):
+    if isinstance(img, np.ndarray):
+        img = Image.fromarray(img)
+    img_bits = BytesIO()
+    img.save(img_bits, format="png")
+    return img_bits.getvalue()
+
+def write_png(img, path):
+    #encodes the image once; the returned bytes can be reused e.g. for the base64 export
+    png_bytes = encode_png(img)
+    with open(path, "wb") as f:
+        f.write(png_bytes)
+    return png_bytes
+
+def png2str(png_bytes):
+    return "data:image/png;base64," + base64.b64encode(png_bytes).decode("utf-8")
+
+@lru_cache(maxsize=None)
+def wgs84_transformer(epsg):
+    return Transformer.from_crs(int(epsg), 4326, always_xy=True)
+
+def load_hist_image(data):
+    img_arr, _, _ = load_gtif(data["path"])
+    return img_arr
+
+def render_gpkg_camera(gfx_scene, cid, data, tiles_data, out_dir, padding=1, w_hist=True, hist_dist=10,
+                       width=None, height=None, export_json=False, tile_size=None, ids=False, img_arr=None):
+
+    #returns the paths of all written files and the json records (spot_rec, render_rec) if exported
+    out_paths = []
+    
+    prc = np.array([data["obj_x0"], data["obj_y0"], data["obj_z0"]])
+
+    if export_json:
+        prc_4326 = wgs84_transformer(tiles_data["epsg"]).transform(data["obj_x0"], data["obj_y0"])
+
+    euler = np.array([data["alpha"], data["zeta"], data["kappa"]])
+    ior = np.array([data["img_x0"], data["img_y0"], data["f"]])
+
+    #the historical image is only decoded if it is actually shown or exported and has not been prefetched
+    if img_arr is None and (export_json or (w_hist and padding > 0)):
+        img_arr = load_hist_image(data)
+
+    if export_json:
+        bg_color = (255, 255, 255)
+        img = Image.fromarray(img_arr)
+        img.thumbnail((500, 500))
+        img_pad = img2square(img, background_color=bg_color)
+        out_paths.append(os.path.join(out_dir, "%s_square.png" % (cid)))
+        img_pad_str = png2str(write_png(img_pad, out_paths[-1]))
+
+        img_w, img_h = img.size
+
+        if img_w > img_h:
+            diff = img_w-img_h
+            bbox = [diff/2., 0, img_w-(diff/2.), img_h]
+        else:
+            diff = img_h-img_w
+            bbox = [0, diff/2., img_w, img_h-(diff/2.)]
+
+        thumb_img = img.resize((50, 50), box=bbox)
+        thumb_str = png2str(encode_png(thumb_img))
+
+    hfov = data["hfov"]
+    vfov = data["vfov"]
+
+    img_h = data["img_h"]
+    img_w = data["img_w"]
+
+    canvas_h = img_h if width is None else width
+    canvas_w = img_w if height is None else height
+
+    #large images are rendered in tiles and saved as tiled *.tif; tiles are rendered with the same supersampling as
+    #single canvases
+    tile_size = camera_tiling(data, width, height, tile_size)
+    if tile_size is not None and export_json:
+        raise ValueError("%s is rendered in tiles and can not be exported to json." % (cid))
+    if tile_size is not None and ids:
+        raise ValueError("%s is rendered in tiles; the ids can not be rendered." % (cid))
+    
+    if ids:
+        enable_ids(gfx_scene)
+    
+    if tile_size is None:
+        offscreen_canvas = OffscreenCanvas(size=(canvas_w, canvas_h), pixel_ratio=1)
+        offscreen_renderer = gfx.WgpuRenderer(offscreen_canvas, pixel_ratio=RENDER_PIXEL_RATIO)
+
+    gfx_camera = camera_from_gpkg(data, tiles_data["min_xyz"], padding)
+
+    with PROFILER.stage("render", camera=cid, pixels=canvas_w*canvas_h):
+        if tile_size is None:
+            offscreen_canvas.request_draw(offscreen_renderer.render(gfx_scene, gfx_camera))
+            img_scene_arr = np.asarray(offscreen_canvas.draw())[:,:,:3]
+        else:
+            out_paths.append(os.path.join(out_dir, cid + ".tif"))
+            save_tif_tiles(render_tiles(gfx_scene, gfx_camera, canvas_w, canvas_h, tile_size, pixel_ratio=RENDER_PIXEL_RATIO), 
+                           out_paths[-1], canvas_w, canvas_h, 3)
+    if tile_size is None:
+        out_paths.append(os.path.join(out_dir, cid + ".png"))
+        img_scene_png = write_png(img_scene_arr, out_paths[-1])
+    
+    #the ids are read before the historical image is added to the scene
+    if ids:
+        with PROFILER.stage("ids", camera=cid, pixels=canvas_w*canvas_h):
+            out_paths.append(os.path.join(out_dir, cid + "_id.tif"))
+            save_tif(read_ids(gfx_scene, offscreen_renderer, canvas_w, canvas_h), out_paths[-1], nd=-1)
+
+    if w_hist and padding > 0:
+        plane_mesh = plane_from_camera(data, img_arr, dist_plane=hist_dist, min_xyz=np.array(tiles_data["min_xyz"]))
+        gfx_scene.add(plane_mesh)
+
+        with PROFILER.stage("render_hist", camera=cid, pixels=canvas_w*canvas_h):
+            if tile_size is None:
+                offscreen_canvas.request_draw(offscreen_renderer.render(gfx_scene, gfx_camera))
+                img_scene_with_arr = np.asarray(offscreen_canvas.draw())[:,:,:3]
+            else:
+                out_paths.append(os.path.join(out_dir, cid + "_hist.tif"))
+                save_tif_tiles(render_tiles(gfx_scene, gfx_camera, canvas_w, canvas_h, tile_size, pixel_ratio=RENDER_PIXEL_RATIO), 
+                               out_paths[-1], canvas_w, canvas_h, 3)
+        if tile_size is None:
+            out_paths.append(os.path.join(out_dir, cid + "_hist.png"))
+            img_scene_with_png = write_png(img_scene_with_arr, out_paths[-1])
+        gfx_scene.remove(plane_mesh)
+
+        if export_json:
+            render_rec = {"iid": "H" + cid,
+                          "render":png2str(img_scene_png),
+                          "render_with":png2str(img_scene_with_png),
+                          }
+
+            spot_rec = {"iid":"H" + cid,
+                        "image":img_pad_str,
+                        "thumb":thumb_str,
+                        "geom": "SRID=4326;POINT (%.6f %.6f)" % (prc_4326[0], prc_4326[1]),
+                        "altitude": prc[2],
+                        "hfov":hfov,
+                        "vfov":vfov,
+                        "alpha":euler[0],
+                        "heading":alpha2azi(euler[0]),
+                        "zeta":euler[1],
+                        "kappa":euler[2],
+                        "f":ior[2],
+                        "archive":data["archiv"] if "archiv" in list(data.keys()) else None,
+                        "copy": data["copy"] if "copy" in list(data.keys()) else None,
+                        "von":"%s-01-01" % (data["jahr"]) if "jahr" in list(data.keys()) else "1111-01-01",
+                        "bis":"%s-12-31" % (data["jahr"]) if "jahr" in list(data.keys()) else "1111-12-31"}
+
+            return out_paths, (spot_rec, render_rec)
+
+    return out_paths, None
+
+def animate_gpkg_camera(gfx_scene, cid, data, tiles_data, out_dir, logo_arr, logo_alpha, padding=1,
+                        dist_range=(100, 10000, 100), width=1080, height=1080, fmt="gif", frame_duration=50,
+                        progress=None, img_arr=None):
+
+    anim_path = os.path.join(out_dir, f"{cid}.{fmt}")
+
+    if img_arr is None:
+        img_arr = load_hist_image(data)
+
+    canvas_h = width
+    canvas_w = height
+
+    offscreen_canvas = OffscreenCanvas(size=(canvas_w, canvas_h), pixel_ratio=1)
+    offscreen_renderer = gfx.WgpuRenderer(offscreen_canvas)
+
+    gfx_camera = camera_from_gpkg(data, tiles_data["min_xyz"], padding)
+
+    dists = np.arange(dist_range[0], dist_range[1]+dist_range[2], dist_range[2])
+
+    #the scene without the historical image, the historical image itself and the logo contain
+    #(apart from blending) all colors of the animation; hence, they define the shared palette
+    offscreen_canvas.request_draw(offscreen_renderer.render(gfx_scene, gfx_camera))
+    img_scene_arr = overlay_logo(np.asarray(offscreen_canvas.draw())[:,:,:3], logo_arr, logo_alpha)
+
+    img_thumb = Image.fromarray(img_arr)
+    img_thumb.thumbnail((canvas_w, canvas_h))
+    palette_img = palette_from_samples([img_scene_arr, np.asarray(img_thumb)]) if fmt == "gif" else None
+
+    anim_writer = open_anim_writer(anim_path, fmt, palette_img=palette_img, duration=frame_duration)
+    frame_spool = None
+
+    #the plane (and its texture) is only created once per camera; each frame just rescales it
+    plane_mesh = plane_from_camera(data, img_arr, dist_plane=dists[0], min_xyz=np.array(tiles_data["min_xyz"]))
+    gfx_scene.add(plane_mesh)
+
+    #frame level progress is only shown if rendering runs in the main process
+    if progress is not None:
+        task = progress.add_task("...rendering frames of %s." % (cid), total=len(dists)*2)
+
+    with PROFILER.stage("animate", camera=cid) as stage:
+        for dx, dist in enumerate(dists):
+            set_plane_dist(plane_mesh, dist)
+
+            offscreen_canvas.request_draw(offscreen_renderer.render(gfx_scene, gfx_camera))
+            img_scene_with_arr = overlay_logo(np.asarray(offscreen_canvas.draw())[:,:,:3], logo_arr, logo_alpha)
+
+            #frames are encoded right away; the spool only keeps them on disk for the reversed half
+            frame = anim_writer.prepare(img_scene_with_arr)
+            anim_writer.write(frame)
+
+            if frame_spool is None:
+                frame_spool = FrameSpool(np.shape(frame), dtype=frame.dtype, tmp_dir=out_dir)
+            frame_spool.append(frame)
+            stage.count(frames=1, pixels=canvas_w*canvas_h)
+
+            if progress is not None:
+                progress.update(task, advance=1)
+
+        for frame in frame_spool.reversed():
+            anim_writer.write(frame)
+            stage.count(frames=1)
+            if progress is not None:
+                progress.update(task, advance=1)
+
+    if progress is not None:
+        progress.remove_task(task)
+
+    gfx_scene.remove(plane_mesh)
+    frame_spool.close()
+    anim_writer.close()
+
+    return anim_path
@@ -0,0 +1,218 @@
+import numpy as np
+from functools import lru_cache
+
+#right-triangulated irregular network (RTIN) as in Martini (https://github.com/mapbox/martini); the error map is
+#computed once per tile and level by level instead of triangle by triangle; afterwards, meshes for any maximum error
+#can be extracted from it
+
+@lru_cache(maxsize=4)
+def rtin_triangles(grid_size):
+
+    #corners a and b (hypotenuse) of all triangles of the hierarchy as (x, y); the triangles are ordered by level
+    #(the two root triangles first); coordinates are x=column, y=row
+    tile_size = grid_size - 1
+    nr_triangles = tile_size * tile_size * 2 - 2
+
+    tid = np.arange(nr_triangles, dtype=np.int64) + 2
+    level = np.floor(np.log2(tid)).astype(np.int64)
+
+    ax = np.zeros(nr_triangles, dtype=np.int64)
+    ay = np.zeros(nr_triangles, dtype=np.int64)
+    bx = np.zeros(nr_triangles, dtype=np.int64)
+    by = np.zeros(nr_triangles, dtype=np.int64)
+    cx = np.zeros(nr_triangles, dtype=np.int64)
+    cy = np.zeros(nr_triangles, dtype=np.int64)
+
+    #bottom-left or top-right root triangle
+    bl = (tid & 1) == 1
+    bx[bl] = by[bl] = cx[bl] = tile_size
+    ax[~bl] = ay[~bl] = cy[~bl] = tile_size
+
+    #the further bits of the id (starting with the least significant one) describe the path from the root triangle
+    for bit in range(1, int(level.max())):
+        active = level > bit
+        left = active & (((tid >> bit) & 1) == 1)
+        right = active & ~left
+
+        mx = (ax + bx) >> 1
+        my = (ay + by) >> 1
+
+        bx[left], by[left] = ax[left], ay[left]
+        ax[left], ay[left] = cx[left], cy[left]
+
+        ax[right], ay[right] = bx[right], by[right]
+        bx[right], by[right] = cx[right], cy[right]
+
+        cx[active], cy[active] = mx[active], my[active]
+
+    return np.column_stack((ax, ay, bx, by)), level
+
+class RTIN:
+    def __init__(self, terrain, extent=None, nodata=None):
+
+        #terrain (grid_size, grid_size) with grid_size = 2**n+1; extent (h, w) of the actual terrain in the upper left
+        #of the grid (e.g. a tile at the border of a DTM padded to 2**n+1 pixels); the mesh is cut exactly along its
+        #last row and column and only the triangles within are returned; triangles and pixels with nodata are not
+        #considered for the error of the mesh
+        self.terrain = np.asarray(terrain, dtype=np.float64)
+        self.grid_size = np.shape(self.terrain)[0]
+        if np.shape(self.terrain) != (self.grid_size, self.grid_size) or (self.grid_size - 1) & (self.grid_size - 2) != 0:
+            raise ValueError("RTIN requires a square grid of 2**n+1 pixels.")
+
+        self.extent = (self.grid_size, self.grid_size) if extent is None else (int(extent[0]), int(extent[1]))
+        if min(self.extent) < 2 or max(self.extent) > self.grid_size:
+            raise ValueError("The extent must be within the grid and at least 2x2 pixels.")
+        self.nodata = nodata
+
+        self.compute_errors()
+
+    def __repr__(self):
+        return "RTIN(grid_size=%i)" % (self.grid_size)
+
+    def compute_errors(self):
+
+        #the error of a vertex is the deviation of the terrain from the hypotenuse of the triangles it splits; it is
+        #propagated to the parent triangles (the children's midpoints) that splitting a vertex always splits its
+        #dependencies as well; all triangles of one level are independent from each other
+        coords, level = rtin_triangles(self.grid_size)
+        terrain = self.terrain.ravel()
+        size = self.grid_size
+
+        self.errors = np.zeros(size * size)
+        nr_parents = len(level) - (size - 1) * (size - 1)
+
+        #the vertices along the last row and column of the extent must be part of the mesh; as their error is propagated
+        #to all triangles containing them, no triangle crosses the border of the extent
+        ext_h, ext_w = self.extent
+        if ext_h < size:
+            self.errors[(ext_h - 1) * size + np.arange(ext_w)] = np.inf
+        if ext_w < size:
+            self.errors[np.arange(ext_h) * size + ext_w - 1] = np.inf
+
+        for lvl in range(int(level.max()), int(level.min()) - 1, -1):
+            tix = np.nonzero(level == lvl)[0]
+            ax, ay, bx, by = coords[tix, 0], coords[tix, 1], coords[tix, 2], coords[tix, 3]
+
+            mx = (ax + bx) >> 1
+            my = (ay + by) >> 1
+            cx = mx + my - ay
+            cy = my + ax - mx
+
+            mix = my * size + mx
+            err = np.abs((terrain[ay * size + ax] + terrain[by * size + bx]) / 2. - terrain[mix])
+
+            if tix[0] < nr_parents:
+                lix = ((ay + cy) >> 1) * size + ((ax + cx) >> 1)
+                rix = ((by + cy) >> 1) * size + ((bx + cx) >> 1)
+                err = np.maximum(err, np.maximum(self.errors[lix], self.errors[rix]))
+
+            np.maximum.at(self.errors, mix, err)
+
+    def split(self, max_error):
+
+        #breadth first refinement starting with the two root triangles; returns the corners (x, y) of the final triangles
+        #within the extent
+        size = self.grid_size
+        tile_size = size - 1
+
+        active = np.array([[0, 0, tile_size, tile_size, tile_size, 0],
+                           [tile_size, tile_size, 0, 0, 0, tile_size]], dtype=np.int64)
+        done = []
+
+        while len(active) > 0:
+            ax, ay, bx, by, cx, cy = active.T
+            mx = (ax + bx) >> 1
+            my = (ay + by) >> 1
+
+            splittable = np.abs(ax - cx) + np.abs(ay - cy) > 1
+            refine = splittable & (self.errors[my * size + mx] > max_error)
+            done.append(active[~refine])
+
+            r = refine
+            active = np.vstack((np.column_stack((cx[r], cy[r], ax[r], ay[r], mx[r], my[r])),
+                                np.column_stack((bx[r], by[r], cx[r], cy[r], mx[r], my[r]))))
+
+        corners = np.vstack(done)
+        ext_h, ext_w = self.extent
+        return corners[np.all(corners[:, 0::2] <= ext_w - 1, axis=1) & np.all(corners[:, 1::2] <= ext_h - 1, axis=1)]
+
+    def nr_triangles(self, max_error):
+        return len(self.split(max_error))
+
+    def deviation(self, corners):
+
+        #maximum deviation of the terrain from the triangles (corners a, b, c as x, y); the triangles of an RTIN only
+        #have a few distinct shapes (two orientations per level and direction); hence, the grid points within a
+        #triangle and their barycentric weights are computed once per shape
+        if len(corners) == 0:
+            return 0.
+
+        terrain = self.terrain.ravel()
+        size = self.grid_size
+
+        ix_a = corners[:, 1] * size + corners[:, 0]
+        ix_b = corners[:, 3] * size + corners[:, 2]
+        ix_c = corners[:, 5] * size + corners[:, 4]
+
+        if self.nodata is not None:
+            valid = (terrain[ix_a] != self.nodata) & (terrain[ix_b] != self.nodata) & (terrain[ix_c] != self.nodata)
+            corners, ix_a, ix_b, ix_c = corners[valid], ix_a[valid], ix_b[valid], ix_c[valid]
+
+        shapes = corners[:, 0:4] - np.tile(corners[:, 4:6], 2)
+        uq_shapes, shape_ix = np.unique(shapes, axis=0, return_inverse=True)
+        shape_ix = shape_ix.ravel()
+
+        error = 0.
+        for sx, (ax, ay, bx, by) in enumerate(uq_shapes):
+            px, py = np.meshgrid(np.arange(min(0, ax, bx), max(0, ax, bx) + 1), np.arange(min(0, ay, by), max(0, ay, by) + 1))
+            px, py = px.ravel(), py.ravel()
+
+            det = float(ax * by - bx * ay)
+            wa = (px * by - py * bx) / det
+            wb = (ax * py - ay * px) / det
+            inside = (wa >= 0) & (wb >= 0) & (wa + wb <= 1)
+
+            tix = np.nonzero(shape_ix == sx)[0]
+            z_a, z_b, z_c = terrain[ix_a[tix]], terrain[ix_b[tix]], terrain[ix_c[tix]]
+
+            z_pts = terrain[ix_c[tix].reshape(-1, 1) + (py[inside] * size + px[inside]).reshape(1, -1)]
+            z_mesh = z_c.reshape(-1, 1) + np.outer(z_a - z_c, wa[inside]) + np.outer(z_b - z_c, wb[inside])
+
+            dev = np.abs(z_pts - z_mesh)
+            if self.nodata is not None:
+                dev[z_pts == self.nodata] = 0
+            error = max(error, float(np.max(dev)))
+
+        return error
+
+    def mesh(self, max_error, max_triangles=None):
+
+        #vertices as (row, col), triangles and the maximum deviation of the mesh from the terrain; with max_triangles
+        #the smallest error is searched which results in at most max_triangles triangles within the extent (or
+        #max_error if this already results in fewer triangles)
+        if max_triangles is not None and self.nr_triangles(max_error) > max_triangles:
+            #the vertices along the border of the extent (infinite error) are always kept; hence, the coarsest mesh
+            #splits at the largest finite error
+            levels = np.unique(self.errors[(self.errors > max_error) & np.isfinite(self.errors)])
+            if len(levels) > 0:
+                lo, hi = 0, len(levels) - 1
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if self.nr_triangles(levels[mid]) <= max_triangles:
+                        hi = mid
+                    else:
+                        lo = mid + 1
+                max_error = levels[lo]
+
+        corners = self.split(max_error)
+        mesh_error = self.deviation(corners)
+
+        #corners (x, y) to vertex indices; x is the column and y the row
+        corner_ix = corners[:, [1, 0, 3, 2, 5, 4]].reshape(-1, 2)
+        corner_key = corner_ix[:, 0] * self.grid_size + corner_ix[:, 1]
+        uq_key, triangles = np.unique(corner_key, return_inverse=True)
+
+        vertices = np.column_stack((uq_key // self.grid_size, uq_key % self.grid_size))
+        triangles = triangles.reshape(-1, 3)
+
+        return vertices, triangles, mesh_error
@@ -0,0 +1,67 @@
+import os
+import glob
+import numpy as np
+import open3d as o3d
+from monique_helper.io import load_gtif
+from monique_helper.instrument import PROFILER
+
+def read_terrain(tiles_data, read_op=True):
+    
+    #reads the mesh (and orthophoto) tiles from disk; the plain arrays can be shared with other processes
+    tiles_arrays = []
+   
+    with PROFILER.stage("terrain_load") as stage:
+        for tile in tiles_data["tiles"]:
+            tile_path = os.path.join(tiles_data["tile_dir"], "%s.ply" % (tile["tid"]))
+            with stage.item(tile["tid"]) as tile_stage:
+                tile_mesh = o3d.io.read_triangle_mesh(tile_path)
+
+            verts = np.asarray(tile_mesh.vertices)
+            faces = np.asarray(tile_mesh.triangles)
+            tile_min = np.array(tile["min_xyz"])
+            
+            #positions are relative to the minimum of the tile; its offset to the minimum of all tiles is applied by the
+            #transform of the mesh; the texture coordinates are derived from the positions (see render.TerrainShader);
+            #tiles with up to 2**16 vertices use uint16 indices
+            tile_arrays = {"positions":(verts - tile_min).astype(np.float32),
+                           "indices":faces.astype(np.uint16 if len(verts) <= 2**16 else np.uint32),
+                           "origin":(tile_min - np.array(tiles_data["min_xyz"])).astype(np.float32)}
+
+            # op_path = os.path.join(tiles_data["op_dir"], "%s.jpg" % (tile["tid"]))
+            op_paths = glob.glob(os.path.normpath(os.path.join(tiles_data["op_dir"], "%s.*" % (tile["tid"]))))
+        
+            if read_op and len(op_paths) == 1:
+                op_path = op_paths[0]            
+                with stage.item(tile["tid"] + "_op") as op_stage:
+                    img_arr, _ , _ = load_gtif(op_path)   
+                    tile_arrays["op"] = np.ascontiguousarray(np.flipud(img_arr))
+                op_stage.count(pixels=img_arr.shape[0] * img_arr.shape[1])
+                stage.count(texture_pixels=img_arr.shape[0] * img_arr.shape[1])
+        
+            tiles_arrays.append(tile_arrays)
+            
+            tile_stage.count(triangles=len(faces))
+            stage.count(tiles=1, triangles=len(faces))
+        
+    return tiles_arrays
+
+def raycasting_scene(tiles_arrays, skirts=None):
+    
+    #skirts: number of skirt triangles at the end of each tile (see create-mesh --seams skirt); they are not
+    #part of the terrain and hence not added to the scene
+    if skirts is None:
+        skirts = [0] * len(tiles_arrays)
+    
+    with PROFILER.stage("raycast_setup", engine="mesh") as stage:
+        o3d_scene = o3d.t.geometry.RaycastingScene()
+        for tile_arrays, skirt in zip(tiles_arrays, skirts):
+            indices = tile_arrays["indices"][:len(tile_arrays["indices"])-skirt].astype(np.uint32)
+            o3d_scene.add_triangles(tile_arrays["positions"] + tile_arrays["origin"], indices)
+            stage.count(triangles=len(indices))
+        
+        #the BVH is built lazily with the first query; if profiled, this is triggered here that
+        #building and casting are recorded separately
+        if PROFILER.enabled:
+            o3d_scene.cast_rays(o3d.core.Tensor(np.zeros((1, 6), dtype=np.float32)))
+    
+    return o3d_scene
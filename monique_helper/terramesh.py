@@ -1,16 +1,20 @@
 import open3d as o3d
 import numpy as np
 from osgeo import gdal, osr
-# from pymartini import Martini
 from pydelatin import Delatin
 import os
-from json import dump
+import glob
+import shutil
+import hashlib
+from json import dump, load
 from rich.progress import track
 from rich.progress import Progress
+from monique_helper.instrument import PROFILER
+from monique_helper.rtin import RTIN
 
 gdal.UseExceptions()
  
-def load_geoimg(img_path, nr_bands=3, band_dtype=np.uint8):
+def load_geoimg(img_path, nr_bands=3, band_dtype=np.uint8, window=None):
 
     ds = gdal.Open(img_path)
     
@@ -19,12 +23,20 @@ def load_geoimg(img_path, nr_bands=3, band_dtype=np.uint8):
     
     ds_gt = ds.GetGeoTransform()
     ds_geo = ds.GetProjection()
+    
+    #window (xoff, yoff, xsize, ysize) in pixels; only this part is read and the geotransform is shifted accordingly
+    if window is not None:
+        xoff, yoff, ds_w, ds_h = [int(v) for v in window]
+        ds_gt = (ds_gt[0] + xoff * ds_gt[1] + yoff * ds_gt[2], ds_gt[1], ds_gt[2], 
+                 ds_gt[3] + xoff * ds_gt[4] + yoff * ds_gt[5], ds_gt[4], ds_gt[5])
+    else:
+        xoff, yoff = 0, 0
    
     band_arr = np.zeros((ds_h, ds_w, nr_bands), dtype=band_dtype)
     
     for i in range(nr_bands):
         curr_band = ds.GetRasterBand(i+1)
-        curr_arr = curr_band.ReadAsArray().astype(band_dtype)
+        curr_arr = curr_band.ReadAsArray(xoff, yoff, ds_w, ds_h).astype(band_dtype)
         band_arr[:, :, i] = curr_arr
     
     ds_nd = ds.GetRasterBand(1).GetNoDataValue()
@@ -50,6 +62,54 @@ def px2geo(coords, gt, pixel_shift=True):
     
     return np.hstack((pos_x.reshape(-1, 1), pos_y.reshape(-1, 1)))
 
+def tile_steps(size, tile_size):
+    #start of each tile along one axis; the last entry is the size of the DTM
+    steps = np.arange(0, size, tile_size)
+    if steps[-1] != size:
+        steps = np.append(steps, size)
+    return steps
+
+def mesh_deviation(tile_arr, vertices, triangles, nodata=-1):
+    
+    #maximum deviation of the tile from the triangles (vertices as row/col); triangles with a nodata vertex are
+    #removed later on and pixels with nodata are not part of the terrain; hence, both are ignored; the triangles are
+    #grouped by the size of their bounding box that the pixels within are tested for all triangles of a group at once
+    tri_rc = vertices[triangles].astype(np.int64)
+    tri_z = tile_arr[tri_rc[:, :, 0], tri_rc[:, :, 1]].astype(np.float64)
+    
+    valid = ~np.any(tri_z == nodata, axis=1)
+    tri_rc, tri_z = tri_rc[valid], tri_z[valid]
+    if len(tri_rc) == 0:
+        return 0.
+    
+    min_rc = np.min(tri_rc, axis=1)
+    box_hw = np.max(tri_rc, axis=1) - min_rc + 1
+    uq_boxes, box_ix = np.unique(box_hw, axis=0, return_inverse=True)
+    box_ix = box_ix.ravel()
+    
+    error = 0.
+    for bx, (box_h, box_w) in enumerate(uq_boxes):
+        tix = np.nonzero(box_ix == bx)[0]
+        off_r, off_c = np.meshgrid(np.arange(box_h), np.arange(box_w), indexing="ij")
+        px_r = min_rc[tix, 0:1] + off_r.reshape(1, -1)
+        px_c = min_rc[tix, 1:2] + off_c.reshape(1, -1)
+        
+        (r0, c0), (r1, c1), (r2, c2) = [(tri_rc[tix, vx, 0:1], tri_rc[tix, vx, 1:2]) for vx in range(3)]
+        det = ((r1 - r0) * (c2 - c0) - (r2 - r0) * (c1 - c0)).astype(np.float64)
+        det[det == 0] = np.nan
+        w1 = ((px_r - r0) * (c2 - c0) - (r2 - r0) * (px_c - c0)) / det
+        w2 = ((r1 - r0) * (px_c - c0) - (px_r - r0) * (c1 - c0)) / det
+        
+        z0, z1, z2 = tri_z[tix, 0:1], tri_z[tix, 1:2], tri_z[tix, 2:3]
+        z_px = tile_arr[px_r, px_c]
+        dev = np.abs(z_px - (z0 + w1 * (z1 - z0) + w2 * (z2 - z0)))
+        
+        inside = (w1 >= -1e-9) & (w2 >= -1e-9) & (w1 + w2 <= 1 + 1e-9) & (z_px != nodata)
+        if np.any(inside):
+            error = max(error, float(np.max(dev[inside])))
+    
+    return error
+
 # def mesh_from_array(arr_h, arr_w):
                 
 #     vix = np.arange(arr_h * arr_w).reshape(arr_h, arr_w)
@@ -70,19 +130,33 @@ def px2geo(coords, gt, pixel_shift=True):
     
 #     return faces.astype(np.uint32)
 
+def px_dtype(tile_size):
+    #pixel coordinates within a tile are stored as uint16 if the tile size allows it
+    return np.uint16 if tile_size <= np.iinfo(np.uint16).max + 1 else np.uint32
+
 class MeshTile:
-    def __init__(self, vertices=None, triangles=None, tile_arr=None, tile_gt=None, tile_size=None, bounds_local=None, bounds_geo=None):
+    #only the simplified mesh is kept; the heights of the vertices are sampled from the DTM when the tile is created
+    #as the DTM window is not kept; hence, the memory depends on the size of the mesh and not of the DTM
+    __slots__ = ("vertices", "triangles", "heights", "error", "skirt", "tile_size", "bbox_px", "bbox_geo", "tile_gt", "nr_vertices", "nr_triangles",
+                 "l_vix", "l_tix", "r_vix", "r_tix", "t_vix", "t_tix", "b_vix", "b_tix")
+    
+    def __init__(self, vertices=None, triangles=None, heights=None, error=None, tile_gt=None, tile_size=None, bounds_local=None, bounds_geo=None):
         if vertices is None:
             raise ValueError("Vertices must be provided.")
         if triangles is None:
             raise ValueError("Triangles must be provided.")
-        
-        self.vertices = vertices
-        self.triangles = triangles
+        if heights is None:
+            raise ValueError("Heights must be provided.")
+        
+        self.vertices = np.asarray(vertices).astype(px_dtype(tile_size))
+        self.triangles = np.asarray(triangles).astype(np.uint32)
+        self.heights = np.asarray(heights).astype(np.float32)
+        self.error = error
+        #number of skirt triangles stored after the triangles of the terrain
+        self.skirt = 0
         self.tile_size = tile_size
         self.bbox_px = bounds_local
         self.bbox_geo = bounds_geo
-        self.tile_arr = tile_arr
         self.tile_gt = tile_gt
         
         self.nr_vertices = len(self.vertices)
@@ -96,6 +170,45 @@ class MeshTile:
     def __repr__(self):
         return "MeshTile(vertices=%i, triangles=%i)" % (self.nr_vertices, self.nr_triangles)
     
+    def add_skirt(self, depth, sides=("l", "r", "t", "b")):
+        
+        #vertical strip hanging down by depth from the boundary edges on the given sides of the tile; it covers the
+        #gaps to the neighbouring tiles without snapping; the skirt vertices and triangles are appended
+        max_r = self.bbox_px[3] - self.bbox_px[1] - 1
+        max_c = self.bbox_px[2] - self.bbox_px[0] - 1
+        
+        #edges as oriented in their triangle; boundary edges only belong to a single triangle
+        edges = self.triangles[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2).astype(np.int64)
+        edge_key = np.min(edges, axis=1) * self.nr_vertices + np.max(edges, axis=1)
+        _, edge_inv, edge_cnt = np.unique(edge_key, return_inverse=True, return_counts=True)
+        edges = edges[edge_cnt[edge_inv.ravel()] == 1]
+        
+        edge_coords = self.vertices[edges.ravel()].reshape(-1, 2, 2)
+        on_side = np.zeros(len(edges), dtype=bool)
+        for side, axis, val in (("l", 1, 0), ("r", 1, max_c), ("t", 0, 0), ("b", 0, max_r)):
+            if side in sides:
+                on_side |= (edge_coords[:, 0, axis] == val) & (edge_coords[:, 1, axis] == val)
+        edges = edges[on_side]
+        
+        if len(edges) == 0:
+            return
+        
+        skirt_vix, skirt_inv = np.unique(edges, return_inverse=True)
+        skirt_inv = skirt_inv.reshape(-1, 2) + self.nr_vertices
+        
+        #the edge is reversed that the skirt faces outwards
+        a, b = edges[:, 0], edges[:, 1]
+        a_low, b_low = skirt_inv[:, 0], skirt_inv[:, 1]
+        skirt_tris = np.vstack((np.column_stack((b, a, a_low)), np.column_stack((b, a_low, b_low))))
+        
+        self.vertices = np.vstack((self.vertices, self.vertices[skirt_vix])) 
+        self.heights = np.hstack((self.heights, self.heights[skirt_vix] - depth)).astype(np.float32)
+        self.triangles = np.vstack((self.triangles, skirt_tris.astype(np.uint32)))
+        self.skirt = len(skirt_tris)
+        
+        self.nr_vertices = len(self.vertices)
+        self.nr_triangles = len(self.triangles)
+    
     def extract_boundaries(self):
         
         # bdry_coords = self.vertices.reshape(-1, 2)[bdry_vix, :]
@@ -201,7 +314,8 @@ class MeshTile:
 
 class MeshGrid:
     
-    def __init__(self, path=None, tile_size=256, max_error=1, method="delatin", extent=(None, None, None, None)):
+    def __init__(self, path=None, tile_size=256, max_error=1, method="delatin", extent=(None, None, None, None), update_json=None, shard=None, max_triangles=None, 
+                 seams="snap", skirt_depth=None):
         
         if path is None:
             raise ValueError("Path to the .tif must be provided.")
@@ -211,54 +325,191 @@ class MeshGrid:
         self.path = path
         self.tile_size = tile_size
         self.max_error = max_error
+        #maximum number of triangles of each tile; tiles reaching it are less accurate than max_error
+        self.max_triangles = max_triangles
         self.data = {}
         self.method = method
         
+        #martini (RTIN) subdivides each tile into right triangles; hence, it requires tiles of 2**n+1 pixels
+        if self.method_name() == "martini" and (tile_size < 2 or tile_size & (tile_size - 1) != 0):
+            raise ValueError("--method martini requires a tile size of 2**n pixels.")
+        
         self.extent = extent
         
+        #snap: vertices along the tile boundaries are inserted into both neighbours; skirt: each tile gets a vertical 
+        #skirt along its boundaries instead; hence, the tiles are independent of each other
+        if getattr(seams, "value", seams) not in ("snap", "skirt"):
+            raise ValueError("%s is not a valid seam mode." % (seams))
+        self.seams = getattr(seams, "value", seams)
+        #depth of the skirts; if None, twice the maximum error of the tile
+        self.skirt_depth = skirt_depth
+        
+        #hash of the DTM window of each tile; in update mode (update_json of a previous run) only tiles 
+        #with a different hash are simplified again
+        self.hashes = {}
+        self.changed = None
+        self.prev_meta = None
+        
+        #shard (i, n); only the i-th of n blocks of tile rows is simplified; the shards are combined by from_shards
+        if shard is not None and not 0 <= shard[0] < shard[1]:
+            raise ValueError("Shard %i/%i is not valid." % (shard[0], shard[1]))
+        self.shard = shard
+        self.shard_rows = None
+        self.row_offset = 0
+        
+        if update_json is not None:
+            with open(update_json, "r") as f:
+                self.prev_meta = load(f)
+            self.prev_dir = os.path.dirname(os.path.abspath(update_json))
+            self.prev_tiles = {tile["tid"]:tile for tile in self.prev_meta["tiles"]}
+            self.changed = set()
+        
         self.build()
         
     def build(self):
+        with PROFILER.stage("load") as stage:
+            dgm_arr, dgm_gt = self.load()
+            stage.count(pixels=dgm_arr.size)
+        self.simplify(dgm_arr, dgm_gt)
+    
+    def load(self):
         print("...loading %s." % (self.path))
-        dgm_arr, dgm_gt, dgm_prj_raw, dgm_h, dgm_w, dgm_nd = load_geoimg(self.path, nr_bands=1, band_dtype=np.float32)        
-        dgm_arr[dgm_arr == dgm_nd] = -1
+        
+        ds = gdal.Open(self.path)
+        dgm_gt = ds.GetGeoTransform()
+        dgm_h, dgm_w = ds.RasterYSize, ds.RasterXSize
+        dgm_prj_raw = ds.GetProjection()
+        ds = None
+        
+        #pixel window of the DTM which is tiled
+        min_r, max_r, min_c, max_c = 0, dgm_h, 0, dgm_w
         
         if self.extent[0] is not None:
             extent_arr = geo2px(np.array([[self.extent[0], self.extent[1]], 
                                           [self.extent[2], self.extent[3]]]), dgm_gt)
             
-            minr, minc = extent_arr[0, :]
-            maxr, maxc = extent_arr[1, :]
+            max_r, min_c = extent_arr[0, :]
+            min_r, max_c = extent_arr[1, :]
             
-            dgm_arr = dgm_arr[maxr:minr, minc:maxc]
+            min_r, min_c = max(min_r, 0), max(min_c, 0)
+            max_r, max_c = min(max_r, dgm_h), min(max_c, dgm_w)
             dgm_gt = (self.extent[0], dgm_gt[1], dgm_gt[2], self.extent[3], dgm_gt[4], dgm_gt[5])
-            dgm_h, dgm_w = np.shape(dgm_arr)
+        
+        self.shape = [int(max_r - min_r), int(max_c - min_c)]
+        
+        #a shard only reads the rows of its tiles including the 1px overlap to the next shard
+        read_r0, read_r1 = 0, self.shape[0]
+        if self.shard is not None:
+            r_steps = tile_steps(self.shape[0], self.tile_size)
+            nr_tile_rows = len(r_steps) - 1
+            self.shard_rows = [self.shard[0] * nr_tile_rows // self.shard[1], (self.shard[0]+1) * nr_tile_rows // self.shard[1]]
+            read_r0 = int(r_steps[self.shard_rows[0]])
+            read_r1 = min(int(r_steps[self.shard_rows[1]]) + 1, self.shape[0]) if self.shard_rows[1] > self.shard_rows[0] else read_r0
+            self.row_offset = read_r0
+        
+        if read_r1 > read_r0:
+            dgm_arr, _, _, _, _, dgm_nd = load_geoimg(self.path, nr_bands=1, band_dtype=np.float32, 
+                                                      window=(min_c, min_r + read_r0, self.shape[1], read_r1 - read_r0))
+            dgm_arr = dgm_arr.reshape(read_r1 - read_r0, self.shape[1])
+        else:
+            dgm_arr, dgm_nd = np.zeros((0, self.shape[1]), dtype=np.float32), None
+        
+        #nodata is only replaced by -1 within tiles partially covered by the DTM (see simplify)
+        self.nodata = dgm_nd
+        self.px_offset = [int(min_r), int(min_c)]
         
         dgm_prj = osr.SpatialReference(wkt=dgm_prj_raw)
         dgm_prj.AutoIdentifyEPSG()
         dgm_epsg = dgm_prj.GetAttrValue('AUTHORITY',1)
         self.epsg = dgm_epsg
-            
-        r_steps = np.arange(0, dgm_h, self.tile_size)
-        c_steps = np.arange(0, dgm_w, self.tile_size)
+        self.res = dgm_gt[1]
+        self.origin = [dgm_gt[0], dgm_gt[3]]
         
-        if r_steps[-1] != dgm_h:
-            r_steps = np.append(r_steps, dgm_h)
+        if self.prev_meta is not None:
+            self.check_update()
         
-        if c_steps[-1] != dgm_w:
-            c_steps = np.append(c_steps, dgm_w)
+        return dgm_arr, dgm_gt
+    
+    def method_name(self):
+        return getattr(self.method, "value", self.method)
+    
+    def check_update(self):
+        
+        #tiles can only be reused if the tiling and the simplification are identical
+        prev = self.prev_meta
+        if "empty" not in prev.keys() or any(["hash" not in tile.keys() for tile in prev["tiles"]]):
+            raise ValueError("The previous tiles do not contain hashes. Create them again without update.")
+        
+        for key, val in (("tile_size", self.tile_size), ("max_error", self.max_error), ("max_triangles", self.max_triangles), ("method", self.method_name()),
+                         ("seams", self.seams), ("skirt_depth", self.skirt_depth), ("res", self.res), ("origin", self.origin), ("shape", self.shape)):
+            #tiles created before the seam modes were always snapped
+            prev_val = prev.get(key, "snap" if key == "seams" else None)
+            if prev_val != val:
+                raise ValueError("%s of the DTM or the parameters differs from the previous tiles (%s vs. %s)." % (key, prev_val, val))
+    
+    def empty_tiles(self, r_steps, c_steps, tile_rows):
+        
+        #tiles consisting of blocks which are not stored at all (e.g. sparse GeoTIFFs of clipped national DTMs) are
+        #detected without looking at the pixels; not all drivers support this
+        empty = set()
+        if self.nodata is None:
+            return empty
+        
+        ds = gdal.Open(self.path)
+        band = ds.GetRasterBand(1)
+        
+        for rx in tile_rows:
+            for cx in range(len(c_steps)-1):
+                yoff = self.px_offset[0] + r_steps[rx]
+                xoff = self.px_offset[1] + c_steps[cx]
+                ysize = min(r_steps[rx+1]+1, self.shape[0]) - r_steps[rx]
+                xsize = min(c_steps[cx+1]+1, self.shape[1]) - c_steps[cx]
+                
+                flags, _ = band.GetDataCoverageStatus(int(xoff), int(yoff), int(xsize), int(ysize))
+                if flags == gdal.GDAL_DATA_COVERAGE_STATUS_EMPTY:
+                    empty.add("%i_%i" % (rx, cx))
+        ds = None
+        
+        return empty
+    
+    def classify_tile(self, tile_arr):
+        
+        #empty: only nodata; full: no nodata; partial: nodata is replaced by -1 in a copy of the tile
+        if self.nodata is None:
+            return "full", tile_arr
+        
+        tile_nd = np.isnan(tile_arr) if np.isnan(self.nodata) else tile_arr == self.nodata
+        if not np.any(tile_nd):
+            return "full", tile_arr
+        elif np.all(tile_nd):
+            return "empty", tile_arr
+        return "partial", np.where(tile_nd, np.float32(-1), tile_arr)
+    
+    def simplify(self, dgm_arr, dgm_gt):
+        
+        #the steps are derived from the whole DTM; for shards dgm_arr only contains the rows of the shard
+        dgm_h, dgm_w = self.shape
+        
+        r_steps = tile_steps(dgm_h, self.tile_size)
+        c_steps = tile_steps(dgm_w, self.tile_size)
         
         self.nr_cols = len(c_steps)
         self.nr_rows = len(r_steps)
         
+        tile_rows = range(len(r_steps)-1) if self.shard_rows is None else range(*self.shard_rows)
+        
         #as we extract the dgm with 1 px overlay we adjust the tilesize after we calcutate the splits
         self.tile_size += 1
         
-        with Progress() as progress:
+        unchanged = {}
+        
+        with Progress() as progress, PROFILER.stage("simplify", method=self.method_name()) as stage:
+            
+            empty = self.empty_tiles(r_steps, c_steps, tile_rows)
 
-            task = progress.add_task('...simplifying tiles:', total=(self.nr_cols-1) * (self.nr_rows-1))
+            task = progress.add_task('...simplifying tiles:', total=(self.nr_cols-1) * len(tile_rows))
         
-            for rx in range(len(r_steps)-1):
+            for rx in tile_rows:
                 for cx in range(len(c_steps)-1):
                     
                     min_c = c_steps[cx]
@@ -276,27 +527,43 @@ class MeshGrid:
                     tile_gt = (min_x_geo, dgm_gt[1], dgm_gt[2], max_y_geo, dgm_gt[4], dgm_gt[5])
                     tile_bbox = list(bounds_geo.ravel())
                     
-                    tile_arr = dgm_arr[min_r:max_r, min_c:max_c]
+                    tile_arr = dgm_arr[min_r-self.row_offset:max_r-self.row_offset, min_c:max_c]
                     tile_h, tile_w = np.shape(tile_arr)
                     
-                    tile = Delatin(tile_arr, max_error=self.max_error)
-                    vertices = tile.vertices[:, :2].astype(np.uint32)
-                    triangles = tile.triangles
+                    tid = "%i_%i" % (rx, cx)
+                    tile_class, tile_arr = ("empty", tile_arr) if tid in empty else self.classify_tile(tile_arr)
+                    stage.count(**{"%s_tiles" % (tile_class):1})
+                    
+                    #empty tiles are hashed as if nodata was replaced by -1 
+                    tile_hash_arr = np.full((tile_h, tile_w), -1, dtype=np.float32) if tile_class == "empty" else tile_arr
+                    tile_hash = hashlib.blake2b(np.ascontiguousarray(tile_hash_arr).tobytes(), digest_size=16).hexdigest()
+                    self.hashes[tid] = tile_hash
                     
-                    #vertices are col/row; we further use row/col; hence, np.fliplr
-                    #delatin appaers to interpret row=0 as bottom left corner; Hence, we need 
-                    #invert this that its actually numpy style
-                    vertices = np.fliplr(vertices.reshape(-1, 2))
-                    vertices[:, 0] = tile_h-1-vertices[:, 0]
+                    if self.changed is not None:
+                        prev_tile = self.prev_tiles.get(tid, None)
+                        prev_hash = prev_tile["hash"] if prev_tile is not None else self.prev_meta.get("empty", {}).get(tid, None)
+                        
+                        if prev_hash == tile_hash:
+                            #the tile is read from the previous run in case it must be snapped to a changed neighbour
+                            unchanged[tid] = (tile_gt, [min_c, min_r, max_c, max_r], tile_bbox)
+                            progress.update(task_id=task, advance=1)
+                            continue
+                        
+                        self.changed.add(tid)
+                    
+                    if tile_class == "empty":
+                        progress.update(task_id=task, advance=1)
+                        continue
+                    
+                    with stage.item(tid) as tile_stage:
+                        vertices, triangles, vert_h, tile_error = self.simplify_tile(tile_arr)
                     
-                    triangles = triangles.reshape(-1, 3)
-                                    
-                    vert_h = tile_arr[vertices[:, 0], vertices[:, 1]]                
                     tris_vert_h = vert_h[triangles.ravel()].reshape(-1, 3)
                     
                     valid_tix = np.nonzero(~np.any(tris_vert_h==-1, axis=1))[0]
                     
                     if len(valid_tix) == 0:
+                        progress.update(task_id=task, advance=1)
                         continue
                     
                     valid_tris = triangles[valid_tix, :]
@@ -309,22 +576,201 @@ class MeshGrid:
                     triangles = new_tris_vix[valid_tris_vix_inv].reshape(-1, 3)
                     vertices = vertices[valid_tris_vix, :]               
                     
-                    
                     mesh_tile = MeshTile(vertices=vertices, 
                                         triangles=triangles, 
+                                        heights=vert_h[valid_tris_vix],
+                                        error=tile_error,
                                         tile_size=self.tile_size,
                                         tile_gt=tile_gt,
-                                        tile_arr=tile_arr,
                                         bounds_local=[min_c, min_r, max_c, max_r],
                                         bounds_geo=tile_bbox)
                     
-                    self.data["%i_%i" % (rx, cx)] = mesh_tile
+                    if self.seams == "skirt":
+                        #no skirts along the outer boundary of the DTM
+                        sides = [side for side, outer in (("l", cx == 0), ("r", cx == len(c_steps)-2), ("t", rx == 0), ("b", rx == len(r_steps)-2)) if not outer]
+                        #the gap to a neighbour can not exceed the height range of the tile; hence, the error (which may
+                        #be large with max_triangles) is limited to it
+                        h_range = float(np.ptp(tile_arr[tile_arr != -1]))
+                        skirt_depth = 2 * max(self.max_error, min(tile_error, h_range))
+                        mesh_tile.add_skirt(self.skirt_depth if self.skirt_depth is not None else skirt_depth, sides=sides)
+                    
+                    self.data[tid] = mesh_tile
+                    
+                    tile_stage.count(triangles=len(triangles))
+                    stage.count(tiles=1, triangles=len(triangles))
 
                     progress.update(task_id=task, advance=1)
+        
+        #skirted tiles do not depend on their neighbours
+        if self.changed is not None and self.seams == "snap":
+            self.load_neighbours(unchanged)
+    
+    def simplify_tile(self, tile_arr):
+        
+        #returns the vertices (row/col), triangles, heights of the vertices and the maximum error of the mesh
+        tile_h, tile_w = np.shape(tile_arr)
+        
+        if self.method_name() == "martini":
+            #tiles at the right and bottom border are padded to the full 2**n+1 grid by repeating their last row and
+            #column; the mesh is cut exactly along the border of the tile and the padding is neither returned nor
+            #counted for max_triangles
+            grid_size = max(tile_h, tile_w, 3)
+            grid_size = 2**int(np.ceil(np.log2(grid_size - 1))) + 1
+            grid_arr = np.pad(tile_arr, ((0, grid_size - tile_h), (0, grid_size - tile_w)), mode="edge")
+            
+            rtin = RTIN(grid_arr, extent=(tile_h, tile_w), nodata=-1)
+            vertices, triangles, error = rtin.mesh(self.max_error, max_triangles=self.max_triangles)
+            vertices = vertices.astype(np.uint32)
+            return vertices, triangles, tile_arr[vertices[:, 0], vertices[:, 1]], float(error)
+        
+        tile = Delatin(tile_arr, max_error=self.max_error, max_triangles=self.max_triangles)
+        vertices = tile.vertices[:, :2].astype(np.uint32)
+        triangles = tile.triangles
+        
+        #vertices are col/row; we further use row/col; hence, np.fliplr
+        #delatin appaers to interpret row=0 as bottom left corner; Hence, we need 
+        #invert this that its actually numpy style
+        vertices = np.fliplr(vertices.reshape(-1, 2))
+        vertices[:, 0] = tile_h-1-vertices[:, 0]
+        
+        triangles = triangles.reshape(-1, 3)
+        
+        #the error of delatin includes the deviation from the nodata (-1) of partial tiles; as for martini, only the
+        #triangles kept and the valid pixels are considered
+        error = float(tile.error)
+        if np.any(tile_arr == -1):
+            error = mesh_deviation(tile_arr, vertices, triangles, nodata=-1)
+        return vertices, triangles, tile_arr[vertices[:, 0], vertices[:, 1]], error
+    
+    def load_neighbours(self, unchanged):
+        
+        #unchanged tiles next to a changed one are read from the previous run as their boundaries
+        #must be snapped again; all other unchanged tiles are reused as they are
+        for tid in sorted(self.changed):
+            r, c = [int(x) for x in tid.split("_")]
+            for nr, nc in ((r-1, c), (r+1, c), (r, c-1), (r, c+1)):
+                nb_tid = "%i_%i" % (nr, nc)
+                if nb_tid in self.data.keys() or nb_tid not in unchanged.keys() or nb_tid not in self.prev_tiles.keys():
+                    continue
+                self.data[nb_tid] = self.tile_from_ply(os.path.join(self.prev_dir, "mesh", "%s.ply" % (nb_tid)), *unchanged[nb_tid], 
+                                                   error=self.prev_tiles[nb_tid].get("error", None))
+    
+    def tile_from_ply(self, ply_path, tile_gt, bounds_local, bounds_geo, error=None):
+        
+        #inverse of save_tiles; the vertices are located at the pixel centers of the tile
+        o3d_mesh = o3d.io.read_triangle_mesh(ply_path)
+        verts_geo = np.asarray(o3d_mesh.vertices)
+        
+        cols = np.round((verts_geo[:, 0] - tile_gt[0]) / tile_gt[1])
+        rows = np.round((verts_geo[:, 1] - tile_gt[3]) / tile_gt[5])
+        
+        vertices = np.hstack((rows.reshape(-1, 1), cols.reshape(-1, 1))).astype(np.uint32)
+        triangles = np.asarray(o3d_mesh.triangles).astype(np.uint32)
+        
+        return MeshTile(vertices=vertices, 
+                        triangles=triangles, 
+                        heights=verts_geo[:, 2],
+                        error=error,
+                        tile_size=self.tile_size,
+                        tile_gt=tile_gt,
+                        bounds_local=bounds_local,
+                        bounds_geo=bounds_geo)
+    
+    @classmethod
+    def from_shards(cls, odir, oname):
+        
+        #combines the shards of create-mesh --shard; all tiles are reused apart from the ones along the borders
+        #of the shards which are read from their *.ply and snapped; hence, the DTM is not required
+        shard_paths = glob.glob(os.path.join(odir, "%s_shard*.json" % (oname)))
+        if len(shard_paths) == 0:
+            raise FileNotFoundError("No shards of %s found in %s." % (oname, odir))
+        
+        shards = []
+        for path in shard_paths:
+            with open(path, "r") as f:
+                shards.append(load(f))
+        shards = sorted(shards, key=lambda meta: meta["shard"][0])
+        
+        nr_shards = shards[0]["shard"][1]
+        if [meta["shard"] for meta in shards] != [[i, nr_shards] for i in range(nr_shards)]:
+            raise ValueError("Shards of %s are missing; found %s of %i." % (oname, ", ".join([str(meta["shard"][0]) for meta in shards]), nr_shards))
+        
+        for key in ("epsg", "res", "origin", "shape", "tile_size", "max_error", "max_triangles", "method", "seams", "skirt_depth", "dtm"):
+            if any([meta.get(key, None) != shards[0].get(key, None) for meta in shards]):
+                raise ValueError("%s differs between the shards of %s." % (key, oname))
+        
+        first = shards[0]
+        grid = cls.__new__(cls)
+        grid.path = first["dtm"]
+        grid.tile_size = first["tile_size"] + 1
+        grid.max_error = first["max_error"]
+        grid.max_triangles = first.get("max_triangles", None)
+        grid.method = first["method"]
+        grid.seams = first.get("seams", "snap")
+        grid.skirt_depth = first.get("skirt_depth", None)
+        grid.extent = (None, None, None, None)
+        grid.epsg = first["epsg"]
+        grid.res = first["res"]
+        grid.origin = first["origin"]
+        grid.shape = first["shape"]
+        grid.nr_rows = len(tile_steps(grid.shape[0], first["tile_size"]))
+        grid.nr_cols = len(tile_steps(grid.shape[1], first["tile_size"]))
+        grid.shard = None
+        grid.shard_rows = None
+        grid.row_offset = 0
+        grid.data = {}
+        
+        #the merged shards are handled like a previous run of which only the border tiles changed
+        grid.prev_meta = {"tiles":[tile for meta in shards for tile in meta["tiles"]],
+                          "empty":{tid:tile_hash for meta in shards for tid, tile_hash in meta["empty"].items()}}
+        grid.prev_tiles = {tile["tid"]:tile for tile in grid.prev_meta["tiles"]}
+        grid.prev_dir = odir
+        grid.hashes = dict(grid.prev_meta["empty"])
+        grid.hashes.update({tid:tile["hash"] for tid, tile in grid.prev_tiles.items()})
+        grid.changed = set()
+        
+        #skirted tiles are not snapped; hence, none of them must be read
+        for meta in shards[1:] if grid.seams == "snap" else []:
+            rb = meta["rows"][0]
+            for c in range(grid.nr_cols-1):
+                pair = ["%i_%i" % (rb-1, c), "%i_%i" % (rb, c)]
+                if any([tid not in grid.prev_tiles.keys() for tid in pair]):
+                    continue
+                for tid in pair:
+                    if tid not in grid.data.keys():
+                        grid.data[tid] = grid.tile_from_ply(os.path.join(odir, "mesh", "%s.ply" % (tid)), *grid.tile_bounds(tid), 
+                                                            error=grid.prev_tiles[tid].get("error", None))
+                grid.changed.update(pair)
+        
+        grid.shard_paths = shard_paths
+        return grid
+    
+    def tile_bounds(self, tid):
+        
+        #geotransform and bounds of a tile as used by simplify
+        r, c = [int(x) for x in tid.split("_")]
+        ts = self.tile_size - 1
+        min_r, min_c = r * ts, c * ts
+        max_r, max_c = min(min_r + ts, self.shape[0]) + 1, min(min_c + ts, self.shape[1]) + 1
+        
+        dgm_gt = (self.origin[0], self.res, 0, self.origin[1], 0, -self.res)
+        bounds_geo = px2geo(np.array([[min_r, min_c], [max_r, max_c]]), gt=dgm_gt)
+        tile_gt = (np.min(bounds_geo[:, 0]), self.res, 0, np.max(bounds_geo[:, 1]), 0, -self.res)
+        
+        return tile_gt, [min_c, min_r, max_c, max_r], list(bounds_geo.ravel())
+    
+    def remove_shards(self):
+        for path in self.shard_paths:
+            os.remove(path)
+    
+    def snap_required(self, tid_a, tid_b):
+        #in update mode only seams touching a changed tile are snapped again
+        return self.changed is None or tid_a in self.changed or tid_b in self.changed
 
-    def update_tid(self, tid, new_verts, new_tris, pop_tris):
+    def update_tid(self, tid, new_verts, new_tris, pop_tris, new_heights):
                     
-        self.data[tid].vertices = np.vstack((self.data[tid].vertices, np.array(new_verts)))
+        self.data[tid].vertices = np.vstack((self.data[tid].vertices, np.array(new_verts))).astype(self.data[tid].vertices.dtype)
+        self.data[tid].heights = np.hstack((self.data[tid].heights, new_heights)).astype(np.float32)
     
         upd_triangles = np.delete(self.data[tid].triangles, pop_tris, axis=0)
         self.data[tid].triangles = np.vstack((upd_triangles, np.array(new_tris))).astype(np.uint32)
@@ -334,6 +780,13 @@ class MeshGrid:
         self.data[tid].nr_vertices = np.shape(self.data[tid].vertices)[0]
         self.data[tid].nr_triangles = np.shape(self.data[tid].triangles)[0]
                         
+    def boundary_heights(self, tid, bdry_vix, coords, bix=0):
+        
+        #vertices inserted during snapping exist on the boundary of the neighbouring tile; hence, their heights are
+        #taken from there; bdry_vix is sorted by ascending coordinate along the boundary
+        bdry_coords = self.data[tid].vertices[bdry_vix, bix]
+        return self.data[tid].heights[bdry_vix[np.searchsorted(bdry_coords, coords)]]
+    
     def snap(self, tid, missing_vix_coords, mode=None):
         
         missing_vix_coords = missing_vix_coords.astype(np.uint32)
@@ -365,12 +818,23 @@ class MeshGrid:
         else:
             raise ValueError("%s not supported." % (mode))
         
-        #six is the index where coordinates of next must be inserted into curr to maintain order
-        missing_vix_coords_six = np.searchsorted(bdry_coords[:, bix].ravel(), missing_vix_coords, side="left")-1
-        uq_six, uq_six_inv = np.unique(missing_vix_coords_six, return_inverse=True)
+        #six is the index of the boundary triangle whose boundary edge contains the coordinate; the boundary may have
+        #gaps (nodata); hence, the triangles are matched by the span of their edge and not by the boundary vertices;
+        #coordinates within gaps or beyond the boundary of curr (the other border is longer) are skipped
+        bdry_tris_coords = self.data[tid].vertices[self.data[tid].triangles[bdry_trix, :], :].astype(np.int64)
+        on_bdry = bdry_tris_coords[:, :, not_bix] == bdry_const
+        span_lo = np.min(np.where(on_bdry, bdry_tris_coords[:, :, bix], np.iinfo(np.int64).max), axis=1)
+        span_hi = np.max(np.where(on_bdry, bdry_tris_coords[:, :, bix], -1), axis=1)
         
-        uq_six = uq_six[uq_six < len(bdry_trix)]            #sometimes the other border is longer than the current one; hence, clip those ranges
-        uq_six = uq_six[uq_six >= 0]
+        span_asc = np.argsort(span_hi)
+        bdry_trix, span_lo, span_hi = bdry_trix[span_asc], span_lo[span_asc], span_hi[span_asc]
+        
+        missing_vix_coords_six = np.searchsorted(span_hi, missing_vix_coords, side="left")
+        in_span = missing_vix_coords_six < len(bdry_trix)
+        in_span[in_span] = span_lo[missing_vix_coords_six[in_span]] < missing_vix_coords[in_span]
+        
+        missing_vix_coords = missing_vix_coords[in_span]
+        uq_six, uq_six_inv = np.unique(missing_vix_coords_six[in_span], return_inverse=True)
         
         if len(uq_six) == 0:
             return [], [], []
@@ -443,9 +907,11 @@ class MeshGrid:
         r_new_verts, r_new_tris, r_pop_tris = self.snap(right_tid, right_missing_vix_coords, mode="right")
         
         if len(l_new_verts) > 0:
-            self.update_tid(left_tid, l_new_verts, l_new_tris, l_pop_tris)
+            l_new_heights = self.boundary_heights(right_tid, self.data[right_tid].l_vix, np.array(l_new_verts)[:, 0], bix=0)
+            self.update_tid(left_tid, l_new_verts, l_new_tris, l_pop_tris, l_new_heights)
         if len(r_new_verts) > 0:
-            self.update_tid(right_tid, r_new_verts, r_new_tris, r_pop_tris)
+            r_new_heights = self.boundary_heights(left_tid, self.data[left_tid].r_vix, np.array(r_new_verts)[:, 0], bix=0)
+            self.update_tid(right_tid, r_new_verts, r_new_tris, r_pop_tris, r_new_heights)
     
     def snap_boundaries_top_bottom(self, top_tid, bottom_tid):
                                    
@@ -463,42 +929,48 @@ class MeshGrid:
         b_new_verts, b_new_tris, b_pop_tris = self.snap(bottom_tid, bot_missing_vix_coords, mode="bottom")
         
         if len(t_new_verts) > 0:
-            self.update_tid(top_tid, t_new_verts, t_new_tris, t_pop_tris)
+            t_new_heights = self.boundary_heights(bottom_tid, self.data[bottom_tid].t_vix, np.array(t_new_verts)[:, 1], bix=1)
+            self.update_tid(top_tid, t_new_verts, t_new_tris, t_pop_tris, t_new_heights)
         if len(b_new_verts) > 0:
-            self.update_tid(bottom_tid, b_new_verts, b_new_tris, b_pop_tris)
+            b_new_heights = self.boundary_heights(top_tid, self.data[top_tid].b_vix, np.array(b_new_verts)[:, 1], bix=1)
+            self.update_tid(bottom_tid, b_new_verts, b_new_tris, b_pop_tris, b_new_heights)
     
     def snap_boundaries(self):
+        if self.seams == "skirt":
+            return
+        
         rows = range(0, self.nr_rows-1)
         cols = range(0, self.nr_cols-1)
         
-        for r in rows:
-            for c in cols:
-                curr_tid = "%s_%s" % (r, c)
-                if curr_tid not in self.data.keys():
-                    continue
+        with PROFILER.stage("snapping", tiles=len(self.data)):
+            for r in rows:
+                for c in cols:
+                    curr_tid = "%s_%s" % (r, c)
+                    if curr_tid not in self.data.keys():
+                        continue
                 
-                if c+1 <= cols[-1]:
-                    right_tid = "%s_%s" % (r, c+1)
-                    if right_tid not in self.data.keys():
+                    if c+1 <= cols[-1]:
+                        right_tid = "%s_%s" % (r, c+1)
+                        if right_tid not in self.data.keys():
+                            right_tid = None
+                    else:
                         right_tid = None
-                else:
-                    right_tid = None
-                if r+1 <= rows[-1]:
-                    lower_tid = "%s_%s" % (r+1, c)
-                    if lower_tid not in self.data.keys():
+                    if r+1 <= rows[-1]:
+                        lower_tid = "%s_%s" % (r+1, c)
+                        if lower_tid not in self.data.keys():
+                            lower_tid = None
+                    else:
                         lower_tid = None
-                else:
-                    lower_tid = None
                 
-                if right_tid:
-                    self.snap_boundaries_left_right(left_tid=curr_tid, right_tid=right_tid)
-                if lower_tid:
-                    self.snap_boundaries_top_bottom(top_tid=curr_tid, bottom_tid=lower_tid)
+                    if right_tid and self.snap_required(curr_tid, right_tid):
+                        self.snap_boundaries_left_right(left_tid=curr_tid, right_tid=right_tid)
+                    if lower_tid and self.snap_required(curr_tid, lower_tid):
+                        self.snap_boundaries_top_bottom(top_tid=curr_tid, bottom_tid=lower_tid)
             
     def save_tiles(self, odir, oname, save_json=True):
                
-        if not os.path.exists(odir):
-            os.mkdir(odir)
+        #shards of the same DTM may be saved to odir at the same time
+        os.makedirs(odir, exist_ok=True)
         
         rows = range(0, self.nr_rows-1)
         cols = range(0, self.nr_cols-1)
@@ -516,68 +988,114 @@ class MeshGrid:
         tidi = 0
         
         tile_meta_list = []
+        self.ortho_outdated = []
         
         odir_mesh = os.path.join(odir, "mesh")
-        if not os.path.exists(odir_mesh):
-            os.makedirs(odir_mesh)
+        os.makedirs(odir_mesh, exist_ok=True)
         
-        for r in rows:
-            for c in cols:
+        with PROFILER.stage("save") as stage:
+            for r in rows:
+                for c in cols:
                 
-                tile_meta = {}
+                    tile_meta = {}
             
-                curr_tid = "%s_%s" % (r, c)
+                    curr_tid = "%s_%s" % (r, c)
                 
-                if curr_tid not in self.data.keys():
-                    continue
+                    if curr_tid not in self.data.keys():
+                        if self.changed is not None and curr_tid in self.prev_tiles.keys():
+                            if curr_tid in self.changed:
+                                #tile without any valid triangles after the update
+                                self.remove_tile(odir, curr_tid)
+                                continue
+                            
+                            #unchanged tile of the previous run; neither its mesh nor its orthophoto is written again
+                            tile_meta = dict(self.prev_tiles[curr_tid], tid_int=tidi)
+                            tile_meta_list.append(tile_meta)
+                            
+                            global_min_x = min(global_min_x, tile_meta["min_xyz"][0])
+                            global_min_y = min(global_min_y, tile_meta["min_xyz"][1])
+                            global_min_z = min(global_min_z, tile_meta["min_xyz"][2])
+                            global_max_x = max(global_max_x, tile_meta["max_xyz"][0])
+                            global_max_y = max(global_max_y, tile_meta["max_xyz"][1])
+                            global_max_z = max(global_max_z, tile_meta["max_xyz"][2])
+                            
+                            tidi += 1
+                        continue
                 
-                tile_meta["tid"] = curr_tid
-                tile_meta["tid_int"] = tidi
+                    tile_meta["tid"] = curr_tid
+                    tile_meta["tid_int"] = tidi
+                    tile_meta["hash"] = self.hashes[curr_tid]
+                    
+                    #maximum error of the simplified tile; with max_triangles it may exceed max_error
+                    if self.data[curr_tid].error is not None:
+                        tile_meta["error"] = round(self.data[curr_tid].error, 3)
+                    #the last triangles of the *.ply are the skirt; they are ignored by ray casting and export-mesh
+                    if self.data[curr_tid].skirt > 0:
+                        tile_meta["skirt"] = self.data[curr_tid].skirt
                 
-                opath = os.path.join(odir_mesh, "%s.ply" % (curr_tid))
+                    opath = os.path.join(odir_mesh, "%s.ply" % (curr_tid))
                 
-                curr_tile = self.data[curr_tid]
+                    curr_tile = self.data[curr_tid]
                 
-                verts = curr_tile.vertices                        
-                verts_h = curr_tile.tile_arr[verts[:, 0], verts[:, 1]]
-                #tile_gt already contains the pixel shift towards the center; Hence, we don't add it again
-                verts_geo = np.hstack((px2geo(verts, curr_tile.tile_gt, pixel_shift=False), verts_h.reshape(-1, 1)))
+                    verts = curr_tile.vertices                        
+                    verts_h = curr_tile.heights
+                    #tile_gt already contains the pixel shift towards the center; Hence, we don't add it again
+                    verts_geo = np.hstack((px2geo(verts, curr_tile.tile_gt, pixel_shift=False), verts_h.reshape(-1, 1)))
+                    
+                    #the extent only contains the terrain; the skirt vertices hang below it
+                    tris = curr_tile.triangles
+                    terrain_geo = verts_geo
+                    if curr_tile.skirt > 0:
+                        terrain_geo = verts_geo[np.unique(tris[:len(tris)-curr_tile.skirt])]
                 
-                min_xyz = np.min(verts_geo, axis=0)
-                max_xyz = np.max(verts_geo, axis=0)
-                cx_xyz = ((min_xyz + max_xyz)/2.)
-                cx_rad = np.max(np.sqrt(np.sum((verts_geo[:, :2]-cx_xyz[:2])**2,axis=1)))
+                    min_xyz = np.min(terrain_geo, axis=0)
+                    max_xyz = np.max(terrain_geo, axis=0)
+                    cx_xyz = ((min_xyz + max_xyz)/2.)
+                    cx_rad = np.max(np.sqrt(np.sum((terrain_geo[:, :2]-cx_xyz[:2])**2,axis=1)))
                 
-                if min_xyz[0] < global_min_x:
-                    global_min_x = min_xyz[0]
-                if min_xyz[1] < global_min_y:
-                    global_min_y = min_xyz[1]
-                if min_xyz[2] < global_min_z:
-                    global_min_z = min_xyz[2]
+                    if min_xyz[0] < global_min_x:
+                        global_min_x = min_xyz[0]
+                    if min_xyz[1] < global_min_y:
+                        global_min_y = min_xyz[1]
+                    if min_xyz[2] < global_min_z:
+                        global_min_z = min_xyz[2]
                 
-                if max_xyz[0] > global_max_x:
-                    global_max_x = max_xyz[0]
-                if max_xyz[1] > global_max_y:
-                    global_max_y = max_xyz[1]
-                if max_xyz[2] > global_max_z:
-                    global_max_z = max_xyz[2]
+                    if max_xyz[0] > global_max_x:
+                        global_max_x = max_xyz[0]
+                    if max_xyz[1] > global_max_y:
+                        global_max_y = max_xyz[1]
+                    if max_xyz[2] > global_max_z:
+                        global_max_z = max_xyz[2]
                                 
-                tile_meta["min_xyz"] = np.round(min_xyz, 3).ravel().tolist()
-                tile_meta["max_xyz"] = np.round(max_xyz, 3).ravel().tolist()
-                tile_meta["cx_r"] = np.round(cx_xyz, 3).ravel().tolist() + [np.round(cx_rad, 1)]
-                tile_meta_list.append(tile_meta)
-                
-                tris = curr_tile.triangles
-
-                o3d_mesh = o3d.geometry.TriangleMesh(vertices=o3d.utility.Vector3dVector(verts_geo),
-                                                     triangles=o3d.utility.Vector3iVector(tris))
-                o3d_mesh.remove_duplicated_vertices()
-                
-                o3d.io.write_triangle_mesh(opath, o3d_mesh)
-
-                tidi += 1
+                    tile_meta["min_xyz"] = np.round(min_xyz, 3).ravel().tolist()
+                    tile_meta["max_xyz"] = np.round(max_xyz, 3).ravel().tolist()
+                    tile_meta["cx_r"] = np.round(cx_xyz, 3).ravel().tolist() + [np.round(cx_rad, 1)]
+                    tile_meta_list.append(tile_meta)
+                    
+                    with stage.item(curr_tid, triangles=len(tris)):
+                        o3d_mesh = o3d.geometry.TriangleMesh(vertices=o3d.utility.Vector3dVector(verts_geo),
+                                                             triangles=o3d.utility.Vector3iVector(tris))
+                        o3d_mesh.remove_duplicated_vertices()
+                        
+                        o3d.io.write_triangle_mesh(opath, o3d_mesh)
+                    
+                    stage.count(tiles=1, triangles=len(tris))
+                    tidi += 1
+                    
+                    if self.changed is not None:
+                        self.check_ortho(odir, tile_meta)
                 
         meta["epsg"] = self.epsg
+        meta["res"] = self.res
+        meta["dtm"] = os.path.abspath(self.path)
+        meta["origin"] = self.origin
+        meta["shape"] = self.shape
+        meta["tile_size"] = self.tile_size - 1
+        meta["max_error"] = self.max_error
+        meta["max_triangles"] = self.max_triangles
+        meta["method"] = self.method_name()
+        meta["seams"] = self.seams
+        meta["skirt_depth"] = self.skirt_depth
         meta["min_xyz"] = [round(global_min_x, 3), round(global_min_y, 3), round(global_min_z, 3)]
         meta["max_xyz"] = [round(global_max_x, 3), round(global_max_y, 3), round(global_max_z, 3)]
         meta["cx"] = [round((global_min_x + global_max_x)/2., 3),
@@ -586,46 +1104,165 @@ class MeshGrid:
         
         meta["tiles"] = tile_meta_list
         
+        #hashes of tiles without any valid triangles; required to detect if they changed in an update
+        saved_tids = set([tile["tid"] for tile in tile_meta_list])
+        meta["empty"] = {tid:tile_hash for tid, tile_hash in self.hashes.items() if tid not in saved_tids}
+        
+        #the json of a shard is only an intermediate result which is combined by merge-mesh
+        json_name = "%s.json" % (oname)
+        if self.shard is not None:
+            meta["shard"] = list(self.shard)
+            meta["rows"] = self.shard_rows
+            json_name = "%s_shard%i.json" % (oname, self.shard[0])
+        
         if save_json:
-            with open(os.path.join(odir, "%s.json" % (oname)), 'w') as f:
+            with open(os.path.join(odir, json_name), 'w') as f:
                 dump(meta, f, indent=4)
         
-    def merge_tiles(self, opath):
+    def remove_tile(self, odir, tid):
+        for path in [os.path.join(odir, "mesh", "%s.ply" % (tid))] + glob.glob(os.path.join(odir, "op", "%s.*" % (tid))):
+            os.remove(path)
+    
+    def check_ortho(self, odir, tile_meta):
         
-        out_verts = None
-        out_tris = None
+        #orthophoto tiles are cut to the extent of the mesh tile; hence, only if the extent changed they 
+        #must be created again (add-ortho --missing)
+        prev_tile = self.prev_tiles.get(tile_meta["tid"], None)
+        if prev_tile is not None and prev_tile["min_xyz"][:2] == tile_meta["min_xyz"][:2] and prev_tile["max_xyz"][:2] == tile_meta["max_xyz"][:2]:
+            return
         
-        rows = range(0, self.nr_rows-1)
-        cols = range(0, self.nr_cols-1)
+        for path in glob.glob(os.path.join(odir, "op", "%s.*" % (tile_meta["tid"]))):
+            os.remove(path)
+        self.ortho_outdated.append(tile_meta["tid"])
+    
+    def iter_tiles(self):
         
-        for r in rows:
-            for c in cols:
+        #tiles in row-major order as (tid, global pixel coordinates, xyz, triangles)
+        for r in range(0, self.nr_rows-1):
+            for c in range(0, self.nr_cols-1):
                 curr_tid = "%s_%s" % (r, c)
-                
                 if curr_tid not in self.data.keys():
                     continue
                 
                 curr_tile = self.data[curr_tid]
                 
-                verts = curr_tile.vertices                        
-                verts_h = curr_tile.tile_arr[verts[:, 0], verts[:, 1]]
+                verts = curr_tile.vertices
+                verts_h = curr_tile.heights
                 #tile_gt already contains the pixel shift towards the center; Hence, we don't add it again
                 verts_geo = np.hstack((px2geo(verts, curr_tile.tile_gt, pixel_shift=False), verts_h.reshape(-1, 1)))
+                verts_px = verts.astype(np.int64) + np.array([curr_tile.bbox_px[1], curr_tile.bbox_px[0]])
                 
-                tris = curr_tile.triangles
-                
-                if out_verts is None:
-                    out_verts = verts_geo
-                    out_tris = tris
-                else:
-                    
-                    tris += int(np.shape(out_verts)[0])
-                    
-                    out_verts = np.vstack((out_verts, verts_geo))
-                    out_tris = np.vstack((out_tris, tris))
+                yield (curr_tid, ) + remove_skirt(verts_px, verts_geo, curr_tile.triangles, curr_tile.skirt)
+    
+    def merge_tiles(self, opath):
+        return merge_tiles(opath, self.iter_tiles(), self.tile_size - 1)
+
+def iter_ply_tiles(tiles_data):
+    
+    #saved tiles of a tiles json as (tid, global pixel coordinates, xyz, triangles); the vertices are located
+    #at the pixel centers of the DTM
+    if "origin" not in tiles_data.keys():
+        raise ValueError("The tiles do not contain the origin of the DTM. Create them again.")
+    
+    origin = tiles_data["origin"]
+    res = tiles_data["res"]
+    
+    for tile in tiles_data["tiles"]:
+        o3d_mesh = o3d.io.read_triangle_mesh(os.path.join(tiles_data["tile_dir"], "%s.ply" % (tile["tid"])))
+        verts_geo = np.asarray(o3d_mesh.vertices)
         
-        o3d_mesh = o3d.geometry.TriangleMesh(vertices=o3d.utility.Vector3dVector(out_verts),
-                                             triangles=o3d.utility.Vector3iVector(out_tris))
-        o3d_mesh.remove_duplicated_vertices()
+        cols = np.round((verts_geo[:, 0] - origin[0]) / res - 0.5)
+        rows = np.round((origin[1] - verts_geo[:, 1]) / res - 0.5)
+        verts_px = np.hstack((rows.reshape(-1, 1), cols.reshape(-1, 1))).astype(np.int64)
         
-        o3d.io.write_triangle_mesh(opath, o3d_mesh)
\ No newline at end of file
+        yield (tile["tid"], ) + remove_skirt(verts_px, verts_geo, np.asarray(o3d_mesh.triangles), tile.get("skirt", 0))
+
+PLY_FACE = np.dtype([("n", "u1"), ("vix", "<i4", (3, ))])
+
+def remove_skirt(verts_px, verts_geo, tris, skirt):
+    
+    #skirt triangles are stored after the triangles of the terrain; their vertices are not used by the terrain
+    if skirt == 0:
+        return verts_px, verts_geo, tris
+    
+    vix, tris = np.unique(tris[:len(tris)-skirt], return_inverse=True)
+    return verts_px[vix], verts_geo[vix], tris.reshape(-1, 3)
+
+def merge_tiles(opath, tiles, tile_size):
+    
+    #merges the tiles (tid, global pixel coordinates, xyz, triangles in row-major order) into a single binary *.ply;
+    #vertices shared by neighbouring tiles lie on the tile boundaries, i.e. on multiples of tile_size, and are welded
+    #by their global pixel coordinate; only the boundary vertices of the previous and the current row of tiles are kept
+    #in memory; vertices and faces are streamed to temporary files as the header requires the final counts
+    seam_prev = {}
+    seam_curr = {}
+    curr_row = None
+    
+    nr_verts = 0
+    nr_tris = 0
+    
+    verts_path = opath + ".verts.tmp"
+    tris_path = opath + ".tris.tmp"
+    
+    with PROFILER.stage("merge") as stage:
+        try:
+            with open(verts_path, "wb") as f_verts, open(tris_path, "wb") as f_tris:
+                for tid, verts_px, verts_geo, tris in tiles:
+                    
+                    row = int(tid.split("_")[0])
+                    if row != curr_row:
+                        #only the boundary vertices of the bottom edge are shared with the next row
+                        if curr_row is not None:
+                            seam_prev = {key:vix for key, vix in seam_curr.items() if key[0] == row * tile_size}
+                        seam_curr = {}
+                        curr_row = row
+                    
+                    vix = np.empty(len(verts_px), dtype=np.int64)
+                    is_new = np.ones(len(verts_px), dtype=bool)
+                    
+                    bdry = np.nonzero((verts_px[:, 0] % tile_size == 0) | (verts_px[:, 1] % tile_size == 0))[0]
+                    for bx, key in zip(bdry.tolist(), map(tuple, verts_px[bdry, :].tolist())):
+                        prev_vix = seam_prev.get(key, seam_curr.get(key, None))
+                        if prev_vix is not None:
+                            vix[bx] = prev_vix
+                            is_new[bx] = False
+                    
+                    new_ix = np.nonzero(is_new)[0]
+                    vix[new_ix] = np.arange(nr_verts, nr_verts + len(new_ix))
+                    for bx in bdry[is_new[bdry]].tolist():
+                        seam_curr[tuple(verts_px[bx, :].tolist())] = int(vix[bx])
+                    
+                    f_verts.write(np.ascontiguousarray(verts_geo[new_ix, :], dtype="<f8").tobytes())
+                    
+                    faces = np.empty(len(tris), dtype=PLY_FACE)
+                    faces["n"] = 3
+                    faces["vix"] = vix[np.asarray(tris).reshape(-1, 3)]
+                    f_tris.write(faces.tobytes())
+                    
+                    nr_verts += len(new_ix)
+                    nr_tris += len(tris)
+                    stage.count(tiles=1, triangles=len(tris))
+            
+            header = ("ply\n"
+                      "format binary_little_endian 1.0\n"
+                      "element vertex %i\n"
+                      "property double x\n"
+                      "property double y\n"
+                      "property double z\n"
+                      "element face %i\n"
+                      "property list uchar int vertex_indices\n"
+                      "end_header\n") % (nr_verts, nr_tris)
+            
+            with open(opath, "wb") as f_out:
+                f_out.write(header.encode("ascii"))
+                for path in (verts_path, tris_path):
+                    with open(path, "rb") as f_in:
+                        shutil.copyfileobj(f_in, f_out)
+        finally:
+            for path in (verts_path, tris_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        
+        stage.count(vertices=nr_verts)
+    
+    return nr_verts, nr_tris
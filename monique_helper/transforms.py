@@ -1,28 +1,78 @@
 import numpy as np
 
 def alzeka2rot(euler):
-    
-    al = euler[0]
-    ze = euler[1]
-    ka = euler[2]
-    
-    R = np.empty((3, 3))
-
-    R[0,0] = np.cos(al) * np.cos(ze) * np.cos(ka) - np.sin(al) * np.sin(ka)
-    R[0,1] = -np.cos(al) * np.cos(ze) * np.sin(ka) - np.sin(al) * np.cos(ka)
-    R[0,2] = np.cos(al) * np.sin(ze)
-    R[1,0] = np.sin(al) * np.cos(ze) * np.cos(ka) + np.cos(al) * np.sin(ka)
-    R[1,1] = -np.sin(al) * np.cos(ze) * np.sin(ka) + np.cos(al) * np.cos(ka)
-    R[1,2] = np.sin(al) * np.sin(ze)
-    R[2,0] = -np.sin(ze) * np.cos(ka)
-    R[2,1] = np.sin(ze) * np.sin(ka)
-    R[2,2] = np.cos(ze)
-    
+
+    #euler can be a single (3, ) or a stack (..., 3) of angles; returns (3, 3) or (..., 3, 3)
+    euler = np.asarray(euler, dtype=np.float64)
+
+    al = euler[..., 0]
+    ze = euler[..., 1]
+    ka = euler[..., 2]
+
+    cos_al, sin_al = np.cos(al), np.sin(al)
+    cos_ze, sin_ze = np.cos(ze), np.sin(ze)
+    cos_ka, sin_ka = np.cos(ka), np.sin(ka)
+
+    R = np.empty(np.shape(al) + (3, 3))
+
+    R[..., 0,0] = cos_al * cos_ze * cos_ka - sin_al * sin_ka
+    R[..., 0,1] = -cos_al * cos_ze * sin_ka - sin_al * cos_ka
+    R[..., 0,2] = cos_al * sin_ze
+    R[..., 1,0] = sin_al * cos_ze * cos_ka + cos_al * sin_ka
+    R[..., 1,1] = -sin_al * cos_ze * sin_ka + cos_al * cos_ka
+    R[..., 1,2] = sin_al * sin_ze
+    R[..., 2,0] = -sin_ze * cos_ka
+    R[..., 2,1] = sin_ze * sin_ka
+    R[..., 2,2] = cos_ze
+
     return R
 
 def R_ori2cv(R):
     rx_200 = np.diag((1, -1, -1))
-    return rx_200 @ np.transpose(R)
+    return rx_200 @ np.swapaxes(R, -1, -2)
 
 def alpha2azi(alpha):
-    return np.deg2rad((450 - np.rad2deg(alpha)) % 360)
\ No newline at end of file
+    return np.deg2rad((450 - np.rad2deg(alpha)) % 360)
+
+def stack_cameras(cams):
+
+    #stacks the parameters of several cameras (dicts as stored in the gpkg) for the batch functions below
+    prc = np.array([[c["obj_x0"], c["obj_y0"], c["obj_z0"]] for c in cams], dtype=np.float64).reshape(-1, 3)
+    euler = np.array([[c["alpha"], c["zeta"], c["kappa"]] for c in cams], dtype=np.float64).reshape(-1, 3)
+    ior = np.array([[c["img_x0"], c["img_y0"], c["f"]] for c in cams], dtype=np.float64).reshape(-1, 3)
+
+    return prc, alzeka2rot(euler), ior
+
+def img2ray(img_xy, rmat, ior):
+
+    #image coordinates have their origin in the upper left corner with the y-axis pointing upwards (i.e. rows are negative);
+    #all inputs are broadcasted: img_xy (..., 2), rmat (..., 3, 3), ior (..., 3) with img_x0, img_y0, f;
+    #returns unit direction vectors (..., 3) in the object coordinate system
+    img_xy = np.asarray(img_xy, dtype=np.float64)
+    ior = np.asarray(ior, dtype=np.float64)
+
+    img_x = img_xy[..., 0] - ior[..., 0]
+    img_y = img_xy[..., 1] - ior[..., 1]
+    img_z = np.broadcast_to(-ior[..., 2], np.shape(img_x))
+
+    dir_cam = np.stack(np.broadcast_arrays(img_x, img_y, img_z), axis=-1)
+    dir_obj = np.einsum("...ij,...j->...i", rmat, dir_cam)
+
+    return dir_obj / np.linalg.norm(dir_obj, axis=-1, keepdims=True)
+
+def obj2img(obj_xyz, prc, rmat, ior):
+
+    #collinearity equations; all inputs are broadcasted: obj_xyz (..., 3), prc (..., 3), rmat (..., 3, 3), ior (..., 3);
+    #e.g. N points into M cameras with obj_xyz[None, :, :], prc[:, None, :], rmat[:, None, :, :], ior[:, None, :];
+    #returns image coordinates (..., 2) and a mask (...) of points located in front of the camera
+    obj_xyz = np.asarray(obj_xyz, dtype=np.float64)
+    prc = np.asarray(prc, dtype=np.float64)
+    ior = np.asarray(ior, dtype=np.float64)
+
+    obj_cam = np.einsum("...ji,...j->...i", rmat, obj_xyz - prc)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        img_x = ior[..., 0] - ior[..., 2] * obj_cam[..., 0] / obj_cam[..., 2]
+        img_y = ior[..., 1] - ior[..., 2] * obj_cam[..., 1] / obj_cam[..., 2]
+
+    return np.stack((img_x, img_y), axis=-1), obj_cam[..., 2] < 0
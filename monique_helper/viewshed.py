@@ -0,0 +1,178 @@
+import os
+import numpy as np
+from osgeo import gdal, osr
+from rich.progress import Progress
+from monique_helper.transforms import stack_cameras, obj2img
+from monique_helper.instrument import PROFILER
+
+VIS_ND = 255
+COV_ND = 65535
+
+def viewshed_grid(tiles_data, res):
+
+    #cells are centered on the vertices of the mesh, i.e. on the pixel centers of the original DTM;
+    #hence, with the resolution of the DTM the output is aligned with the tiles
+    min_xyz = np.array(tiles_data["min_xyz"])
+    max_xyz = np.array(tiles_data["max_xyz"])
+
+    grid_w = int(np.round((max_xyz[0] - min_xyz[0]) / res)) + 1
+    grid_h = int(np.round((max_xyz[1] - min_xyz[1]) / res)) + 1
+    grid_gt = (min_xyz[0] - res/2., res, 0, max_xyz[1] + res/2., 0, -res)
+
+    return grid_gt, grid_h, grid_w
+
+def terrain_heights(raycaster, xy_local, z_top):
+
+    #vertical rays from above the terrain; cells without mesh are NaN
+    rays = np.zeros((len(xy_local), 6))
+    rays[:, :2] = xy_local
+    rays[:, 2] = z_top
+    rays[:, 5] = -1
+
+    t_hit = raycaster.cast(rays)
+    return z_top - t_hit.astype(np.float64)
+
+def terrain_normals(cell_z, res):
+
+    #unit normals of the terrain at the cells (rows, cols) from the central differences of the heights; the rows
+    #point towards -y; cells next to missing terrain have no normal (NaN)
+    dz_dx = np.gradient(cell_z, res, axis=1) if np.shape(cell_z)[1] > 1 else np.zeros_like(cell_z)
+    dz_dy = -np.gradient(cell_z, res, axis=0) if np.shape(cell_z)[0] > 1 else np.zeros_like(cell_z)
+
+    normals = np.dstack((-dz_dx, -dz_dy, np.ones_like(cell_z))).reshape(-1, 3)
+    return normals / np.linalg.norm(normals, axis=1).reshape(-1, 1)
+
+def visible_cells(raycaster, cell_xyz_local, prc_local, rmat, ior, img_w, img_h, tol=1, normals=None, min_cos=0.2):
+
+    #only cells projecting into the image are cast; a cell is visible if the first intersection along the ray
+    #from the projection center is (within tol) the cell itself; with the normals of the terrain tol is scaled by
+    #1/cos of the angle of incidence (at most 1/min_cos) as a grazing ray crosses the cell over a longer distance
+    img_xy, in_front = obj2img(cell_xyz_local, prc_local, rmat, ior)
+
+    in_img = in_front & (img_xy[:, 0] >= 0) & (img_xy[:, 0] <= img_w) & (img_xy[:, 1] <= 0) & (img_xy[:, 1] >= -img_h)
+    in_img &= np.isfinite(cell_xyz_local[:, 2])
+
+    vis = np.zeros(len(cell_xyz_local), dtype=bool)
+
+    cix = np.nonzero(in_img)[0]
+    if len(cix) == 0:
+        return vis
+
+    dirs = cell_xyz_local[cix, :] - prc_local
+    dist = np.linalg.norm(dirs, axis=1)
+    dirs /= dist.reshape(-1, 1)
+
+    if normals is not None:
+        cos = np.abs(np.sum(dirs * normals[cix, :], axis=1))
+        tol = tol / np.maximum(np.nan_to_num(cos, nan=1.), min_cos)
+
+    rays = np.hstack((np.broadcast_to(prc_local, np.shape(dirs)), dirs))
+    t_hit = raycaster.cast(rays)
+
+    #rays without any intersection (t_hit = inf) can not see the cell itself either; hence, they are not visible
+    vis[cix] = np.isfinite(t_hit) & (t_hit >= (dist - tol))
+    return vis
+
+def _create_raster(path, grid_gt, grid_h, grid_w, epsg, gdal_type, nd, compress=True):
+    driver = gdal.GetDriverByName("GTiff")
+    options = ["TILED=YES", "BIGTIFF=IF_SAFER"] + (["COMPRESS=DEFLATE"] if compress else [])
+    ds = driver.Create(path, grid_w, grid_h, 1, gdal_type, options=options)
+    ds.SetGeoTransform(grid_gt)
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(int(epsg))
+    ds.SetProjection(srs.ExportToWkt())
+
+    ds.GetRasterBand(1).SetNoDataValue(nd)
+    return ds
+
+def compute_viewsheds(raycaster, tiles_data, cam_dict, out_dir, res=1, per_camera=True, coverage=False, tol=None, chunk_size=2**22,
+                      max_open=64):
+
+    #the grid is processed in chunks of complete rows; hence, memory only depends on chunk_size and not the extent;
+    #the cameras are processed in groups of max_open cameras that only as many rasters are open at once (the heights
+    #of the terrain are cast again for each group)
+    #a ray reaches the footprint of the cell half a cell before its center (scaled by the angle of incidence)
+    if tol is None:
+        tol = res / 2.
+
+    min_xyz = np.array(tiles_data["min_xyz"])
+    max_xyz = np.array(tiles_data["max_xyz"])
+    z_top = max_xyz[2] - min_xyz[2] + 100
+
+    grid_gt, grid_h, grid_w = viewshed_grid(tiles_data, res)
+    chunk_rows = max(1, chunk_size // grid_w)
+
+    cam_ids = list(cam_dict.keys())
+    prc, rmat, ior = stack_cameras([cam_dict[cid] for cid in cam_ids])
+    prc_local = prc - min_xyz
+
+    #the counts are added up over the groups in an uncompressed raster (blocks of compressed rasters can not be
+    #rewritten in place) which is compressed at the end
+    if coverage:
+        cov_path = os.path.join(out_dir, "coverage.tif")
+        cov_tmp_path = os.path.join(out_dir, "coverage.tmp.tif")
+        cov_ds = _create_raster(cov_tmp_path, grid_gt, grid_h, grid_w, tiles_data["epsg"], gdal.GDT_UInt16, COV_ND, compress=False)
+
+    cols_local = grid_gt[0] + (np.arange(grid_w) + 0.5) * res - min_xyz[0]
+    groups = [list(range(g0, min(g0 + max_open, len(cam_ids)))) for g0 in range(0, len(cam_ids), max_open)]
+
+    with Progress() as progress, PROFILER.stage("viewshed", cameras=len(cam_ids)) as stage:
+        task = progress.add_task("...computing viewsheds.", total=grid_h * len(groups))
+
+        for gx, group in enumerate(groups):
+            vis_ds = {}
+            if per_camera:
+                for cx in group:
+                    vis_ds[cx] = _create_raster(os.path.join(out_dir, "%s_viewshed.tif" % (cam_ids[cx])), grid_gt, grid_h, grid_w,
+                                                tiles_data["epsg"], gdal.GDT_Byte, VIS_ND)
+
+            for r0 in range(0, grid_h, chunk_rows):
+                r1 = min(r0 + chunk_rows, grid_h)
+
+                rows_local = grid_gt[3] - (np.arange(r0, r1) + 0.5) * res - min_xyz[1]
+                cell_x, cell_y = np.meshgrid(cols_local, rows_local)
+
+                cell_xyz = np.zeros((cell_x.size, 3))
+                cell_xyz[:, 0] = cell_x.ravel()
+                cell_xyz[:, 1] = cell_y.ravel()
+                cell_xyz[:, 2] = terrain_heights(raycaster, cell_xyz[:, :2], z_top)
+
+                no_terrain = ~np.isfinite(cell_xyz[:, 2])
+                normals = terrain_normals(cell_xyz[:, 2].reshape(r1-r0, grid_w), res)
+
+                if coverage:
+                    cov_chunk = np.zeros(len(cell_xyz), dtype=np.uint16)
+                    if gx > 0:
+                        cov_chunk = cov_ds.GetRasterBand(1).ReadAsArray(0, r0, grid_w, r1-r0).ravel()
+
+                for cx in group:
+                    cid = cam_ids[cx]
+                    vis = visible_cells(raycaster, cell_xyz, prc_local[cx, :], rmat[cx, :, :], ior[cx, :],
+                                        cam_dict[cid]["img_w"], cam_dict[cid]["img_h"], tol=tol, normals=normals)
+
+                    if per_camera:
+                        vis_chunk = vis.astype(np.uint8)
+                        vis_chunk[no_terrain] = VIS_ND
+                        vis_ds[cx].GetRasterBand(1).WriteArray(vis_chunk.reshape(r1-r0, grid_w), 0, r0)
+
+                    if coverage:
+                        cov_chunk[~no_terrain] += vis[~no_terrain]
+
+                if coverage:
+                    cov_chunk[no_terrain] = COV_ND
+                    cov_ds.GetRasterBand(1).WriteArray(cov_chunk.reshape(r1-r0, grid_w), 0, r0)
+
+                stage.count(cells=len(cell_xyz))
+                progress.update(task, advance=r1-r0)
+
+            #the rasters are closed before the next group is opened
+            for cx in group:
+                if cx in vis_ds:
+                    vis_ds.pop(cx).FlushCache()
+
+    if coverage:
+        cov_ds.FlushCache()
+        cov_ds = None
+        gdal.Translate(cov_path, cov_tmp_path, creationOptions=["COMPRESS=DEFLATE", "TILED=YES", "BIGTIFF=IF_SAFER"])
+        os.remove(cov_tmp_path)